@@ -12,7 +12,7 @@ LX_DEPENDENCIES = []
 #pylint:disable=E1101
 
 #from migen import *
-from migen import Module, Signal, Instance, ClockDomain, If
+from migen import Module, Signal, Instance, ClockDomain, If, Memory
 from migen.genlib.resetsync import AsyncResetSynchronizer
 from migen.fhdl.specials import TSTriple
 from migen.fhdl.bitcontainer import bits_for
@@ -32,7 +32,15 @@ from valentyusb.usbcore.cpu import dummyusb, eptri, epfifo
 from valentyusb.usbcore.endpoint import EndpointType
 
 import argparse
+import csv
+import hashlib
 import os
+import shutil
+import tempfile
+
+import litex
+import migen
+import valentyusb
 
 _io = [
     # Wishbone
@@ -64,6 +72,13 @@ _io = [
 
 _connectors = []
 
+# Generated outputs, by a hash of everything that goes into them.
+GATEWARE_CACHE_DIR = os.environ.get(
+    "VALENTYUSB_GATEWARE_CACHE",
+    os.path.join(
+        os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+        "valentyusb", "gateware"))
+
 class _CRG(Module):
     def __init__(self, platform):
         clk = platform.request("clk")
@@ -133,7 +148,8 @@ class BaseSoC(SoCCore):
     }
     interrupt_map.update(SoCCore.interrupt_map)
 
-    def __init__(self, platform, output_dir="build", usb_variant='dummy', **kwargs):
+    def __init__(self, platform, output_dir="build", usb_variant='dummy',
+                 debug=True, burst=False, cdc=False, wide=False, **kwargs):
         # Disable integrated RAM as we'll add it later
         self.integrated_sram_size = 0
 
@@ -155,14 +171,15 @@ class BaseSoC(SoCCore):
         usb_iobuf = usbio.IoBuf(usb_pads.d_p, usb_pads.d_n, usb_pads.pullup)
         self.comb += usb_pads.tx_en.eq(usb_iobuf.usb_tx_en)
         if usb_variant == 'eptri':
-            self.submodules.usb = eptri.TriEndpointInterface(usb_iobuf, debug=True)
+            self.submodules.usb = eptri.TriEndpointInterface(usb_iobuf, debug=debug, burst=burst, cdc=cdc, wide=wide)
         elif usb_variant == 'epfifo':
-            self.submodules.usb = epfifo.PerEndpointFifoInterface(usb_iobuf, debug=True)
+            self.submodules.usb = epfifo.PerEndpointFifoInterface(usb_iobuf, debug=debug)
         elif usb_variant == 'dummy':
-            self.submodules.usb = dummyusb.DummyUsb(usb_iobuf, debug=True)
+            self.submodules.usb = dummyusb.DummyUsb(usb_iobuf, debug=debug, burst=burst)
         else:
             raise ValueError('Invalid endpoints value. It is currently \'eptri\' and \'dummy\'')
-        self.add_wb_master(self.usb.debug_bridge.wishbone)
+        if debug:
+            self.add_wb_master(self.usb.debug_bridge.wishbone)
 
         class _WishboneBridge(Module):
             def __init__(self, interface):
@@ -222,16 +239,134 @@ def add_fsm_state_names():
         return My_LowerNext(self.next_state, self.next_state_name, self.encoding, self.state_aliases)
     fsm.FSM._lower_controls = my_lower_controls
 
-def generate(output_dir, csr_csv, variant):
+def write_register_map(soc, csr_csv, filename, variant):
+    """Write `filename`, a module of `regmap` bindings for the CSRs in
+    `csr_csv`, with the fields of each register taken from `soc`."""
+    fields = {}
+    for region, _origin, _busword, obj in soc.get_csr_regions():
+        if isinstance(obj, Memory):
+            continue
+        for csr in obj:
+            fields[region + "_" + csr.name] = getattr(getattr(csr, "fields", None), "fields", [])
+
+    lines = [
+        "# Generated by generate_verilog.py for the {} gateware, do not edit.".format(variant),
+        "from regmap import Field, Register, RegisterMap",
+        "",
+        "CSR_DATA_WIDTH = {}".format(soc.csr_data_width),
+        "",
+    ]
+    names = []
+    with open(csr_csv, newline='') as csr_csv_file:
+        # csr_register format: csr_register, name, address, size, rw/ro
+        for row in csv.reader(csr_csv_file):
+            if row[0] != 'csr_register':
+                continue
+            name, addr, size, mode = row[1], int(row[2], base=0), int(row[3]), row[4]
+            reg = name.upper()
+            names.append(reg)
+            head = "{} = Register({!r}, 0x{:08x}, {}, {!r}, busword=CSR_DATA_WIDTH, fields=[".format(
+                reg, name, addr, size, mode)
+            if not fields.get(name):
+                lines.append(head + "])")
+                lines.append("")
+                continue
+            lines.append(head)
+            constants = []
+            for f in fields[name]:
+                mask = ((1 << f.size) - 1) << f.offset
+                lines.append("    Field({!r}, {}, {}, 0x{:x}),".format(f.name, f.offset, f.size, mask))
+                constants.append("{}_{}_SHIFT = {}".format(reg, f.name.upper(), f.offset))
+                constants.append("{}_{}_MASK = 0x{:x}".format(reg, f.name.upper(), mask))
+            lines.append("])")
+            lines.extend(constants)
+            lines.append("")
+
+    lines.append("REGISTERS = RegisterMap([")
+    lines.extend("    {},".format(reg) for reg in names)
+    lines.append("])")
+    with open(filename, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+def generate(output_dir, csr_csv, variant, regs=None, **options):
     platform = Platform()
     soc = BaseSoC(platform, usb_variant=variant,
                             cpu_type=None, cpu_variant=None,
-                            output_dir=output_dir)
+                            output_dir=output_dir, **options)
     builder = Builder(soc, output_dir=output_dir,
                            csr_csv=csr_csv,
                            compile_software=False)
     vns = builder.build(run=False)
     soc.do_exit(vns)
+    if regs is not None:
+        write_register_map(soc, csr_csv, regs, variant)
+
+def _source_files(package):
+    """(name, path) of the Python sources of `package`, leaving out tests."""
+    for root in package.__path__:
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = sorted(d for d in dirnames if d not in ("__pycache__", "test"))
+            for filename in sorted(filenames):
+                if filename.endswith(".py") and not filename.endswith("_test.py"):
+                    path = os.path.join(dirpath, filename)
+                    yield package.__name__ + "/" + os.path.relpath(path, root), path
+
+def build_hash(variant, **options):
+    """Hash of everything that goes into the generated outputs: the
+    arguments, this script, and the valentyusb, LiteX and migen sources."""
+    h = hashlib.sha256()
+    for part in [variant] + ["{}={}".format(k, v) for k, v in sorted(options.items())]:
+        h.update(part.encode("utf-8") + b"\0")
+    files = [("generate_verilog.py", os.path.abspath(__file__))]
+    for package in (valentyusb, litex, migen):
+        files.extend(_source_files(package))
+    for name, path in files:
+        with open(path, "rb") as f:
+            h.update(name.encode("utf-8") + b"\0" + f.read() + b"\0")
+    return h.hexdigest()[:24]
+
+def _copy_tree(src, dst):
+    for dirpath, _dirnames, filenames in os.walk(src):
+        target = os.path.join(dst, os.path.relpath(dirpath, src))
+        os.makedirs(target, exist_ok=True)
+        for filename in filenames:
+            # Not copy2: the copies are new outputs as far as make is concerned.
+            shutil.copy(os.path.join(dirpath, filename), target)
+
+def generate_cached(output_dir, csr_csv, variant, regs=None, cache_dir=None, **options):
+    """`generate`, reusing the outputs of an earlier build with the same
+    `build_hash`.  Returns True if they were reused.
+
+    Outputs are built in a temporary directory which is renamed into
+    `cache_dir` (default GATEWARE_CACHE_DIR) once complete, so an existing
+    directory always holds a finished build.
+    """
+    if cache_dir is None:
+        cache_dir = GATEWARE_CACHE_DIR
+
+    key = build_hash(variant, **options)
+    directory = os.path.join(cache_dir, key)
+    hit = os.path.exists(os.path.join(directory, "csr_regs.py"))
+    if not hit:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=cache_dir, prefix=key + ".", suffix=".tmp")
+        try:
+            generate(os.path.join(tmp, "build"), os.path.join(tmp, "csr.csv"),
+                     variant, os.path.join(tmp, "csr_regs.py"), **options)
+            try:
+                os.rename(tmp, directory)
+            except OSError:
+                # Another process finished the same build first.
+                if not os.path.exists(directory):
+                    raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    _copy_tree(os.path.join(directory, "build"), output_dir)
+    shutil.copy(os.path.join(directory, "csr.csv"), csr_csv)
+    if regs is not None:
+        shutil.copy(os.path.join(directory, "csr_regs.py"), regs)
+    return hit
 
 def main():
     parser = argparse.ArgumentParser(
@@ -246,15 +381,41 @@ def main():
     parser.add_argument('--csr', metavar='CSR',
                                  default='csr.csv',
                                  help='csr file (default: %(default)s)')
+    parser.add_argument('--regs', metavar='REGS',
+                                  default='csr_regs.py',
+                                  help='Python register map for the test benches (default: %(default)s)')
+    parser.add_argument('--cdc', action='store_true',
+                                 help='Clock the CSRs of eptri from sys, rather than usb_12')
+    parser.add_argument('--wide', action='store_true',
+                                  help='Make the data registers of eptri 32 bits wide')
+    parser.add_argument('--burst', action='store_true',
+                                   help='Use the burst capable Wishbone debug bridge')
+    parser.add_argument('--no-debug', dest='debug', action='store_false',
+                                      help='Leave out the USB Wishbone debug bridge')
+    parser.add_argument('--no-cache', dest='cache', action='store_false',
+                                      help='Always rebuild, rather than reuse outputs from '
+                                           '$VALENTYUSB_GATEWARE_CACHE (default: {})'.format(GATEWARE_CACHE_DIR))
     args = parser.parse_args()
+    if args.cdc and args.variant != 'eptri':
+        parser.error('--cdc is only supported by eptri')
+    if args.wide and args.variant != 'eptri':
+        parser.error('--wide is only supported by eptri')
+    if args.burst and args.variant == 'epfifo':
+        parser.error('--burst is not supported by epfifo')
     add_fsm_state_names()
     output_dir = args.dir
-    generate(output_dir, args.csr, args.variant)
+    options = dict(debug=args.debug, burst=args.burst, cdc=args.cdc, wide=args.wide)
+    if args.cache:
+        if generate_cached(output_dir, args.csr, args.variant, args.regs, **options):
+            print("Reused a cached build, nothing has changed since.")
+    else:
+        generate(output_dir, args.csr, args.variant, args.regs, **options)
 
     print(
 """Simulation build complete.  Output files:
     {}/gateware/dut.v               Source Verilog file.  Run this under Cocotb.
-""".format(output_dir))
+    {}                    Register map, imported by the test benches.
+""".format(output_dir, args.regs))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,136 @@
+"""Register map bindings for the cocotb test benches.
+
+`generate_verilog.py` writes a module of these for the gateware it builds
+(`csr_regs.py` by default), with the addresses and field positions worked
+out at build time:
+
+    import csr_regs
+    yield csr_regs.USB_OUT_CTRL.write(wb, epno=3, enable=1)
+    status = yield csr_regs.USB_OUT_STATUS.read(wb)
+    if csr_regs.USB_OUT_STATUS.get(status, "have"):
+        ...
+
+`wb` is a `wishbone.WishboneMaster`.  Registers wider than the CSR bus are
+split over consecutive words, most significant first, like LiteX does.
+"""
+
+import collections
+
+import cocotb
+from cocotb.result import ReturnValue
+
+
+class Field(collections.namedtuple("Field", "name offset size mask")):
+    """A field of a register, `mask` is already shifted by `offset`."""
+
+
+class Register:
+    def __init__(self, name, addr, size, mode, busword=8, fields=()):
+        self.name    = name
+        self.addr    = addr
+        self.size    = size
+        self.mode    = mode
+        self.busword = busword
+        self.fields  = collections.OrderedDict((f.name, f) for f in fields)
+
+    def __repr__(self):
+        return "Register({!r}, 0x{:08x})".format(self.name, self.addr)
+
+    def _field(self, name):
+        try:
+            return self.fields[name]
+        except KeyError:
+            raise ValueError("{} has no field {!r}".format(self.name, name)) from None
+
+    def pack(self, value=0, **fields):
+        """`value`, with each of `fields` replaced."""
+        for name, v in fields.items():
+            f = self._field(name)
+            value = (value & ~f.mask) | ((v << f.offset) & f.mask)
+        return value
+
+    def get(self, value, name):
+        """Field `name` of `value`."""
+        f = self._field(name)
+        return (value & f.mask) >> f.offset
+
+    def unpack(self, value):
+        """All the fields of `value`, by name."""
+        return collections.OrderedDict(
+            (name, (value & f.mask) >> f.offset) for name, f in self.fields.items())
+
+    def words(self, value):
+        """(address, data) of each bus word of `value`."""
+        word_mask = (1 << self.busword) - 1
+        return [(self.addr + 4*i, (value >> self.busword*(self.size - 1 - i)) & word_mask)
+                for i in range(self.size)]
+
+    def join(self, datas):
+        """The value of the bus words `datas`, read from `words`."""
+        value = 0
+        for data in datas:
+            value = (value << self.busword) | data
+        return value
+
+    @cocotb.coroutine
+    def read(self, bus):
+        datas = yield bus.read_many([adr for adr, _ in self.words(0)])
+        raise ReturnValue(self.join(datas))
+
+    @cocotb.coroutine
+    def write(self, bus, value=0, **fields):
+        yield bus.write_many(self.words(self.pack(value, **fields)))
+
+    @cocotb.coroutine
+    def modify(self, bus, **fields):
+        """Read-modify-write: change `fields`, keep the rest."""
+        value = yield self.read(bus)
+        yield self.write(bus, value, **fields)
+
+
+class RegisterMap:
+    """The registers of a gateware build, by name."""
+
+    def __init__(self, registers):
+        self._registers = collections.OrderedDict((r.name, r) for r in registers)
+
+    def __getitem__(self, name):
+        return self._registers[name]
+
+    def __getattr__(self, name):
+        try:
+            return self._registers[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __contains__(self, name):
+        return name in self._registers
+
+    def __iter__(self):
+        return iter(self._registers.values())
+
+    def addresses(self):
+        """Address of each register by name, as the old `csr.csv` lookups."""
+        return {name: r.addr for name, r in self._registers.items()}
+
+    @cocotb.coroutine
+    def write_many(self, bus, writes):
+        """Write each (register, fields) of `writes`, in one bus cycle."""
+        words = []
+        for reg, fields in writes:
+            words.extend(reg.words(reg.pack(**fields)))
+        yield bus.write_many(words)
+
+    @cocotb.coroutine
+    def modify_many(self, bus, writes):
+        """Read-modify-write each (register, fields) of `writes`, with one
+        bus cycle to read all of them and one to write them back."""
+        writes = list(writes)
+        adrs = [adr for reg, _ in writes for adr, _ in reg.words(0)]
+        datas = yield bus.read_many(adrs)
+        words = []
+        for reg, fields in writes:
+            value = reg.join(datas[:reg.size])
+            datas = datas[reg.size:]
+            words.extend(reg.words(reg.pack(value, **fields)))
+        yield bus.write_many(words)
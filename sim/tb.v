@@ -19,7 +19,27 @@ module tb(
 	input [2:0] wishbone_cti,
 	input [1:0] wishbone_bte,
 	input [4095:0] test_name,
-	output wishbone_err
+	output wishbone_err,
+
+	// Host packet playback.  Load host_samples (two bits per sample,
+	// {usb_d_n, usb_d_p}, first sample lowest) and host_length, then change
+	// host_go: the samples are driven one per clk48 cycle and host_done
+	// pulses once the last one has been on the bus for a cycle.
+	input [8191:0] host_samples,
+	input [12:0] host_length,
+	input [7:0] host_go,
+	output reg host_done,
+
+	// Device transmission capture.  Every time usb_tx_en goes high the bus
+	// is recorded into capture_samples (packed as host_samples), one sample
+	// per clk48 cycle.  capture_turnaround counts the cycles between the end
+	// of the last host packet and the start of the transmission.  When
+	// usb_tx_en drops again capture_count goes up and capture_done pulses.
+	output reg [8191:0] capture_samples,
+	output reg [12:0] capture_length,
+	output reg [15:0] capture_turnaround,
+	output reg [15:0] capture_count,
+	output reg capture_done
 );
 
 dut dut (
@@ -43,6 +63,67 @@ dut dut (
 	.wishbone_err(wishbone_err)
 );
 
+// The host idles the bus at J, weakly so the device can drive over it.
+reg host_p = 1;
+reg host_n = 0;
+assign (weak1, weak0) usb_d_p = host_p;
+assign (weak1, weak0) usb_d_n = host_n;
+
+reg [7:0] host_go_seen = 0;
+reg host_busy = 0;
+reg [12:0] host_index = 0;
+reg [15:0] tx_wait = 0;
+reg capture_active = 0;
+
+initial begin
+	host_done = 0;
+	capture_samples = 0;
+	capture_length = 0;
+	capture_turnaround = 0;
+	capture_count = 0;
+	capture_done = 0;
+end
+
+always @(posedge clk48) begin
+	host_done <= 0;
+	if (host_busy) begin
+		if (host_index == host_length) begin
+			{host_n, host_p} <= 2'b01;
+			host_busy <= 0;
+			host_done <= 1;
+		end else begin
+			{host_n, host_p} <= host_samples[2*host_index +: 2];
+			host_index <= host_index + 1;
+		end
+	end else if (host_go != host_go_seen) begin
+		host_go_seen <= host_go;
+		host_index <= 0;
+		host_busy <= 1;
+	end
+
+	if (host_done)
+		tx_wait <= 0;
+	else if (!usb_tx_en && tx_wait != 16'hffff)
+		tx_wait <= tx_wait + 1;
+
+	capture_done <= 0;
+	if (usb_tx_en) begin
+		if (!capture_active) begin
+			capture_active <= 1;
+			capture_samples <= {usb_d_n, usb_d_p};
+			capture_length <= 1;
+			capture_turnaround <= tx_wait;
+		end else if (capture_length != 4096) begin
+			capture_samples[2*capture_length +: 2] <= {usb_d_n, usb_d_p};
+			capture_length <= capture_length + 1;
+		end
+	end else if (capture_active) begin
+		capture_active <= 0;
+		capture_count <= capture_count + 1;
+		capture_done <= 1;
+	end
+end
+
   // Dump waves
   initial begin
     $dumpfile("dump.vcd");
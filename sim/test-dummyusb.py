@@ -1,18 +1,24 @@
 # Tests for the Fomu Tri-Endpoint
 import cocotb
 from cocotb.clock import Clock
-from cocotb.triggers import RisingEdge, NullTrigger, Timer
+from cocotb.triggers import First, RisingEdge, NullTrigger, Timer
 from cocotb.result import TestFailure, TestSuccess, ReturnValue
 
 from valentyusb.usbcore.utils.packet import *
 from valentyusb.usbcore.endpoint import *
 from valentyusb.usbcore.pid import *
 from valentyusb.usbcore.utils.pprint import pp_packet
+from valentyusb.usbcore.io import FakeDeviceMonitor, FakeHostTransactor
 
 from wishbone import WishboneMaster, WBOp
+import csr_regs
 
 import logging
-import csv
+
+# clk48 period, and the sizes of the playback and capture memories in tb.v
+CLK48_PS = 20800
+HOST_DEPTH = 4096
+CAPTURE_DEPTH = 4096
 
 def grouper_tofit(n, iterable):
     from itertools import zip_longest
@@ -36,16 +42,17 @@ def grouper_tofit(n, iterable):
 class UsbTest:
     def __init__(self, dut):
         self.dut = dut
-        self.csrs = dict()
-        with open("csr.csv", newline='') as csr_csv_file:
-            csr_csv = csv.reader(csr_csv_file)
-            # csr_register format: csr_register, name, address, size, rw/ro
-            for row in csr_csv:
-                if row[0] == 'csr_register':
-                    self.csrs[row[1]] = int(row[2], base=0)
-        cocotb.fork(Clock(dut.clk48, 20800, 'ps').start())
+        # Written by generate_verilog.py along with dut.v
+        self.regs = csr_regs.REGISTERS
+        self.csrs = self.regs.addresses()
+        cocotb.fork(Clock(dut.clk48, CLK48_PS, 'ps').start())
         self.wb = WishboneMaster(dut, "wishbone", dut.clk12, timeout=20)
 
+        # Packet playback and capture, see tb.v
+        self.host_go = 0
+        self.dut.host_go = 0
+        self.captures = 0
+
         # Set the signal "test_name" to match this test
         import inspect
         tn = cocotb.binary.BinaryValue(value=None, n_bits=4096)
@@ -61,8 +68,6 @@ class UsbTest:
         yield RisingEdge(self.dut.clk12)
 
         self.dut.reset = 0
-        self.dut.usb_d_p = 1
-        self.dut.usb_d_n = 0
 
         # yield self.disconnect()
 
@@ -75,6 +80,11 @@ class UsbTest:
         value = yield self.wb.read(addr)
         raise ReturnValue(value)
 
+    @cocotb.coroutine
+    def write_many(self, addr, values):
+        """Write each of `values` to `addr`, all in one bus cycle."""
+        yield self.wb.write_many((addr, v) for v in values)
+
     @cocotb.coroutine
     def connect(self):
         # Python is a weird language.  This is required to turn this
@@ -117,36 +127,29 @@ class UsbTest:
 
         # Packet gets multiplied by 4x so we can send using the
         # usb48 clock instead of the usb12 clock.
-        packet = 'JJJJJJJJ' + wrap_packet(packet)
+        yield self._host_send_wire(wrap_packet(packet))
+
+    @cocotb.coroutine
+    def _host_send_wire(self, packet):
+        """Send an already wrapped USB packet."""
+        packet = 'JJJJJJJJ' + packet
         self.assertEqual('J', packet[-1], "Packet didn't end in J: "+packet)
 
-        for v in packet:
-            if v == '0' or v == '_':
-                # SE0 - both lines pulled low
-                self.dut.usb_d_p <= 0
-                self.dut.usb_d_n <= 0
-            elif v == '1':
-                # SE1 - illegal, should never occur
-                self.dut.usb_d_p <= 1
-                self.dut.usb_d_n <= 1
-            elif v == '-' or v == 'I':
-                # Idle
-                self.dut.usb_d_p <= 1
-                self.dut.usb_d_n <= 0
-            elif v == 'J':
-                self.dut.usb_d_p <= 1
-                self.dut.usb_d_n <= 0
-            elif v == 'K':
-                self.dut.usb_d_p <= 0
-                self.dut.usb_d_n <= 1
-            else:
-                raise TestFailure("Unknown value: %s" % v)
-            yield RisingEdge(self.dut.clk48)
+        if len(packet) > HOST_DEPTH:
+            raise TestFailure("Packet too long to send: {} samples".format(len(packet)))
+
+        # tb.v plays the samples back itself, so only the end of the packet
+        # needs waiting for rather than every clk48 cycle.
+        self.dut.host_samples <= FakeHostTransactor.encode(packet)
+        self.dut.host_length <= len(packet)
+        self.host_go = (self.host_go + 1) & 0xff
+        self.dut.host_go <= self.host_go
+        yield RisingEdge(self.dut.host_done)
 
     @cocotb.coroutine
     def host_send_token_packet(self, pid, addr, ep):
         epnum = EndpointType.epnum(ep)
-        yield self._host_send_packet(token_packet(pid, addr, epnum))
+        yield self._host_send_wire(wrap_token_packet(pid, addr, epnum))
 
     @cocotb.coroutine
     def host_send_data_packet(self, pid, data):
@@ -155,11 +158,11 @@ class UsbTest:
 
     @cocotb.coroutine
     def host_send_sof(self, time):
-        yield self._host_send_packet(sof_packet(time))
+        yield self._host_send_wire(wrap_sof_packet(time))
 
     @cocotb.coroutine
     def host_send_ack(self):
-        yield self._host_send_packet(handshake_packet(PID.ACK))
+        yield self._host_send_wire(wrap_handshake_packet(PID.ACK))
 
     @cocotb.coroutine
     def host_send(self, data01, addr, epnum, data, expected=PID.ACK):
@@ -188,35 +191,25 @@ class UsbTest:
     def host_expect_packet(self, packet, msg=None):
         """Except to receive the following USB packet."""
 
-        def current():
-            values = (self.dut.usb_d_p, self.dut.usb_d_n)
-
-            if values == (0, 0):
-                return '_'
-            elif values == (1, 1):
-                return '1'
-            elif values == (1, 0):
-                return 'J'
-            elif values == (0, 1):
-                return 'K'
-            else:
-                raise TestFailure("Unrecognized dut values: {}".format(values))
-
-        # Wait for transmission to start
-        tx = 0
-        bit_times = 0
-        for i in range(0, 100):
-            tx = self.dut.usb_tx_en
-            if tx == 1:
-                break
-            yield RisingEdge(self.dut.clk48)
-            bit_times = bit_times + 1
-        if tx != 1:
-            raise TestFailure("No packet started, " + msg)
+        # tb.v records the device's transmissions by itself, wait for the
+        # next one to finish unless it already has.
+        captures = int(self.dut.capture_count)
+        if captures == self.captures:
+            fired = yield First(RisingEdge(self.dut.capture_done),
+                                Timer(CLK48_PS*(100 + CAPTURE_DEPTH), 'ps'))
+            if not isinstance(fired, RisingEdge):
+                if self.dut.usb_tx_en == 1:
+                    raise TestFailure("Packet didn't finish, " + msg)
+                raise TestFailure("No packet started, " + msg)
+            captures += 1
+        self.captures = captures
 
         # # USB specifies that the turn-around time is 7.5 bit times for the device
+        bit_times = int(self.dut.capture_turnaround)
         bit_time_max = 12.5
         bit_time_acceptable = 7.5
+        if bit_times >= 100:
+            raise TestFailure("No packet started, " + msg)
         if (bit_times/4.0) > bit_time_max:
             raise TestFailure("Response came after {} bit times, which is more than {}".format(bit_times / 4.0, bit_time_max))
         if (bit_times/4.0) > bit_time_acceptable:
@@ -225,21 +218,13 @@ class UsbTest:
             self.dut._log.info("Response came after {} bit times".format(bit_times / 4.0))
 
         # Read in the transmission data
-        result = ""
-        for i in range(0, 1024):
-            result += current()
-            yield RisingEdge(self.dut.clk48)
-            if self.dut.usb_tx_en != 1:
-                break
-        if tx == 1:
-            raise TestFailure("Packet didn't finish, " + msg)
-        self.dut.usb_d_p = 1
-        self.dut.usb_d_n = 0
+        result = FakeDeviceMonitor.decode(
+            self.dut.capture_samples.value.integer, int(self.dut.capture_length))
 
         # Check the packet received matches
-        expected = pp_packet(wrap_packet(packet))
-        actual = pp_packet(result)
-        self.assertSequenceEqual(expected, actual, msg)
+        expected = wrap_packet(packet)
+        if expected != result:
+            self.assertSequenceEqual(pp_packet(expected), pp_packet(result), msg)
 
     @cocotb.coroutine
     def host_expect_ack(self):
@@ -336,8 +321,7 @@ class UsbTest:
 
     @cocotb.coroutine
     def send_data(self, token, ep, data):
-        for b in data:
-            yield self.write(self.csrs['usb_epin_data'], b)
+        yield self.write_many(self.csrs['usb_epin_data'], data)
         yield self.write(self.csrs['usb_epin_epno'], ep)
 
     @cocotb.coroutine
@@ -401,8 +385,7 @@ class UsbTest:
     @cocotb.coroutine
     def set_data(self, ep, data):
         _epnum = EndpointType.epnum(ep)
-        for b in data:
-            yield self.write(self.csrs['usb_epin_data'], b)
+        yield self.write_many(self.csrs['usb_epin_data'], data)
 
     @cocotb.coroutine
     def transaction_status_in(self, addr, ep):
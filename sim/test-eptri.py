@@ -1,18 +1,24 @@
 # Tests for the Fomu Tri-Endpoint
 import cocotb
 from cocotb.clock import Clock
-from cocotb.triggers import RisingEdge, NullTrigger, Timer
+from cocotb.triggers import First, RisingEdge, NullTrigger, Timer
 from cocotb.result import TestFailure, TestSuccess, ReturnValue
 
 from valentyusb.usbcore.utils.packet import *
 from valentyusb.usbcore.endpoint import *
 from valentyusb.usbcore.pid import *
 from valentyusb.usbcore.utils.pprint import pp_packet
+from valentyusb.usbcore.io import FakeDeviceMonitor, FakeHostTransactor
 
 from wishbone import WishboneMaster, WBOp
+import csr_regs
 
 import logging
-import csv
+
+# clk48 period, and the sizes of the playback and capture memories in tb.v
+CLK48_PS = 20800
+HOST_DEPTH = 4096
+CAPTURE_DEPTH = 4096
 
 def grouper_tofit(n, iterable):
     from itertools import zip_longest
@@ -36,16 +42,17 @@ def grouper_tofit(n, iterable):
 class UsbTest:
     def __init__(self, dut):
         self.dut = dut
-        self.csrs = dict()
-        with open("csr.csv", newline='') as csr_csv_file:
-            csr_csv = csv.reader(csr_csv_file)
-            # csr_register format: csr_register, name, address, size, rw/ro
-            for row in csr_csv:
-                if row[0] == 'csr_register':
-                    self.csrs[row[1]] = int(row[2], base=0)
-        cocotb.fork(Clock(dut.clk48, 20800, 'ps').start())
+        # Written by generate_verilog.py along with dut.v
+        self.regs = csr_regs.REGISTERS
+        self.csrs = self.regs.addresses()
+        cocotb.fork(Clock(dut.clk48, CLK48_PS, 'ps').start())
         self.wb = WishboneMaster(dut, "wishbone", dut.clk12, timeout=20)
 
+        # Packet playback and capture, see tb.v
+        self.host_go = 0
+        self.dut.host_go = 0
+        self.captures = 0
+
         # Set the signal "test_name" to match this test
         import inspect
         tn = cocotb.binary.BinaryValue(value=None, n_bits=4096)
@@ -60,9 +67,6 @@ class UsbTest:
         self.dut.reset = 0
         yield RisingEdge(self.dut.clk12)
 
-        self.dut.usb_d_p = 1
-        self.dut.usb_d_n = 0
-
         yield self.disconnect()
 
         # Enable endpoint 0
@@ -84,6 +88,43 @@ class UsbTest:
         value = yield self.wb.read(addr)
         raise ReturnValue(value)
 
+    @cocotb.coroutine
+    def write_many(self, addr, values):
+        """Write each of `values` to `addr`, all in one bus cycle."""
+        yield self.wb.write_many((addr, v) for v in values)
+
+    @cocotb.coroutine
+    def write_in_data(self, data):
+        """Add `data` to the IN FIFO, four bytes per write if IN_DATA is wide."""
+        if 'usb_in_count' not in self.regs:
+            yield self.write_many(self.csrs['usb_in_data'], data)
+            return
+        data = list(data)
+        writes = []
+        count = 3
+        for i in range(0, len(data), 4):
+            chunk = data[i:i+4]
+            if len(chunk) - 1 != count:
+                count = len(chunk) - 1
+                writes.append((self.regs.usb_in_count, dict(count=count)))
+            writes.append((self.regs.usb_in_data, dict(data=int.from_bytes(bytes(chunk), 'little'))))
+        if count != 3:
+            writes.append((self.regs.usb_in_count, dict(count=3)))
+        yield self.regs.write_many(self.wb, writes)
+
+    @cocotb.coroutine
+    def read_fifo_data(self, name, status):
+        """Read the head of the `name` ('setup' or 'out') FIFO, given the value
+        of its status register: one byte, or up to four if the data is wide."""
+        status_reg = self.regs['usb_{}_status'.format(name)]
+        data_reg = self.regs['usb_{}_data'.format(name)]
+        if 'count' not in status_reg.fields:
+            v = yield self.read(data_reg.addr)
+            raise ReturnValue([v])
+        count = status_reg.get(status, 'count')
+        v = yield data_reg.read(self.wb)
+        raise ReturnValue(list(v.to_bytes(4, 'little')[:count]))
+
     @cocotb.coroutine
     def connect(self):
         USB_PULLUP_OUT = self.csrs['usb_pullup_out']
@@ -94,12 +135,12 @@ class UsbTest:
         if EndpointType.epdir(epaddr) == EndpointType.IN:
             # Reset endpoint
             self.dut._log.info("Clearing IN_EV_PENDING")
-            yield self.write(self.csrs['usb_in_ctrl'], 0x20)
+            yield self.regs.usb_in_ctrl.write(self.wb, reset=1)
             yield self.write(self.csrs['usb_in_ev_pending'], 0xff)
         else:
             self.dut._log.info("Clearing OUT_EV_PENDING")
             yield self.write(self.csrs['usb_out_ev_pending'], 0xff)
-            yield self.write(self.csrs['usb_out_ctrl'], 0x20)
+            yield self.regs.usb_out_ctrl.write(self.wb, reset=1)
 
     @cocotb.coroutine
     def disconnect(self):
@@ -127,36 +168,29 @@ class UsbTest:
 
         # Packet gets multiplied by 4x so we can send using the
         # usb48 clock instead of the usb12 clock.
-        packet = 'JJJJJJJJ' + wrap_packet(packet)
+        yield self._host_send_wire(wrap_packet(packet))
+
+    @cocotb.coroutine
+    def _host_send_wire(self, packet):
+        """Send an already wrapped USB packet."""
+        packet = 'JJJJJJJJ' + packet
         self.assertEqual('J', packet[-1], "Packet didn't end in J: "+packet)
 
-        for v in packet:
-            if v == '0' or v == '_':
-                # SE0 - both lines pulled low
-                self.dut.usb_d_p <= 0
-                self.dut.usb_d_n <= 0
-            elif v == '1':
-                # SE1 - illegal, should never occur
-                self.dut.usb_d_p <= 1
-                self.dut.usb_d_n <= 1
-            elif v == '-' or v == 'I':
-                # Idle
-                self.dut.usb_d_p <= 1
-                self.dut.usb_d_n <= 0
-            elif v == 'J':
-                self.dut.usb_d_p <= 1
-                self.dut.usb_d_n <= 0
-            elif v == 'K':
-                self.dut.usb_d_p <= 0
-                self.dut.usb_d_n <= 1
-            else:
-                raise TestFailure("Unknown value: %s" % v)
-            yield RisingEdge(self.dut.clk48)
+        if len(packet) > HOST_DEPTH:
+            raise TestFailure("Packet too long to send: {} samples".format(len(packet)))
+
+        # tb.v plays the samples back itself, so only the end of the packet
+        # needs waiting for rather than every clk48 cycle.
+        self.dut.host_samples <= FakeHostTransactor.encode(packet)
+        self.dut.host_length <= len(packet)
+        self.host_go = (self.host_go + 1) & 0xff
+        self.dut.host_go <= self.host_go
+        yield RisingEdge(self.dut.host_done)
 
     @cocotb.coroutine
     def host_send_token_packet(self, pid, addr, ep):
         epnum = EndpointType.epnum(ep)
-        yield self._host_send_packet(token_packet(pid, addr, epnum))
+        yield self._host_send_wire(wrap_token_packet(pid, addr, epnum))
 
     @cocotb.coroutine
     def host_send_data_packet(self, pid, data):
@@ -165,11 +199,11 @@ class UsbTest:
 
     @cocotb.coroutine
     def host_send_sof(self, time):
-        yield self._host_send_packet(sof_packet(time))
+        yield self._host_send_wire(wrap_sof_packet(time))
 
     @cocotb.coroutine
     def host_send_ack(self):
-        yield self._host_send_packet(handshake_packet(PID.ACK))
+        yield self._host_send_wire(wrap_handshake_packet(PID.ACK))
 
     @cocotb.coroutine
     def host_send(self, data01, addr, epnum, data, expected=PID.ACK):
@@ -198,35 +232,25 @@ class UsbTest:
     def host_expect_packet(self, packet, msg=None):
         """Except to receive the following USB packet."""
 
-        def current():
-            values = (self.dut.usb_d_p, self.dut.usb_d_n)
-
-            if values == (0, 0):
-                return '_'
-            elif values == (1, 1):
-                return '1'
-            elif values == (1, 0):
-                return 'J'
-            elif values == (0, 1):
-                return 'K'
-            else:
-                raise TestFailure("Unrecognized dut values: {}".format(values))
-
-        # Wait for transmission to start
-        tx = 0
-        bit_times = 0
-        for i in range(0, 100):
-            tx = self.dut.usb_tx_en
-            if tx == 1:
-                break
-            yield RisingEdge(self.dut.clk48)
-            bit_times = bit_times + 1
-        if tx != 1:
-            raise TestFailure("No packet started, " + msg)
+        # tb.v records the device's transmissions by itself, wait for the
+        # next one to finish unless it already has.
+        captures = int(self.dut.capture_count)
+        if captures == self.captures:
+            fired = yield First(RisingEdge(self.dut.capture_done),
+                                Timer(CLK48_PS*(100 + CAPTURE_DEPTH), 'ps'))
+            if not isinstance(fired, RisingEdge):
+                if self.dut.usb_tx_en == 1:
+                    raise TestFailure("Packet didn't finish, " + msg)
+                raise TestFailure("No packet started, " + msg)
+            captures += 1
+        self.captures = captures
 
         # # USB specifies that the turn-around time is 7.5 bit times for the device
+        bit_times = int(self.dut.capture_turnaround)
         bit_time_max = 12.5
         bit_time_acceptable = 7.5
+        if bit_times >= 100:
+            raise TestFailure("No packet started, " + msg)
         if (bit_times/4.0) > bit_time_max:
             raise TestFailure("Response came after {} bit times, which is more than {}".format(bit_times / 4.0, bit_time_max))
         if (bit_times/4.0) > bit_time_acceptable:
@@ -235,21 +259,13 @@ class UsbTest:
             self.dut._log.info("Response came after {} bit times".format(bit_times / 4.0))
 
         # Read in the transmission data
-        result = ""
-        for i in range(0, 4096):
-            result += current()
-            yield RisingEdge(self.dut.clk48)
-            if self.dut.usb_tx_en != 1:
-                break
-        if tx == 1:
-            raise TestFailure("Packet didn't finish, " + msg)
-        self.dut.usb_d_p = 1
-        self.dut.usb_d_n = 0
+        result = FakeDeviceMonitor.decode(
+            self.dut.capture_samples.value.integer, int(self.dut.capture_length))
 
         # Check the packet received matches
-        expected = pp_packet(wrap_packet(packet))
-        actual = pp_packet(result)
-        self.assertSequenceEqual(expected, actual, msg)
+        expected = wrap_packet(packet)
+        if expected != result:
+            self.assertSequenceEqual(pp_packet(expected), pp_packet(result), msg)
 
     @cocotb.coroutine
     def host_expect_ack(self):
@@ -271,10 +287,10 @@ class UsbTest:
     @cocotb.coroutine
     def pending(self, ep):
         if EndpointType.epdir(ep) == EndpointType.IN:
-            val = yield self.read(self.csrs['usb_in_status'])
+            val = yield self.regs.usb_in_status.read(self.wb)
             raise ReturnValue(val & (1 << 4))
         else:
-            val = yield self.read(self.csrs['usb_out_status'])
+            val = yield self.regs.usb_out_status.read(self.wb)
             raise ReturnValue((val & (1 << 5) | (1 << 4)) and (EndpointType.epnum(ep) == (val & 0x0f)))
 
     @cocotb.coroutine
@@ -283,20 +299,20 @@ class UsbTest:
         # wait for data to appear
         for i in range(128):
             self.dut._log.debug("Prime loop {}".format(i))
-            status = yield self.read(self.csrs['usb_setup_status'])
-            have = status & 0x10
+            status = yield self.regs.usb_setup_status.read(self.wb)
+            have = self.regs.usb_setup_status.get(status, 'have')
             if have:
                 break
             yield RisingEdge(self.dut.clk12)
 
         for i in range(48):
             self.dut._log.debug("Read loop {}".format(i))
-            status = yield self.read(self.csrs['usb_setup_status'])
-            have = status & 0x10
+            status = yield self.regs.usb_setup_status.read(self.wb)
+            have = self.regs.usb_setup_status.get(status, 'have')
             if not have:
                 break
-            v = yield self.read(self.csrs['usb_setup_data'])
-            actual_data.append(v)
+            v = yield self.read_fifo_data('setup', status)
+            actual_data.extend(v)
             yield RisingEdge(self.dut.clk12)
 
         if len(actual_data) < 2:
@@ -314,12 +330,12 @@ class UsbTest:
     def drain_setup(self):
         actual_data = []
         for i in range(48):
-            status = yield self.read(self.csrs['usb_setup_status'])
-            have = status & 0x10
+            status = yield self.regs.usb_setup_status.read(self.wb)
+            have = self.regs.usb_setup_status.get(status, 'have')
             if not have:
                 break
-            v = yield self.read(self.csrs['usb_setup_data'])
-            actual_data.append(v)
+            v = yield self.read_fifo_data('setup', status)
+            actual_data.extend(v)
             yield RisingEdge(self.dut.clk12)
         yield self.write(self.csrs['usb_setup_ctrl'], 2)
         # Drain the pending bit
@@ -330,15 +346,15 @@ class UsbTest:
     def drain_out(self):
         actual_data = []
         for i in range(70):
-            status = yield self.read(self.csrs['usb_out_status'])
-            have = status & (1 << 4)
+            status = yield self.regs.usb_out_status.read(self.wb)
+            have = self.regs.usb_out_status.get(status, 'have')
             if not have:
                 break
-            v = yield self.read(self.csrs['usb_out_data'])
-            actual_data.append(v)
+            v = yield self.read_fifo_data('out', status)
+            actual_data.extend(v)
             yield RisingEdge(self.dut.clk12)
         yield self.write(self.csrs['usb_out_ev_pending'], 0xff)
-        yield self.write(self.csrs['usb_out_ctrl'], 0x10)
+        yield self.regs.usb_out_ctrl.write(self.wb, enable=1)
         return actual_data[:-2] # Strip off CRC16
 
     @cocotb.coroutine
@@ -347,20 +363,20 @@ class UsbTest:
         # wait for data to appear
         for i in range(128):
             self.dut._log.debug("Prime loop {}".format(i))
-            status = yield self.read(self.csrs['usb_out_status'])
-            have = status & (1 << 4)
+            status = yield self.regs.usb_out_status.read(self.wb)
+            have = self.regs.usb_out_status.get(status, 'have')
             if have:
                 break
             yield RisingEdge(self.dut.clk12)
 
         for i in range(256):
             self.dut._log.debug("Read loop {}".format(i))
-            status = yield self.read(self.csrs['usb_out_status'])
-            have = status & (1 << 4)
+            status = yield self.regs.usb_out_status.read(self.wb)
+            have = self.regs.usb_out_status.get(status, 'have')
             if not have:
                 break
-            v = yield self.read(self.csrs['usb_out_data'])
-            actual_data.append(v)
+            v = yield self.read_fifo_data('out', status)
+            actual_data.extend(v)
             yield RisingEdge(self.dut.clk12)
 
         if expected == PID.ACK:
@@ -381,13 +397,12 @@ class UsbTest:
         if EndpointType.epdir(ep) == EndpointType.IN and response == EndpointResponse.ACK:
             yield self.write(self.csrs['usb_in_ctrl'], EndpointType.epnum(ep))
         elif EndpointType.epdir(ep) == EndpointType.OUT and response == EndpointResponse.ACK:
-            yield self.write(self.csrs['usb_out_ctrl'], 0x10 | EndpointType.epnum(ep))
+            yield self.regs.usb_out_ctrl.write(self.wb, epno=EndpointType.epnum(ep), enable=1)
 
     @cocotb.coroutine
     def send_data(self, token, ep, data):
-        for b in data:
-            yield self.write(self.csrs['usb_in_data'], b)
-        yield self.write(self.csrs['usb_in_ctrl'], EndpointType.epnum(ep) & 0x0f)
+        yield self.write_in_data(data)
+        yield self.regs.usb_in_ctrl.write(self.wb, epno=EndpointType.epnum(ep))
 
     @cocotb.coroutine
     def transaction_setup(self, addr, data, epnum=0):
@@ -422,8 +437,7 @@ class UsbTest:
         for i, chunk in enumerate(grouper_tofit(chunk_size, data)):
             sent_data = 1
             self.dut._log.debug("Actual data we're expecting: {}".format(chunk))
-            for b in chunk:
-                yield self.write(self.csrs['usb_in_data'], b)
+            yield self.write_in_data(chunk)
             yield self.write(self.csrs['usb_in_ctrl'], epnum)
             recv = cocotb.fork(self.host_recv(datax, addr, ep, chunk))
             yield recv.join()
@@ -441,8 +455,7 @@ class UsbTest:
     @cocotb.coroutine
     def set_data(self, ep, data):
         _epnum = EndpointType.epnum(ep)
-        for b in data:
-            yield self.write(self.csrs['usb_in_data'], b)
+        yield self.write_in_data(data)
 
     @cocotb.coroutine
     def transaction_status_in(self, addr, ep):
@@ -508,7 +521,7 @@ class UsbTest:
         if in_ev != 1:
             raise TestFailure("o: in_ev should be 1 at the end of the test, was: {:02x}".format(in_ev))
         yield self.write(self.csrs['usb_in_ev_pending'], in_ev)
-        yield self.write(self.csrs['usb_in_ctrl'], 1 << 5) # Reset the IN buffer
+        yield self.regs.usb_in_ctrl.write(self.wb, reset=1) # Reset the IN buffer
 
     @cocotb.coroutine
     def control_transfer_in(self, addr, setup_data, descriptor_data=None):
@@ -552,7 +565,7 @@ class UsbTest:
             yield self.write(self.csrs['usb_in_ev_pending'], in_ev)
 
         # Status stage
-        yield self.write(self.csrs['usb_out_ctrl'], 0x10) # Send empty packet
+        yield self.regs.usb_out_ctrl.write(self.wb, enable=1) # Send empty packet
         self.dut._log.info("status stage")
         out_ev = yield self.read(self.csrs['usb_out_ev_pending'])
         if out_ev != 0:
@@ -562,7 +575,7 @@ class UsbTest:
         out_ev = yield self.read(self.csrs['usb_out_ev_pending'])
         if out_ev != 1:
             raise TestFailure("i: out_ev should be 1 at the end of the test, was: {:02x}".format(out_ev))
-        yield self.write(self.csrs['usb_out_ctrl'], 0x20) # Reset FIFO
+        yield self.regs.usb_out_ctrl.write(self.wb, reset=1) # Reset FIFO
         yield self.write(self.csrs['usb_out_ev_pending'], out_ev)
 
 @cocotb.test()
@@ -655,8 +668,7 @@ def test_control_transfer_in_lazy(dut):
     # Set it up so we ACK the final IN packet
     data = [0x00, 0x01, 0x02, 0x03, 0x04, 0x05, 0x06, 0x07,
             0x08, 0x09, 0x0A, 0x0B]
-    for b in data:
-        yield harness.write(harness.csrs['usb_in_data'], b)
+    yield harness.write_in_data(data)
 
     # Send a few packets while we "process" the data as a slow host
     for i in range(2):
@@ -745,8 +757,7 @@ def test_control_transfer_in_lazy(dut):
     # Set it up so we ACK the final IN packet
     data = [0x00, 0x01, 0x02, 0x03, 0x04, 0x05, 0x06, 0x07,
             0x08, 0x09, 0x0A, 0x0B]
-    for b in data:
-        yield harness.write(harness.csrs['usb_in_data'], b)
+    yield harness.write_in_data(data)
 
     # Send a few packets while we "process" the data as a slow host
     for i in range(2):
@@ -796,8 +807,7 @@ def test_control_transfer_out_lazy(dut):
     # Set it up so we ACK the final IN packet
     data = [0x00, 0x01, 0x02, 0x03, 0x04, 0x05, 0x06, 0x07,
             0x08, 0x09, 0x0A, 0x0B]
-    for b in data:
-        yield harness.write(harness.csrs['usb_in_data'], b)
+    yield harness.write_in_data(data)
 
     # Send a few packets while we "process" the data as a slow host
     harness.dut._log.info("\"processing\" data on a slow host (should send NAKs)")
@@ -829,7 +839,7 @@ def test_control_transfer_out_lazy(dut):
     yield harness.host_expect_nak()
 
     harness.dut._log.info("draining OUT buffer")
-    out_status = yield harness.read(harness.csrs['usb_out_status'])
+    out_status = yield harness.regs.usb_out_status.read(harness.wb)
     if (out_status & 0x20) == 0:
         raise TestFailure("out_status didn't have any pending event")
     if (out_status & 0x10) == 0:
@@ -843,7 +853,7 @@ def test_control_transfer_out_lazy(dut):
     yield harness.host_send_token_packet(PID.OUT, 0, ep3_out)
     yield harness.host_send_data_packet(PID.DATA0, ep3_data)
     yield harness.host_expect_ack()
-    out_status = yield harness.read(harness.csrs['usb_out_status'])
+    out_status = yield harness.regs.usb_out_status.read(harness.wb)
     if (out_status & 0x20) == 0:
         raise TestFailure("out_status didn't have any pending event")
     if (out_status & 0x10) == 0:
@@ -906,8 +916,7 @@ def test_control_transfer_in_large(dut):
     for i, chunk in enumerate(grouper_tofit(64, string_data)):
         sent_data = 1
         harness.dut._log.debug("Actual data we're expecting: {}".format(chunk))
-        for b in chunk:
-            yield harness.write(harness.csrs['usb_in_data'], b)
+        yield harness.write_in_data(chunk)
         yield harness.write(harness.csrs['usb_in_ctrl'], 0)
         recv = cocotb.fork(harness.host_recv(datax, 11, 0, chunk))
         yield recv.join()
@@ -1369,6 +1378,96 @@ def test_in_transfer(dut):
     yield harness.host_expect_data_packet(PID.DATA1, d[4:])
     yield harness.host_send_ack()
 
+@cocotb.test(skip='usb_in_count' not in csr_regs.REGISTERS)
+def test_in_transfer_wide(dut):
+    """IN data written four bytes at a time, needs a build with --wide"""
+    harness = UsbTest(dut)
+    yield harness.reset()
+    yield harness.connect()
+
+    addr = 0
+    epaddr = EndpointType.epaddr(1, EndpointType.IN)
+    yield harness.write(harness.csrs['usb_address'], addr)
+
+    regs = harness.regs
+    yield harness.clear_pending(epaddr)
+    yield harness.set_response(epaddr, EndpointResponse.NAK)
+
+    # Three whole words and one byte
+    yield regs.usb_in_data.write(harness.wb, data=0x04030201)
+    yield regs.usb_in_data.write(harness.wb, data=0x08070605)
+    yield regs.usb_in_data.write(harness.wb, data=0x0c0b0a09)
+    yield regs.usb_in_count.write(harness.wb, count=0)
+    yield regs.usb_in_data.write(harness.wb, data=0xffffff0d)
+    yield regs.usb_in_count.write(harness.wb, count=3)
+
+    yield harness.set_response(epaddr, EndpointResponse.ACK)
+    yield harness.host_send_token_packet(PID.IN, addr, epaddr)
+    yield harness.host_expect_data_packet(PID.DATA1, list(range(1, 14)))
+    yield harness.host_send_ack()
+
+    # A full sized packet, in 16 writes
+    d = [(i * 7) & 0xff for i in range(64)]
+    yield harness.clear_pending(epaddr)
+    yield harness.set_data(epaddr, d)
+    yield harness.set_response(epaddr, EndpointResponse.ACK)
+    yield harness.host_send_token_packet(PID.IN, addr, epaddr)
+    yield harness.host_expect_data_packet(PID.DATA1, d)
+    yield harness.host_send_ack()
+
+@cocotb.test(skip='count' not in csr_regs.REGISTERS['usb_out_status'].fields)
+def test_out_transfer_wide(dut):
+    """OUT and SETUP data read four bytes at a time, needs a build with --wide"""
+    harness = UsbTest(dut)
+    yield harness.reset()
+    yield harness.connect()
+    regs = harness.regs
+    ep0 = EndpointType.epaddr(0, EndpointType.OUT)
+    ep1 = EndpointType.epaddr(1, EndpointType.OUT)
+
+    @cocotb.coroutine
+    def read_words(name):
+        status_reg = regs['usb_{}_status'.format(name)]
+        words = []
+        for i in range(32):
+            status = yield status_reg.read(harness.wb)
+            if not status_reg.get(status, 'have'):
+                break
+            v = yield regs['usb_{}_data'.format(name)].read(harness.wb)
+            words.append((status_reg.get(status, 'count'), v))
+        raise ReturnValue(words)
+
+    # The eight bytes of SETUP data are two words, the CRC16 a third
+    setup = [0x00, 0x05, 0x1b, 0x00, 0x00, 0x00, 0x00, 0x00]
+    yield harness.host_send_token_packet(PID.SETUP, 0, ep0)
+    yield harness.host_send_data_packet(PID.DATA0, setup)
+    yield harness.host_expect_ack()
+    words = yield read_words('setup')
+    crc = crc16(setup)
+    expected = [(4, 0x001b0500), (4, 0x00000000), (2, crc[0] | crc[1] << 8)]
+    if words != expected:
+        raise TestFailure("SETUP words were {}, expected {}".format(words, expected))
+    yield harness.write(harness.csrs['usb_setup_ctrl'], 2)
+    yield harness.write(harness.csrs['usb_setup_ev_pending'], 0xff)
+
+    # Seven bytes and the CRC16 are two whole words and one byte
+    d = [0x1, 0x2, 0x3, 0x4, 0x5, 0x6, 0x7]
+    yield harness.clear_pending(ep1)
+    yield harness.set_response(ep1, EndpointResponse.ACK)
+    yield harness.host_send_token_packet(PID.OUT, 0, ep1)
+    yield harness.host_send_data_packet(PID.DATA0, d)
+    yield harness.host_expect_ack()
+    words = yield read_words('out')
+    crc = crc16(d)
+    expected = [(4, 0x04030201), (4, crc[0] << 24 | 0x070605), (1, crc[1])]
+    if words != expected:
+        raise TestFailure("OUT words were {}, expected {}".format(words, expected))
+    yield harness.write(harness.csrs['usb_out_ev_pending'], 0xff)
+
+    # A full sized packet, through the harness
+    d = [(i * 7) & 0xff for i in range(64)]
+    yield harness.transaction_data_out(0, ep1, d, datax=PID.DATA1)
+
 @cocotb.test()
 def test_out_transfer(dut):
     harness = UsbTest(dut)
@@ -1729,14 +1828,8 @@ def test_reset(dut):
     if val != 23:
         raise TestFailure("usb address should have been 23, but was {}".format(val))
 
-    # SE0 condition
-    harness.dut.usb_d_p = 0
-    harness.dut.usb_d_n = 0
-    for i in range(0, 64):
-        yield RisingEdge(harness.dut.clk12)
-
-    harness.dut.usb_d_p = 1
-    harness.dut.usb_d_n = 0
+    # SE0 condition, 64 clk12 cycles long
+    yield harness._host_send_wire('_'*4*64 + 'J')
     for i in range(0, 64):
         yield RisingEdge(harness.dut.clk12)
 
@@ -1782,7 +1875,7 @@ def out_nak_different_ep(dut):
 
 ### VERIFY DEVICE SEES CORRECT EP NUMBER
     harness.dut._log.info("verifying device sees correct ep number")
-    incoming_ep = yield harness.read(harness.csrs['usb_out_status'])
+    incoming_ep = yield harness.regs.usb_out_status.read(harness.wb)
     if (incoming_ep & 0xf) != 3:
         raise TestFailure("incorrect first-stage incoming EP.  Expected 3, got: {} (status: {:02x})".format(incoming_ep & 0xf, incoming_ep))
 
@@ -1795,6 +1888,6 @@ def out_nak_different_ep(dut):
 
 ### VERIFY DEVICE STILL SEES CORRECT ADDRESS
     harness.dut._log.info("verifying device still sees correct address")
-    incoming_ep = yield harness.read(harness.csrs['usb_out_status'])
+    incoming_ep = yield harness.regs.usb_out_status.read(harness.wb)
     if (incoming_ep & 0xf) != 3:
         raise TestFailure("incorrect first-stage incoming EP.  Expected 3, got: {} (status: {:02x})".format(incoming_ep & 0xf, incoming_ep))
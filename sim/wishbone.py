@@ -13,6 +13,19 @@ def is_sequence(arg):
     hasattr(arg, "__getitem__") or
     hasattr(arg, "__iter__"))
 
+# Cycle type identifiers (CTI) and burst type extensions (BTE) of the
+# Wishbone B4 registered feedback bus cycles.
+CTI_CLASSIC     = 0b000
+CTI_CONSTANT    = 0b001
+CTI_INCREMENT   = 0b010
+CTI_END         = 0b111
+
+BTE_LINEAR      = 0b00
+BTE_WRAP4       = 0b01
+BTE_WRAP8       = 0b10
+BTE_WRAP16      = 0b11
+
+
 class WBAux():
     """
     Wishbone Auxiliary Wrapper Class
@@ -35,11 +48,13 @@ class WBOp():
 
     an attempt to wrap em tidy
     """
-    def __init__(self, adr=0, dat=None, idle=0, sel=0xf):
+    def __init__(self, adr=0, dat=None, idle=0, sel=0xf, cti=CTI_CLASSIC, bte=BTE_LINEAR):
         self.adr    = adr
         self.dat    = dat
         self.sel    = sel
         self.idle   = idle
+        self.cti    = cti
+        self.bte    = bte
 
 @public
 class WBRes():
@@ -65,7 +80,7 @@ class Wishbone(BusDriver):
     Wishbone
     """
     _signals = ["cyc", "stb", "we", "sel", "adr", "datwr", "datrd", "ack"]
-    _optional_signals = ["err", "stall", "rty"]
+    _optional_signals = ["err", "stall", "rty", "cti", "bte"]
 
 
     def __init__(self, entity, name, clock, width=32):
@@ -77,6 +92,10 @@ class Wishbone(BusDriver):
         self.bus.we.setimmediatevalue(0)
         self.bus.adr.setimmediatevalue(0)
         self.bus.datwr.setimmediatevalue(0)
+        if hasattr(self.bus, "cti"):
+            self.bus.cti.setimmediatevalue(CTI_CLASSIC)
+        if hasattr(self.bus, "bte"):
+            self.bus.bte.setimmediatevalue(BTE_LINEAR)
 
         v = self.bus.sel.value
         v.binstr = "1" * len(self.bus.sel)
@@ -86,6 +105,14 @@ class Wishbone(BusDriver):
 class WishboneMaster(Wishbone):
     """
     Wishbone master
+
+    All the operations given to `send_cycle` share one cycle.  If the bus
+    has a `stall` line it is driven as pipelined Wishbone: a new operation
+    is issued on every clock the slave doesn't stall, and the acks are
+    collected as they come back.  Otherwise each operation waits for its
+    ack, but `stb` stays high between them, so the slave sees them back to
+    back.  `read_burst` and `write_burst` mark the operations as an
+    incrementing burst on the `cti` and `bte` lines, when the bus has them.
     """
     def __init__(self, entity, name, clock, timeout=None, width=32):
         sTo = ", no cycle timeout"
@@ -154,6 +181,10 @@ class WishboneMaster(Wishbone):
         self.busy = False
         self.busy_event.set()
         self.bus.cyc <= 0 
+        if hasattr(self.bus, "cti"):
+            self.bus.cti <= CTI_CLASSIC
+        if hasattr(self.bus, "bte"):
+            self.bus.bte <= BTE_LINEAR
         yield clkedge
 
 
@@ -227,7 +258,7 @@ class WishboneMaster(Wishbone):
 
 
     @coroutine
-    def _drive(self, we, adr, datwr, sel, idle):
+    def _drive(self, we, adr, datwr, sel, idle, cti=CTI_CLASSIC, bte=BTE_LINEAR):
         """
         Drive the Wishbone Master Out Lines
         """
@@ -246,6 +277,10 @@ class WishboneMaster(Wishbone):
             self.bus.sel    <= sel
             self.bus.datwr  <= datwr
             self.bus.we     <= we
+            if hasattr(self.bus, "cti"):
+                self.bus.cti    <= cti
+            if hasattr(self.bus, "bte"):
+                self.bus.bte    <= bte
             yield clkedge
             #deal with flow control (pipelined wishbone)
             stalled = yield self._wait_stall()
@@ -296,7 +331,7 @@ class WishboneMaster(Wishbone):
                     else:
                         we  = 0
                         dat = 0
-                    yield self._drive(we, op.adr, dat, op.sel, op.idle)
+                    yield self._drive(we, op.adr, dat, op.sel, op.idle, op.cti, op.bte)
                     self.log.debug("#%3u WE: %s ADR: 0x%08x DAT: 0x%08x SEL: 0x%1x IDLE: %3u" % (cnt, we, op.adr<<2, dat, op.sel, op.idle))
                     cnt += 1
                 yield self._close_cycle()
@@ -328,4 +363,47 @@ class WishboneMaster(Wishbone):
         result = yield self.send_cycle([WBOp(adr>>2, data)])
         for rec in result:
             self.log.debug("Result: {}".format(rec))
-        raise ReturnValue(0)
\ No newline at end of file
+        raise ReturnValue(0)
+
+    @coroutine
+    def read_many(self, adrs):
+        """Read each address of `adrs` within a single cycle."""
+        ops = [WBOp(adr>>2) for adr in adrs]
+        result = []
+        if ops:
+            result = yield self.send_cycle(ops)
+        raise ReturnValue([rec.datrd for rec in result])
+
+    @coroutine
+    def write_many(self, writes):
+        """Write each (address, data) pair of `writes` within a single cycle."""
+        ops = [WBOp(adr>>2, data) for adr, data in writes]
+        if ops:
+            yield self.send_cycle(ops)
+        raise ReturnValue(0)
+
+    def _burst(self, adr, datas, bte):
+        # Word addresses of the beats, wrapping at 4, 8 or 16 words for the
+        # wrapping burst types.
+        start = adr>>2
+        wrap = {BTE_WRAP4: 4, BTE_WRAP8: 8, BTE_WRAP16: 16}.get(bte)
+        ops = []
+        for i, data in enumerate(datas):
+            word = start + i
+            if wrap is not None:
+                word = (start & ~(wrap - 1)) | (word & (wrap - 1))
+            cti = CTI_END if i == len(datas) - 1 else CTI_INCREMENT
+            ops.append(WBOp(word, data, cti=cti, bte=bte))
+        return ops
+
+    @coroutine
+    def read_burst(self, adr, count, bte=BTE_LINEAR):
+        """Read `count` words from `adr` onwards as one incrementing burst."""
+        result = yield self.send_cycle(self._burst(adr, [None]*count, bte))
+        raise ReturnValue([rec.datrd for rec in result])
+
+    @coroutine
+    def write_burst(self, adr, datas, bte=BTE_LINEAR):
+        """Write `datas` from `adr` onwards as one incrementing burst."""
+        yield self.send_cycle(self._burst(adr, datas, bte))
+        raise ReturnValue(0)
@@ -12,6 +12,7 @@ from ..utils.packet import crc16
 
 from ..test.common import BaseUsbTestCase, CommonUsbTestCase
 from ..test.clock import CommonTestMultiClockDomain
+from ..test.traffic import CommonUsbSoakTestCase
 
 from .epfifo import PerEndpointFifoInterface
 
@@ -19,11 +20,21 @@ from .epfifo import PerEndpointFifoInterface
 class TestPerEndpointFifoInterface(
         BaseUsbTestCase,
         CommonUsbTestCase,
+        CommonUsbSoakTestCase,
         CommonTestMultiClockDomain,
         unittest.TestCase):
 
     maxDiff=None
 
+    # Clock periods, test/sweep.py varies the sys clock.
+    clocks={
+        "sys": 2,
+        "usb_48": 8,
+        "usb_12": 32,
+    }
+
+    soak_endpoints = (0, 1, 3, 4, 5)
+
     def get_endpoint(self, epaddr):
         epdir = EndpointType.epdir(epaddr)
         epnum = EndpointType.epnum(epaddr)
@@ -51,16 +62,18 @@ class TestPerEndpointFifoInterface(
         else:
             debug = False
 
-        self.iobuf = FakeIoBuf()
         self.endpoints = [EndpointType.BIDIR, EndpointType.IN, EndpointType.BIDIR]
-        self.dut = PerEndpointFifoInterface(self.iobuf, self.endpoints, debug=debug)
+        self.dut = self.cached_dut(
+            lambda: PerEndpointFifoInterface(FakeIoBuf(), self.endpoints, debug=debug),
+            tuple(self.endpoints), debug)
+        self.iobuf = self.dut.iobuf
 
         self.packet_h2d = Signal(1)
         self.packet_d2h = Signal(1)
         self.packet_idle = Signal(1)
 
     def run_sim(self, stim):
-        def padfront():
+        def connect():
             yield
             yield
             yield
@@ -89,24 +102,20 @@ class TestPerEndpointFifoInterface(
 
             yield
             yield from self.idle()
-            yield from stim()
+
+        def run(generator, testsuffix=None):
+            self.run_simulation(
+                self.dut,
+                self.clock_generators(generator, self.clocks),
+                vcd_name=self.make_vcd_name(testsuffix=testsuffix),
+                clocks=self.clocks,
+            )
 
         CommonUsbTestCase.patch_csrs(self)
-        run_simulation(
-            self.dut,
-            padfront(),
-            vcd_name=self.make_vcd_name(),
-            #clocks={
-            #    "sys": 12,
-            #    "usb_48": 48,
-            #    "usb_12": 192,
-            #},
-            clocks={
-                "sys": 2,
-                "usb_48": 8,
-                "usb_12": 32,
-            },
-        )
+        # Every test starts from a connected device, which is only simulated
+        # once per DUT, see BaseUsbTestCase.checkpoint.
+        self.checkpoint("connected", lambda: run(connect(), "connect"))
+        run(stim())
         print("-"*10)
 
     def tick_sys(self):
@@ -117,8 +126,7 @@ class TestPerEndpointFifoInterface(
         yield from self.wait_for_edge("usb_48")
 
     def tick_usb12(self):
-        for i in range(0, 4):
-            yield from self.tick_usb48()
+        yield from self.wait_for_edge("usb_48", 4)
 
     def update_internal_signals(self):
         yield from self.update_clocks()
@@ -202,8 +210,8 @@ class TestPerEndpointFifoInterface(
             self.assertTrue(
                 bool(empty), "Buffer empty after setting data!")
 
-    def expect_data(self, epaddr, data):
-        """Expect that an endpoints buffer has given contents."""
+    def read_data(self, epaddr):
+        """Read an endpoints buffer, including the CRC16."""
         endpoint = self.get_endpoint(epaddr)
 
         # Make sure there is something pending
@@ -219,6 +227,11 @@ class TestPerEndpointFifoInterface(
             v = yield from endpoint.obuf_head.read()
             actual_data.append(v)
             yield
+        return actual_data
+
+    def expect_data(self, epaddr, data):
+        """Expect that an endpoints buffer has given contents."""
+        actual_data = yield from self.read_data(epaddr)
 
         assert len(actual_data) >= 2, actual_data
         actual_data, actual_crc16 = actual_data[:-2], actual_data[-2:]
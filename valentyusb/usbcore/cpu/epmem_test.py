@@ -31,15 +31,16 @@ class TestMemInterface(
 
     def setUp(self):
         CommonTestMultiClockDomain.setUp(self, ("usb_12", "usb_48"))
-        self.iobuf = FakeIoBuf()
-        self.dut = MemInterface(self.iobuf, num_endpoints=3)
+        self.dut = self.cached_dut(
+            lambda: MemInterface(FakeIoBuf(), num_endpoints=3), 3)
+        self.iobuf = self.dut.iobuf
 
         self.packet_h2d = Signal(1)
         self.packet_d2h = Signal(1)
         self.packet_idle = Signal(1)
 
     def run_sim(self, stim):
-        def padfront():
+        def connect():
             yield
             yield
             yield
@@ -50,21 +51,28 @@ class TestMemInterface(
             yield
             yield
             yield from self.idle()
-            yield from stim()
 
         # print()
         # print("-"*10)
+        clocks = {
+            "sys": 2,
+            "usb_48": 8,
+            "usb_12": 32,
+        }
+
+        def run(generator, testsuffix=None):
+            self.run_simulation(
+                self.dut,
+                self.clock_generators(generator, clocks),
+                vcd_name=self.make_vcd_name(testsuffix=testsuffix),
+                clocks=clocks,
+            )
+
         CommonUsbTestCase.patch_csrs(self)
-        run_simulation(
-            self.dut,
-            padfront(),
-            vcd_name=self.make_vcd_name(),
-            clocks={
-                "sys": 2,
-                "usb_48": 8,
-                "usb_12": 32,
-            },
-        )
+        # Every test starts from a connected device, which is only simulated
+        # once per DUT, see BaseUsbTestCase.checkpoint.
+        self.checkpoint("connected", lambda: run(connect(), "connect"))
+        run(stim())
         # print("-"*10)
 
     def tick_sys(self):
@@ -75,8 +83,7 @@ class TestMemInterface(
         yield from self.wait_for_edge("usb_48")
 
     def tick_usb12(self):
-        for i in range(0, 4):
-            yield from self.tick_usb48()
+        yield from self.wait_for_edge("usb_48", 4)
 
     def update_internal_signals(self):
         yield from self.update_clocks()
@@ -82,6 +82,10 @@ class TriEndpointInterface(Module, AutoCSR, AutoDoc):
         Set ``relax_timing=True`` to enable registered accesses for certain operations
         to allow for a higher Fmax at the expense of logic cells.
 
+    wide (bool, optional): Make ``IN_DATA``, ``OUT_DATA`` and ``SETUP_DATA`` 32 bits
+        wide, so that each access moves up to four bytes through the FIFOs.  This
+        saves CSR accesses on a CPU with a 32-bit CSR bus, at the cost of wider FIFOs.
+
     Attributes
     ----------
 
@@ -90,7 +94,7 @@ class TriEndpointInterface(Module, AutoCSR, AutoDoc):
         master for you to connect to your desired Wishbone bus.
     """
 
-    def __init__(self, iobuf, debug=False, burst=False, cdc=False, relax_timing=False):
+    def __init__(self, iobuf, debug=False, burst=False, cdc=False, relax_timing=False, wide=False):
 
         self.background = ModuleDoc(title="USB Device Tri-FIFO", body="""
             This is a three-FIFO USB device.  It presents one FIFO each for ``IN``, ``OUT``, and
@@ -129,6 +133,11 @@ class TriEndpointInterface(Module, AutoCSR, AutoDoc):
             To send an empty packet, avoid writing any data to ``IN_DATA`` and simply write
             the endpoint number to ``IN_CTRL.EPNO``.
 
+            If the interface is built with ``wide=True``, ``IN_DATA`` is 32 bits wide and
+            each write adds ``IN_COUNT.COUNT`` + 1 bytes to the FIFO, starting with the
+            least significant byte.  ``IN_COUNT`` keeps its value, so a packet is usually
+            filled four bytes at a time, with ``IN_COUNT`` lowered for its last write.
+
             The CRC16 will be automatically appended to the end of the transfer.
 
             OUT Transfers
@@ -158,6 +167,12 @@ class TriEndpointInterface(Module, AutoCSR, AutoDoc):
             Additionally, to continue receiving data on that particular endpoint, you will need
             to re-enable it by writing the endpoint number, along with the ``OUT_CTRL.ENABLE``
             to ``OUT_CTRL``.
+
+            If the interface is built with ``wide=True``, each read of ``OUT_DATA`` returns up
+            to four bytes of the packet, starting with the least significant byte, and
+            ``OUT_STATUS.COUNT`` tells how many of them are valid.  ``SETUP_DATA`` works the
+            same way, with ``SETUP_STATUS.COUNT``, so the eight bytes of a ``SETUP`` packet
+            take two reads, followed by a third for the CRC16.
             """)
         self.control_transfers = ModuleDoc(title="Control Transfers", body="""
             Control transfers are complicated, and are the first sort of transfer that
@@ -267,15 +282,15 @@ class TriEndpointInterface(Module, AutoCSR, AutoDoc):
         )
 
         # Handlers
-        self.submodules.setup = setup_handler = SetupHandler(usb_core, cdc=cdc)
+        self.submodules.setup = setup_handler = SetupHandler(usb_core, cdc=cdc, wide=wide)
         self.comb += setup_handler.usb_reset.eq(usb_core.usb_reset)
         ems.append(setup_handler.ev)
 
-        in_handler = InHandler(usb_core, cdc=cdc)
+        in_handler = InHandler(usb_core, cdc=cdc, wide=wide)
         self.submodules.__setattr__("in", in_handler)
         ems.append(in_handler.ev)
 
-        self.submodules.out = out_handler = OutHandler(usb_core, cdc=cdc)
+        self.submodules.out = out_handler = OutHandler(usb_core, cdc=cdc, wide=wide)
         ems.append(out_handler.ev)
 
         self.submodules.ev = ev.SharedIRQ(*ems)
@@ -452,6 +467,49 @@ class TriEndpointInterface(Module, AutoCSR, AutoDoc):
 
         self.comb += usb_core.reset.eq(usb_core.error | usb_core_reset)
 
+class _WordPacker(Module):
+    """Packs received bytes into FIFO entries of up to four bytes.
+
+    Each entry holds the bytes in its low 32 bits, the first one in the lowest
+    byte, and the number of bytes, less one, in the top two bits.  Whole words
+    are output as their last byte comes in, and the last, partial one when
+    ``flush`` is asserted at the end of the packet.
+    """
+    def __init__(self):
+        self.sink_data = Signal(8)
+        self.sink_put = Signal()
+        self.flush = Signal()
+
+        self.source_data = Signal(34)
+        self.source_put = Signal()
+
+        held = Signal(24)
+        held_count = Signal(2)
+
+        self.comb += [
+            If(self.sink_put & (held_count == 3),
+                self.source_data.eq(Cat(held, self.sink_data, C(3, 2))),
+                self.source_put.eq(1),
+            ).Elif(self.flush & (held_count != 0),
+                self.source_data.eq(Cat(held, C(0, 8), (held_count - 1)[0:2])),
+                self.source_put.eq(1),
+            ),
+        ]
+        self.sync += [
+            If(self.sink_put,
+                If(held_count == 3,
+                    held.eq(0),
+                    held_count.eq(0),
+                ).Else(
+                    Array(held[8*i:8*(i+1)] for i in range(3))[held_count].eq(self.sink_data),
+                    held_count.eq(held_count + 1),
+                ),
+            ).Elif(self.flush,
+                held.eq(0),
+                held_count.eq(0),
+            ),
+        ]
+
 class SetupHandler(Module, AutoCSR):
     """Handle ``SETUP`` packets
 
@@ -470,6 +528,9 @@ class SetupHandler(Module, AutoCSR):
     Drain the FIFO by reading from ``SETUP_DATA``, then setting
     ``SETUP_CTRL.ADVANCE``.
 
+    With ``wide``, ``SETUP_DATA`` returns up to four bytes per read, and
+    ``SETUP_STATUS.COUNT`` tells how many.
+
     Attributes
     ----------
 
@@ -493,7 +554,7 @@ class SetupHandler(Module, AutoCSR):
 
     """
 
-    def __init__(self, usb_core, cdc=False):
+    def __init__(self, usb_core, cdc=False, wide=False):
 
         self.reset = Signal()
         self.begin = Signal()
@@ -503,11 +564,19 @@ class SetupHandler(Module, AutoCSR):
         self.usb_reset = Signal()
 
         # Register Interface
-        self.data = data = CSRStatus(
-            fields=[CSRField("data", 8, description="The next byte of ``SETUP`` data")],
-            description="""Data from the last ``SETUP`` transactions.  It will be 10 bytes long, because
-                           it will include the CRC16.  This is a FIFO, and the queue is advanced automatically."""
-        )
+        if wide:
+            self.data = data = CSRStatus(
+                fields=[CSRField("data", 32, description="The next bytes of ``SETUP`` data, the first one in the lowest byte")],
+                description="""Data from the last ``SETUP`` transactions, up to four bytes at a time.  ``SETUP_STATUS.COUNT``
+                               tells how many bytes are valid.  It will be 10 bytes long, because it will include the CRC16.
+                               This is a FIFO, and the queue is advanced automatically."""
+            )
+        else:
+            self.data = data = CSRStatus(
+                fields=[CSRField("data", 8, description="The next byte of ``SETUP`` data")],
+                description="""Data from the last ``SETUP`` transactions.  It will be 10 bytes long, because
+                               it will include the CRC16.  This is a FIFO, and the queue is advanced automatically."""
+            )
 
         self.ctrl = ctrl = CSRStorage(
             fields=[
@@ -516,14 +585,17 @@ class SetupHandler(Module, AutoCSR):
             description="Controls for managing how to handle ``SETUP`` transactions."
         )
 
+        status_fields = [
+            CSRField("epno", 4, description="The destination endpoint for the most recent SETUP token."),
+            CSRField("have", description="``1`` if there is data in the FIFO."),
+            CSRField("pend", description="``1`` if there is an IRQ pending."),
+            CSRField("is_in", description="``1`` if an IN stage was detected."),
+            CSRField("data", description="``1`` if a DATA stage is expected."),
+        ]
+        if wide:
+            status_fields.append(CSRField("count", 3, description="The number of bytes in ``SETUP_DATA``, or ``0`` if the FIFO is empty."))
         self.status = status = CSRStatus(
-            fields=[
-                CSRField("epno", 4, description="The destination endpoint for the most recent SETUP token."),
-                CSRField("have", description="``1`` if there is data in the FIFO."),
-                CSRField("pend", description="``1`` if there is an IRQ pending."),
-                CSRField("is_in", description="``1`` if an IN stage was detected."),
-                CSRField("data", description="``1`` if a DATA stage is expected."),
-            ],
+            fields=status_fields,
             description="Status about the most recent ``SETUP`` transactions, and the state of the FIFO."
         )
 
@@ -548,12 +620,13 @@ class SetupHandler(Module, AutoCSR):
         self.response = Signal()
 
         class SetupHandlerInner(Module):
-            def __init__(self, cdc=False):
+            def __init__(self, cdc=False, wide=False):
+                # In wide mode the 10 bytes are packed into three entries, see _WordPacker.
                 if cdc:
                     self.submodules.setupfifo = ResetInserter(["usb_12", "sys"])(ClockDomainsRenamer({"write": "usb_12", "read": "sys"})(
-                        fifo.AsyncFIFO(width=8, depth=16)))  # 10
+                        fifo.AsyncFIFO(width=34, depth=4) if wide else fifo.AsyncFIFO(width=8, depth=16)))  # 10
                 else:
-                    self.submodules.setupfifo = fifo.SyncFIFOBuffered(width=8, depth=10)
+                    self.submodules.setupfifo = fifo.SyncFIFOBuffered(width=34, depth=3) if wide else fifo.SyncFIFOBuffered(width=8, depth=10)
 
                 # Indicates which byte of `SETUP` data we're currently on.
                 data_byte = Signal(4)
@@ -608,15 +681,30 @@ class SetupHandler(Module, AutoCSR):
                     # Advance the FIFO when a byte is read
                     self.setupfifo.re.eq(data.we & self.setupfifo.readable),
 
-                    If(usb_core.tok == PID.SETUP,
-                        self.setupfifo.din.eq(data_recv_payload),
-                        self.setupfifo.we.eq(data_recv_put),
-                    ),
-
                     # Tie the trigger to the STATUS.HAVE bit
                     trigger.eq(self.setupfifo.readable & setup_sys),
                 ]
 
+                if wide:
+                    self.submodules.packer = packer = ClockDomainsRenamer("usb_12")(_WordPacker())
+                    self.comb += [
+                        If(usb_core.tok == PID.SETUP,
+                            packer.sink_data.eq(data_recv_payload),
+                            packer.sink_put.eq(data_recv_put),
+                        ),
+                        packer.flush.eq(usb_core.end),
+                        self.setupfifo.din.eq(packer.source_data),
+                        self.setupfifo.we.eq(packer.source_put),
+                        status.fields.count.eq(Mux(self.setupfifo.readable, self.setupfifo.dout[32:] + 1, 0)),
+                    ]
+                else:
+                    self.comb += [
+                        If(usb_core.tok == PID.SETUP,
+                            self.setupfifo.din.eq(data_recv_payload),
+                            self.setupfifo.we.eq(data_recv_put),
+                        ),
+                    ]
+
                 self.sync.usb_12 += [
                     # The 6th and 7th bytes of SETUP data are
                     # the wLength field.  If these are nonzero,
@@ -647,7 +735,7 @@ class SetupHandler(Module, AutoCSR):
             # Thus, we compute a "reset_signal" in the sys domain, capture it to usb_12 using BlindTransfer,
             # then we bring it *back* into sys using a MultiReg to enforce strict reset ordering
             reset_signal = Signal()
-            self.submodules.inner = inner = ResetInserter(["sys", "usb_12"])(SetupHandlerInner(cdc=cdc))
+            self.submodules.inner = inner = ResetInserter(["sys", "usb_12"])(SetupHandlerInner(cdc=cdc, wide=wide))
             self.submodules.setupreset = BlindTransfer("sys", "usb_12")
             self.comb += [
                 self.setupreset.i.eq(reset_signal),
@@ -659,7 +747,7 @@ class SetupHandler(Module, AutoCSR):
                 self.ev.packet.clear.eq(self.begin_sys),
             ]
         else:
-            self.submodules.inner = inner = ResetInserter()(ClockDomainsRenamer({"usb_12":"sys"})(SetupHandlerInner()))
+            self.submodules.inner = inner = ResetInserter()(ClockDomainsRenamer({"usb_12":"sys"})(SetupHandlerInner(wide=wide)))
             self.comb += [
                 inner.reset.eq(self.reset | self.begin | ctrl.fields.reset),
                 self.ev.packet.clear.eq(self.begin),
@@ -682,11 +770,15 @@ class InHandler(Module, AutoCSR):
     To send data, fill the FIFO by writing bytes to ``IN_DATA``.  When you're ready
     to transmit, write the destination endpoint number to ``IN_CTRL``.
 
+    With ``wide``, ``IN_DATA`` takes up to four bytes per write, the number set by
+    ``IN_COUNT``.  The FIFO then holds whole writes, and the bytes are taken apart
+    on their way out.
+
     Attributes
     ----------
 
     """
-    def __init__(self, usb_core, cdc=False):
+    def __init__(self, usb_core, cdc=False, wide=False):
         if cdc:
             self.dtb_12 = Signal()
 
@@ -707,21 +799,36 @@ class InHandler(Module, AutoCSR):
         # A list of endpoints that are stalled
         stall_status = Signal(16)
 
+        # In wide mode each FIFO entry is a write to `data`, with the number of
+        # bytes in it, less one, in the top two bits.
+        width = 34 if wide else 8
         if cdc:
-            self.submodules.data_buf = buf = ResetInserter(["usb_12", "sys"])(ClockDomainsRenamer({"write":"sys","read":"usb_12"})(fifo.AsyncFIFOBuffered(width=8, depth=64)))
+            self.submodules.data_buf = buf = ResetInserter(["usb_12", "sys"])(ClockDomainsRenamer({"write":"sys","read":"usb_12"})(fifo.AsyncFIFOBuffered(width=width, depth=64)))
         else:
-            self.submodules.data_buf = buf = ResetInserter()(fifo.SyncFIFOBuffered(width=8, depth=64))
-
-        self.data = CSRStorage(
-            fields=[
-                CSRField("data", 8, description="The next byte to add to the queue."),
-            ],
-            description="""
-                Each byte written into this register gets added to an outgoing FIFO. Any
-                bytes that are written here will be transmitted in the order in which
-                they were added.  The FIFO queue is automatically advanced with each write.
-                The FIFO queue is 64 bytes deep.  If you exceed this amount, the result is undefined."""
-        )
+            self.submodules.data_buf = buf = ResetInserter()(fifo.SyncFIFOBuffered(width=width, depth=64))
+
+        if wide:
+            self.data = CSRStorage(
+                fields=[
+                    CSRField("data", 32, description="The next bytes to add to the queue, the first one in the lowest byte."),
+                ],
+                description="""
+                    Each write to this register adds ``IN_COUNT.COUNT`` + 1 of its bytes to an
+                    outgoing FIFO, starting with the least significant byte.  Any bytes that are
+                    written here will be transmitted in the order in which they were added.
+                    The FIFO queue holds 64 writes.  If you exceed this amount, the result is undefined."""
+            )
+        else:
+            self.data = CSRStorage(
+                fields=[
+                    CSRField("data", 8, description="The next byte to add to the queue."),
+                ],
+                description="""
+                    Each byte written into this register gets added to an outgoing FIFO. Any
+                    bytes that are written here will be transmitted in the order in which
+                    they were added.  The FIFO queue is automatically advanced with each write.
+                    The FIFO queue is 64 bytes deep.  If you exceed this amount, the result is undefined."""
+            )
 
         self.ctrl = ctrl = CSRStorage(
             fields=[
@@ -745,6 +852,16 @@ class InHandler(Module, AutoCSR):
                 ``IN_STATUS.HAVE`` should go to ``1``."""
         )
 
+        if wide:
+            self.count = CSRStorage(
+                fields=[
+                    CSRField("count", 2, reset=3, description="The number of bytes, less one, that each write to ``IN_DATA`` adds."),
+                ],
+                description="""
+                    How many bytes of ``IN_DATA`` each write adds to the FIFO.  This keeps its
+                    value between writes, and starts out at four bytes."""
+            )
+
         self.submodules.ev = ev.EventManager()
         self.ev.submodules.packet = ev.EventSourcePulse(name="done", description="""
             Indicates that the host has successfully transferred an ``IN`` packet,
@@ -849,6 +966,39 @@ class InHandler(Module, AutoCSR):
         is_our_packet = Signal()
         is_in_packet = Signal()
 
+        # `data_out_advance` for this packet, and whether that empties the
+        # FIFO entry at the head.
+        advance = Signal()
+        if wide:
+            # Step through the bytes of the head entry, only popping it after
+            # the last one.
+            byte_sel = Signal(2)
+            last_byte = Signal()
+            head = Signal(8)
+            self.comb += [
+                last_byte.eq(byte_sel == buf.dout[32:]),
+                head.eq(Array(buf.dout[8*i:8*(i+1)] for i in range(4))[byte_sel]),
+                buf.re.eq(advance & last_byte),
+            ]
+            byte_sel_next = [
+                If(advance,
+                    If(last_byte,
+                        byte_sel.eq(0),
+                    ).Else(
+                        byte_sel.eq(byte_sel + 1),
+                    ),
+                ),
+            ]
+            if cdc:
+                self.sync.usb_12 += If(buf.reset_usb_12, byte_sel.eq(0)).Else(*byte_sel_next)
+            else:
+                self.sync += If(buf.reset, byte_sel.eq(0)).Else(*byte_sel_next)
+            data_in = Cat(self.data.storage, self.count.storage)
+        else:
+            head = buf.dout
+            self.comb += buf.re.eq(advance)
+            data_in = self.data.storage
+
         if cdc:
             is_in_packet_sys = Signal()
             is_our_packet_sys = Signal()
@@ -881,8 +1031,8 @@ class InHandler(Module, AutoCSR):
                 # Cause a trigger event when the `queued` value goes to 0
                 self.ev.packet.trigger.eq(~queued & was_queued),
 
-                self.data_out.eq(buf.dout),
-                buf.re.eq(self.data_out_advance & is_in_packet_sys & is_our_packet),
+                self.data_out.eq(head),
+                advance.eq(self.data_out_advance & is_in_packet_sys & is_our_packet),
                 is_our_packet.eq(usb_core.endp == epno12),
                 is_our_packet_sys.eq(endp_sys == ctrl.fields.epno),
                 is_in_packet.eq(usb_core.tok == PID.IN),
@@ -892,7 +1042,7 @@ class InHandler(Module, AutoCSR):
 
             self.comb += [
                 buf.we.eq(self.data.re),
-                buf.din.eq(self.data.storage),
+                buf.din.eq(data_in),
             ]
 
             #### HAZARD: ctrl_re_12 and reset_12 are coming from separate pulse synchronizers
@@ -971,11 +1121,11 @@ class InHandler(Module, AutoCSR):
 
                 self.dtb.eq(dtbs >> usb_core.endp),
 
-                self.data_out.eq(buf.dout),
+                self.data_out.eq(head),
                 self.data_out_have.eq(buf.readable),
-                buf.re.eq(self.data_out_advance & is_in_packet & is_our_packet),
+                advance.eq(self.data_out_advance & is_in_packet & is_our_packet),
                 buf.we.eq(self.data.re),
-                buf.din.eq(self.data.storage),
+                buf.din.eq(data_in),
                 is_our_packet.eq(usb_core.endp == ctrl.fields.epno),
                 is_in_packet.eq(usb_core.tok == PID.IN),
             ]
@@ -1022,25 +1172,42 @@ class OutHandler(Module, AutoCSR):
     To drain the FIFO, read from ``OUT.DATA``.  Don't forget to re-
     enable the FIFO by ensuring ``OUT_CTRL.ENABLE`` is set after advancing the FIFO!
 
+    With ``wide``, ``OUT_DATA`` returns up to four bytes per read, and
+    ``OUT_STATUS.COUNT`` tells how many.
+
     Attributes
     ----------
 
     """
-    def __init__(self, usb_core, cdc=False):
+    def __init__(self, usb_core, cdc=False, wide=False):
+        # In wide mode the 66 bytes are packed into 17 entries, see _WordPacker.
+        width = 34 if wide else 8
         if cdc:
-            self.submodules.data_buf = buf = ResetInserter(["sys", "usb_12"])(ClockDomainsRenamer({"write":"usb_12","read":"sys"})(fifo.AsyncFIFO(width=8, depth=128))) # 66
+            self.submodules.data_buf = buf = ResetInserter(["sys", "usb_12"])(ClockDomainsRenamer({"write":"usb_12","read":"sys"})(fifo.AsyncFIFO(width=width, depth=32 if wide else 128))) # 66
         else:
-            self.submodules.data_buf = buf = ResetInserter()(fifo.SyncFIFOBuffered(width=8, depth=66))
-
-        self.data = data = CSRStatus(
-            fields=[
-                CSRField("data", 8, description="The top byte of the receive FIFO."),
-            ],
-            description="""
-                Data received from the host will go into a FIFO.  This register
-                reflects the contents of the top byte in that FIFO.  Reading from
-                this register advances the FIFO pointer."""
-        )
+            self.submodules.data_buf = buf = ResetInserter()(fifo.SyncFIFOBuffered(width=width, depth=17 if wide else 66))
+
+        if wide:
+            self.data = data = CSRStatus(
+                fields=[
+                    CSRField("data", 32, description="The top bytes of the receive FIFO, the first one in the lowest byte."),
+                ],
+                description="""
+                    Data received from the host will go into a FIFO.  This register
+                    reflects up to four bytes at the top of that FIFO, ``OUT_STATUS.COUNT``
+                    tells how many.  Reading from this register advances the FIFO pointer
+                    past them."""
+            )
+        else:
+            self.data = data = CSRStatus(
+                fields=[
+                    CSRField("data", 8, description="The top byte of the receive FIFO."),
+                ],
+                description="""
+                    Data received from the host will go into a FIFO.  This register
+                    reflects the contents of the top byte in that FIFO.  Reading from
+                    this register advances the FIFO pointer."""
+            )
 
         self.ctrl = ctrl = CSRStorage(
             fields=[
@@ -1057,12 +1224,15 @@ class OutHandler(Module, AutoCSR):
                 Similarly, you can adjust the ``STALL`` state by setting or clearing the ``stall`` bit."""
         )
 
+        status_fields = [
+            CSRField("epno", 4, description="The destination endpoint for the most recent ``OUT`` packet."),
+            CSRField("have", description="``1`` if there is data in the FIFO."),
+            CSRField("pend", description="``1`` if there is an IRQ pending."),
+        ]
+        if wide:
+            status_fields.append(CSRField("count", 3, description="The number of bytes in ``OUT_DATA``, or ``0`` if the FIFO is empty."))
         self.status = CSRStatus(
-            fields=[
-                CSRField("epno", 4, description="The destination endpoint for the most recent ``OUT`` packet."),
-                CSRField("have", description="``1`` if there is data in the FIFO."),
-                CSRField("pend", description="``1`` if there is an IRQ pending."),
-            ],
+            fields=status_fields,
             description="Status about the current state of the `OUT` endpoint."
         )
 
@@ -1184,6 +1354,8 @@ class OutHandler(Module, AutoCSR):
         # Connect the buffer to the USB system
         self.data_recv_payload = Signal(8)
         self.data_recv_put = Signal()
+        # A byte of the packet we're responding to
+        recv_put = Signal()
         if cdc:
             self.submodules.bufressync = BlindTransfer("sys", "usb_12")
             self.comb += [
@@ -1196,7 +1368,7 @@ class OutHandler(Module, AutoCSR):
 
             # work around async buffer readable-X issue
             self.comb += self.status.fields.have.eq(buf.readable)
-            data_reg = Signal(8)
+            data_reg = Signal(width)
             self.sync += [
                 If(buf.readable,
                     data_reg.eq(buf.dout)
@@ -1208,9 +1380,12 @@ class OutHandler(Module, AutoCSR):
             self.comb += [
                 self.data.fields.data.eq(data_reg),
             ]
+            if wide:
+                count_reg = Signal(3)
+                self.sync += count_reg.eq(Mux(buf.readable, buf.dout[32:] + 1, 0))
+                self.comb += self.status.fields.count.eq(count_reg)
             self.comb += [
-                buf.din.eq(self.data_recv_payload),
-                buf.we.eq(self.data_recv_put & responding12),
+                recv_put.eq(self.data_recv_put & responding12),
 
                 self.status.fields.epno.eq(epno),
                 self.status.fields.pend.eq(self.ev.packet.pending),
@@ -1243,9 +1418,10 @@ class OutHandler(Module, AutoCSR):
                 ),
             ]
         else:
+            if wide:
+                self.comb += self.status.fields.count.eq(Mux(buf.readable, buf.dout[32:] + 1, 0))
             self.comb += [
-                buf.din.eq(self.data_recv_payload),
-                buf.we.eq(self.data_recv_put & responding),
+                recv_put.eq(self.data_recv_put & responding),
                 buf.reset.eq(ctrl.fields.reset),
                 self.data.fields.data.eq(buf.dout),
 
@@ -1282,6 +1458,25 @@ class OutHandler(Module, AutoCSR):
                 ),
             ]
 
+        if wide:
+            packer = _WordPacker()
+            if cdc:
+                packer = ClockDomainsRenamer("usb_12")(packer)
+            self.submodules.packer = packer = ResetInserter()(packer)
+            self.comb += [
+                packer.reset.eq(buf.reset_usb_12 if cdc else buf.reset),
+                packer.sink_data.eq(self.data_recv_payload),
+                packer.sink_put.eq(recv_put),
+                packer.flush.eq(usb_core.end),
+                buf.din.eq(packer.source_data),
+                buf.we.eq(packer.source_put),
+            ]
+        else:
+            self.comb += [
+                buf.din.eq(self.data_recv_payload),
+                buf.we.eq(recv_put),
+            ]
+
         # These are useful for debugging
         # self.enable_status = CSRStatus(8, description)
         # self.comb += self.enable_status.status.eq(enable_status)
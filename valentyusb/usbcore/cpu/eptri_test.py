@@ -7,13 +7,13 @@ from migen import *
 
 from ..endpoint import EndpointType, EndpointResponse
 from ..io_test import FakeIoBuf
-from ..pid import PIDTypes
+from ..pid import PID, PIDTypes
 from ..utils.packet import crc16
 
 from ..test.common import BaseUsbTestCase, CommonUsbTestCase
 from ..test.clock import CommonTestMultiClockDomain
 
-from .eptri import TriEndpointInterface
+from .eptri import InHandler, TriEndpointInterface, _WordPacker
 
 
 class TestTriEndpointInterface(
@@ -24,6 +24,15 @@ class TestTriEndpointInterface(
 
     maxDiff=None
 
+    # Clock periods, test/sweep.py varies the sys clock.
+    clocks={
+        "sys": 2,
+        "usb_48": 8,
+        "usb_12": 32,
+    }
+    # Whether the CSRs are in their own clock domain, see TriEndpointInterface.
+    cdc = False
+
     # def get_endpoint(self, epaddr):
     #     epdir = EndpointType.epdir(epaddr)
     #     epnum = EndpointType.epnum(epaddr)
@@ -51,15 +60,17 @@ class TestTriEndpointInterface(
         else:
             debug = False
 
-        self.iobuf = FakeIoBuf()
-        self.dut = TriEndpointInterface(self.iobuf, debug=debug)
+        self.dut = self.cached_dut(
+            lambda: TriEndpointInterface(FakeIoBuf(), debug=debug, cdc=self.cdc),
+            debug, self.cdc)
+        self.iobuf = self.dut.iobuf
 
         self.packet_h2d = Signal(1)
         self.packet_d2h = Signal(1)
         self.packet_idle = Signal(1)
 
     def run_sim(self, stim):
-        def padfront():
+        def connect():
             yield
             yield
             yield
@@ -88,23 +99,19 @@ class TestTriEndpointInterface(
 
             yield
             yield from self.idle()
-            yield from stim()
-
-        run_simulation(
-            self.dut,
-            padfront(),
-            vcd_name=self.make_vcd_name(),
-            #clocks={
-            #    "sys": 12,
-            #    "usb_48": 48,
-            #    "usb_12": 192,
-            #},
-            clocks={
-                "sys": 2,
-                "usb_48": 8,
-                "usb_12": 32,
-            },
-        )
+
+        def run(generator, testsuffix=None):
+            self.run_simulation(
+                self.dut,
+                self.clock_generators(generator, self.clocks),
+                vcd_name=self.make_vcd_name(testsuffix=testsuffix),
+                clocks=self.clocks,
+            )
+
+        # Every test starts from a connected device, which is only simulated
+        # once per DUT, see BaseUsbTestCase.checkpoint.
+        self.checkpoint("connected", lambda: run(connect(), "connect"))
+        run(stim())
         print("-"*10)
 
     def tick_sys(self):
@@ -115,8 +122,7 @@ class TestTriEndpointInterface(
         yield from self.wait_for_edge("usb_48")
 
     def tick_usb12(self):
-        for i in range(0, 4):
-            yield from self.tick_usb48()
+        yield from self.wait_for_edge("usb_48", 4)
 
     def update_internal_signals(self):
         yield from self.update_clocks()
@@ -229,8 +235,8 @@ class TestTriEndpointInterface(
         self.assertSequenceEqual(data, actual_data)
         self.assertSequenceEqual(crc16(data), actual_crc16)
 
-    def expect_data(self, epaddr, data):
-        """Expect that an endpoints buffer has given contents."""
+    def read_data(self, epaddr):
+        """Read an endpoints buffer, including the CRC16."""
         epdir = EndpointType.epdir(epaddr)
         epnum = EndpointType.epnum(epaddr)
 
@@ -249,6 +255,11 @@ class TestTriEndpointInterface(
             v = yield from self.dut.epout.data.read()
             actual_data.append(v)
             yield
+        return actual_data
+
+    def expect_data(self, epaddr, data):
+        """Expect that an endpoints buffer has given contents."""
+        actual_data = yield from self.read_data(epaddr)
 
         assert len(actual_data) >= 2, actual_data
         actual_data, actual_crc16 = actual_data[:-2], actual_data[-2:]
@@ -263,5 +274,98 @@ class TestTriEndpointInterface(
         return bool(status)
 
 
+class TestWordPacker(BaseUsbTestCase):
+    def packer_test(self, data):
+        """Put `data` into the packer a byte per cycle then flush it, and
+        return the entries it output as (bytes, count less one) pairs."""
+        dut = _WordPacker()
+        entries = []
+
+        def collect():
+            if (yield dut.source_put):
+                entry = yield dut.source_data
+                entries.append(([(entry >> 8*i) & 0xff for i in range(4)], entry >> 32))
+
+        def stim():
+            for d in data:
+                yield dut.sink_data.eq(d)
+                yield dut.sink_put.eq(1)
+                yield
+                yield from collect()
+            yield dut.sink_put.eq(0)
+            yield dut.flush.eq(1)
+            yield
+            yield from collect()
+            yield dut.flush.eq(0)
+            yield
+            yield from collect()
+
+        self.run_simulation(dut, stim(), vcd_name=self.make_vcd_name())
+        return entries
+
+    def test_whole_words(self):
+        self.assertEqual(self.packer_test(range(1, 9)), [
+            ([1, 2, 3, 4], 3),
+            ([5, 6, 7, 8], 3),
+        ])
+
+    def test_partial_final_word(self):
+        self.assertEqual(self.packer_test(range(1, 7)), [
+            ([1, 2, 3, 4], 3),
+            ([5, 6, 0, 0], 1),
+        ])
+
+    def test_crc_only(self):
+        # A zero length packet is just its two CRC bytes.
+        self.assertEqual(self.packer_test([0x00, 0x00]), [
+            ([0, 0, 0, 0], 1),
+        ])
+
+    def test_flush_empty(self):
+        self.assertEqual(self.packer_test([]), [])
+
+
+class TestWideInHandler(BaseUsbTestCase):
+    class FakeUsbCore(Module):
+        def __init__(self):
+            self.commit = Signal()
+            self.endp = Signal(4)
+            self.poll = Signal()
+            self.setup = Signal()
+            self.tok = Signal(4)
+
+    def test_byte_sel(self):
+        usb_core = self.FakeUsbCore()
+        dut = InHandler(usb_core, wide=True)
+        dut.submodules.usb_core = usb_core
+        self.assertEqual(len(dut.data_buf.din), 34)
+
+        writes = [(1, 0xccccbbaa), (3, 0x44332211), (0, 0x55)]
+        expected = [0xaa, 0xbb, 0x11, 0x22, 0x33, 0x44, 0x55]
+
+        def stim():
+            for count, data in writes:
+                yield from dut.count.write(count)
+                yield from dut.data.write(data)
+                yield
+                self.assertEqual((yield dut.data_buf.din), (count << 32) | data)
+            for _ in range(4):
+                yield
+
+            # Clock the bytes out, as the transmitter does for an IN to EP0.
+            yield usb_core.tok.eq(PID.IN)
+            actual = []
+            while (yield dut.data_out_have):
+                actual.append((yield dut.data_out))
+                yield dut.data_out_advance.eq(1)
+                yield
+                yield dut.data_out_advance.eq(0)
+                for _ in range(2):
+                    yield
+            self.assertEqual(actual, expected)
+
+        self.run_simulation(dut, stim(), vcd_name=self.make_vcd_name())
+
+
 if __name__ == '__main__':
     unittest.main()
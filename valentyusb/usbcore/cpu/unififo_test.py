@@ -21,10 +21,16 @@ class TestUsbUniFifo(
 
     maxDiff=None
 
+    # The Python CPU model's state, see update_internal_signals.
+    checkpoint_attrs = CommonTestMultiClockDomain.checkpoint_attrs + (
+        "state", "endpoints", "ep", "handshake")
+
     def setUp(self):
         CommonTestMultiClockDomain.setUp(self, ("usb_12", "usb_48"))
-        self.iobuf = FakeIoBuf()
-        self.dut = UsbUniFifo(self.iobuf)
+        # UsbUniFifo samples the pins in usb_48 but doesn't rename the iobuf.
+        self.dut = self.cached_dut(
+            lambda: UsbUniFifo(FakeIoBuf(domain="usb_48")))
+        self.iobuf = self.dut.iobuf
 
         self.states = [
             "WAIT",
@@ -84,7 +90,7 @@ class TestUsbUniFifo(
             self.endpoints[epaddr].addr = epaddr
 
     def run_sim(self, stim):
-        def padfront():
+        def connect():
             yield from self.next_state("WAIT")
             yield
             yield
@@ -96,7 +102,6 @@ class TestUsbUniFifo(
             yield
             yield
             yield from self.idle()
-            yield from stim()
 
         print()
         print("-"*10)
@@ -107,11 +112,17 @@ class TestUsbUniFifo(
             "usb_12": 192,
         }
 
-        run_simulation(
-            self.dut, padfront(),
-            vcd_name=self.make_vcd_name(),
-            clocks=clocks,
-        )
+        def run(generator, testsuffix=None):
+            self.run_simulation(
+                self.dut, self.clock_generators(generator, clocks),
+                vcd_name=self.make_vcd_name(testsuffix=testsuffix),
+                clocks=clocks,
+            )
+
+        # Every test starts from a connected device, which is only simulated
+        # once per DUT, see BaseUsbTestCase.checkpoint.
+        self.checkpoint("connected", lambda: run(connect(), "connect"))
+        run(stim())
         print("-"*10)
 
     def recv_packet(self):
@@ -178,8 +189,7 @@ class TestUsbUniFifo(
         yield from self.wait_for_edge("usb_48")
 
     def tick_usb12(self):
-        for i in range(0, 4):
-            yield from self.tick_usb48()
+        yield from self.wait_for_edge("usb_48", 4)
 
     def next_state(self, state):
         self.assertIn(state, self.states)
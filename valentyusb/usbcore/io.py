@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import unittest
+from collections import namedtuple
 
 from migen import *
 from migen.genlib.cdc import MultiReg
@@ -79,8 +80,153 @@ class IoBuf(Module):
         ]
 
 
+class FakeHostTransactor(Module):
+    """Simulation only host side driver for a FakeIoBuf.
+
+    A whole wrapped packet is loaded into `samples` with a single write (see
+    `send`), after which one sample is driven onto the rx pins per clock
+    cycle.  `done` strobes on the cycle the last sample is driven.  While
+    idle the rx pins are left alone, so `FakeIoBuf.recv` keeps working.
+    """
+
+    # Sample character -> (n, p) as a binary string, usb_p is the LSB.
+    _SAMPLE_BITS = str.maketrans({
+        'J': '01', 'I': '01', '-': '01',
+        'K': '10',
+        '_': '00', '0': '00',
+        '1': '11',
+    })
+
+    def __init__(self, usb_p, usb_n, depth=8192):
+        self.depth = depth
+        self.samples = Signal(2*depth)
+        self.length = Signal(max=depth+1)
+        self.index = Signal(max=depth+1)
+        self.busy = Signal()
+        self.done = Signal()
+
+        self.comb += self.busy.eq(self.index != self.length)
+        self.sync += [
+            self.done.eq(0),
+            If(self.busy,
+                Cat(usb_p, usb_n).eq(self.samples >> Cat(0, self.index)),
+                self.index.eq(self.index + 1),
+                If(self.index + 1 == self.length,
+                    self.done.eq(1),
+                ),
+            ),
+        ]
+
+    @classmethod
+    def encode(cls, packet):
+        """Pack a string of samples two bits per sample, first sample lowest.
+
+        >>> bin(FakeHostTransactor.encode('JK_'))
+        '0b1001'
+        """
+        bits = str(packet)[::-1].translate(cls._SAMPLE_BITS)
+        assert set(bits) <= {'0', '1'}, "Unknown value in: %s" % packet
+        return int(bits or '0', 2)
+
+    def send(self, packet):
+        """Start playing back `packet`, a string of J/K/_ samples."""
+        assert len(packet) <= self.depth, (len(packet), self.depth)
+        busy = yield self.busy
+        assert not busy, "Still sending!"
+        yield self.samples.eq(self.encode(packet))
+        yield self.length.eq(len(packet))
+        yield self.index.eq(0)
+
+
+# Bits of the longest full speed transmission: sync, PID, a 64 byte data
+# payload and CRC16, with a stuffed bit after every six of them and the EOP.
+_MAX_PACKET_BITS = (1 + 1 + 64 + 2) * 8
+MAX_PACKET_SAMPLES = 4 * (_MAX_PACKET_BITS + _MAX_PACKET_BITS // 6 + 3)
+
+
+class FakeDeviceMonitor(Module):
+    """Simulation only capture of a device transmission on a FakeIoBuf.
+
+    Once armed (see `arm`), the cycles spent waiting for `usb_tx_en` are
+    counted in `turnaround`, then one sample per clock cycle is recorded into
+    `samples` for as long as `usb_tx_en` stays high.  `ready` goes high when
+    the transmission has finished, and the record is read back with `capture`.
+    A transmission longer than `depth` samples is cut short and sets
+    `overflow`.  The default depth fits the longest full speed packet at four
+    samples per bit.
+    """
+
+    Capture = namedtuple("Capture", ["samples", "start", "turnaround", "overflow"])
+
+    _SAMPLE_CHARS = {0b00: '_', 0b01: 'J', 0b10: 'K', 0b11: '1'}
+
+    def __init__(self, usb_p, usb_n, usb_tx_en, depth=MAX_PACKET_SAMPLES):
+        self.depth = depth
+        self.samples = Signal(2*depth)
+        self.length = Signal(max=depth+1)
+        self.turnaround = Signal(32)
+        self.cycle = Signal(64)
+        self.start = Signal(64)
+        self.armed = Signal()
+        self.ready = Signal()
+        self.overflow = Signal()
+
+        self.sync += [
+            self.cycle.eq(self.cycle + 1),
+            If(self.armed & ~self.ready,
+                If(usb_tx_en,
+                    If(self.length != depth,
+                        self.samples.eq(
+                            self.samples | (Cat(usb_p, usb_n) << Cat(0, self.length))),
+                        self.length.eq(self.length + 1),
+                    ).Else(
+                        self.overflow.eq(1),
+                    ),
+                    If(self.length == 0,
+                        self.start.eq(self.cycle),
+                    ),
+                ).Elif(self.length != 0,
+                    self.ready.eq(1),
+                ).Else(
+                    self.turnaround.eq(self.turnaround + 1),
+                ),
+            ),
+        ]
+
+    @classmethod
+    def decode(cls, samples, length):
+        """Unpack `length` samples packed two bits per sample.
+
+        >>> FakeDeviceMonitor.decode(0b001001, 3)
+        'JK_'
+        >>> FakeDeviceMonitor.decode(FakeHostTransactor.encode('JK_J'), 4)
+        'JK_J'
+        """
+        return "".join(
+            cls._SAMPLE_CHARS[(samples >> (2*i)) & 0b11] for i in range(length))
+
+    def arm(self):
+        """Start waiting for the next transmission."""
+        yield self.samples.eq(0)
+        yield self.length.eq(0)
+        yield self.turnaround.eq(0)
+        yield self.ready.eq(0)
+        yield self.overflow.eq(0)
+        yield self.armed.eq(1)
+
+    def capture(self):
+        """Return the recorded transmission and disarm the monitor."""
+        samples = yield self.samples
+        length = yield self.length
+        start = yield self.start
+        turnaround = yield self.turnaround
+        overflow = yield self.overflow
+        yield self.armed.eq(0)
+        return self.Capture(self.decode(samples, length), start, turnaround, overflow)
+
+
 class FakeIoBuf(Module):
-    def __init__(self):
+    def __init__(self, domain="sys"):
         self.usb_pullup = Signal()
 
         self.usb_p = Signal()
@@ -115,6 +261,13 @@ class FakeIoBuf(Module):
             ),
         ]
 
+        # Simulation helpers, `domain` should be the clock domain the PHY
+        # samples the pins in.
+        self.submodules.host = ClockDomainsRenamer(domain)(
+            FakeHostTransactor(self.usb_p_rx_io, self.usb_n_rx_io))
+        self.submodules.monitor = ClockDomainsRenamer(domain)(
+            FakeDeviceMonitor(self.usb_p, self.usb_n, self.usb_tx_en))
+
     def recv(self, v):
         tx_en = yield self.usb_tx_en
         assert not tx_en, "Currently transmitting!"
@@ -4,7 +4,9 @@ import unittest
 
 from migen import *
 
-from .io import FakeIoBuf
+from .io import FakeIoBuf, FakeDeviceMonitor, MAX_PACKET_SAMPLES
+from .pid import PID
+from .utils.packet import data_packet, wrap_packet
 
 class TestIoBuf(unittest.TestCase):
     pass
@@ -64,6 +66,82 @@ class TestFakeIoBuf(unittest.TestCase):
             self.assertEqual((yield from self.dut.current()), 'K')
         run_simulation(self.dut, stim())
 
+    def test_host_send(self):
+        packet = "KJKJKJKK" + "JJJJJJJK" + "__J"
+        def stim():
+            yield
+            yield from self.dut.recv('J')
+            yield from self.dut.host.send(packet)
+            yield
+            seen = ""
+            done = 0
+            while not done:
+                yield
+                seen += yield from self.dut.current()
+                done = yield self.dut.host.done
+            self.assertEqual(seen, packet)
+            yield
+            self.assertEqual((yield from self.dut.current()), 'J')
+            self.assertFalse((yield self.dut.host.busy))
+
+            # Left alone while idle
+            yield from self.dut.recv('K')
+            yield
+            yield
+            self.assertEqual((yield from self.dut.current()), 'K')
+        run_simulation(self.dut, stim())
+
+    def test_device_capture(self):
+        packet = "KJKJKJKK" + "JKKKJJKK" + "__J"
+        values = {'J': (1, 0), 'K': (0, 1), '_': (0, 0)}
+        def stim():
+            yield
+            yield from self.dut.monitor.arm()
+            for i in range(5):
+                yield
+            yield self.dut.usb_tx_en.eq(1)
+            for v in packet:
+                p, n = values[v]
+                yield self.dut.usb_p_tx.eq(p)
+                yield self.dut.usb_n_tx.eq(n)
+                yield
+            yield self.dut.usb_tx_en.eq(0)
+            yield
+            yield
+            self.assertTrue((yield self.dut.monitor.ready))
+            capture = yield from self.dut.monitor.capture()
+            self.assertEqual(capture.samples, packet)
+            self.assertEqual(capture.turnaround, 5)
+            self.assertEqual(capture.start, 7)
+
+            # Disarmed, so later transmissions are ignored
+            yield self.dut.usb_tx_en.eq(1)
+            yield
+            yield
+            self.assertEqual((yield self.dut.monitor.length), len(packet))
+        run_simulation(self.dut, stim())
+
+    def test_device_capture_overflow(self):
+        dut = FakeDeviceMonitor(Signal(reset=1), Signal(), Signal(reset=1), depth=4)
+        def stim():
+            yield from dut.arm()
+            for i in range(6):
+                yield
+            self.assertTrue((yield dut.overflow))
+            capture = yield from dut.capture()
+            self.assertEqual(capture.samples, 'JJJJ')
+            self.assertTrue(capture.overflow)
+
+            yield from dut.arm()
+            yield
+            self.assertFalse((yield dut.overflow))
+        run_simulation(dut, stim())
+
+    def test_device_capture_depth(self):
+        # A 64 byte packet of ones, stuffed throughout, still fits.
+        samples = wrap_packet(data_packet(PID.DATA0, [0xff] * 64))
+        self.assertLessEqual(len(samples), MAX_PACKET_SAMPLES)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -52,7 +52,7 @@ class TestRxBitstuffRemover(BaseUsbTestCase):
         with self.subTest(short_name=short_name, vector=vector):
             dut = RxBitstuffRemover()
 
-            run_simulation(
+            self.run_simulation(
                 dut,
                 stim(**vector),
                 vcd_name=self.make_vcd_name(testsuffix=short_name),
@@ -83,7 +83,7 @@ class TestRxClockDataRecovery(BaseUsbTestCase):
 
                 dut = RxClockDataRecovery(usbp_raw, usbn_raw)
 
-                run_simulation(
+                self.run_simulation(
                     dut,
                     stim(),
                     vcd_name=self.make_vcd_name(
@@ -98,7 +98,7 @@ class TestRxClockDataRecovery(BaseUsbTestCase):
 
                     dut = RxClockDataRecovery(usbp_raw, usbn_raw)
 
-                    run_simulation(
+                    self.run_simulation(
                         dut,
                         stim(glitch),
                         vcd_name=self.make_vcd_name(
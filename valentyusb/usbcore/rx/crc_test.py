@@ -46,7 +46,7 @@ class TestRxCrcChecker(BaseUsbTestCase):
             i_data = dut.i_data
             i_reset = dut.i_reset
 
-            run_simulation(
+            self.run_simulation(
                 dut,
                 stim(**vector),
                 vcd_name=self.make_vcd_name(testsuffix=str(i)),
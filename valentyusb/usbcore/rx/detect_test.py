@@ -45,7 +45,7 @@ class TestRxPacketDetect(BaseUsbTestCase):
         with self.subTest(short_name=short_name, vector=vector):
             dut = RxPacketDetect()
 
-            run_simulation(
+            self.run_simulation(
                 dut,
                 stim(**vector),
                 vcd_name=self.make_vcd_name(testsuffix=short_name),
@@ -45,7 +45,7 @@ class TestRxNRZIDecoder(BaseUsbTestCase):
         with self.subTest(short_name=short_name, vector=vector):
             dut = RxNRZIDecoder()
 
-            run_simulation(
+            self.run_simulation(
                 dut,
                 stim(**vector),
                 vcd_name=self.make_vcd_name(testsuffix=short_name),
@@ -87,7 +87,7 @@ class TestRxPipeline(BaseUsbTestCase):
         with self.subTest(name=name):
             fname = name.replace(" ","_")
             dut = RxPipeline()
-            run_simulation(
+            self.run_simulation(
                 dut, stim(**vector),
                 vcd_name=self.make_vcd_name(testsuffix=fname),
                 clocks={"sys": 10, "usb_48": 40, "usb_12": 160},
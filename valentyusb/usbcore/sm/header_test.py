@@ -19,7 +19,7 @@ class TestPacketHeaderDecode(BaseUsbTestCase):
         rx = RxPipeline()
         dut = PacketHeaderDecode(rx)
 
-        run_simulation(
+        self.run_simulation(
             dut, stim(dut),
             vcd_name=self.make_vcd_name(),
             clocks={"sys": 12, "usb_48": 48, "usb_12": 192},
@@ -180,7 +180,7 @@ class TestTxPacketSendNoCrc(BaseUsbTestCase, CommonTxPacketSendTestCase):
         def stim(dut):
             yield from self.assert_packet_sent(dut, pid, data, ndata)
 
-        run_simulation(
+        self.run_simulation(
             dut, stim(dut),
             vcd_name=self.make_vcd_name(),
             clocks={"sys": 10, "usb_48": 40, "usb_12": 160},
@@ -202,7 +202,7 @@ class TestTxPacketSendAutoCrc(BaseUsbTestCase, CommonTxPacketSendTestCase):
         def stim(dut):
             yield from self.assert_packet_sent(dut, pid, data, ndata)
 
-        run_simulation(
+        self.run_simulation(
             dut, stim(dut),
             vcd_name=self.make_vcd_name(),
             clocks={"sys": 10, "usb_48": 40, "usb_12": 160},
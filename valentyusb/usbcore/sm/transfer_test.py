@@ -29,6 +29,8 @@ class TestUsbTransfer(
 
     maxDiff=None
 
+    checkpoint_attrs = CommonTestMultiClockDomain.checkpoint_attrs + ("endpoints",)
+
     def setUp(self):
         CommonTestMultiClockDomain.setUp(self, ("usb_12", "usb_48"))
 
@@ -82,7 +84,7 @@ class TestUsbTransfer(
             self.endpoints[epaddr].addr = epaddr
 
     def run_sim(self, stim):
-        def padfront():
+        def connect():
             yield self.packet_h2d.eq(0)
             yield self.packet_d2h.eq(0)
             yield self.packet_idle.eq(0)
@@ -95,16 +97,22 @@ class TestUsbTransfer(
             yield
             yield
             yield from self.idle()
-            yield from stim()
 
         print()
         print("-"*10)
-        run_simulation(
-            self.dut,
-            padfront(),
-            vcd_name=self.make_vcd_name(),
-            clocks={"sys": 12, "usb_48": 48, "usb_12": 192},
-        )
+
+        def run(generator, testsuffix=None):
+            self.run_simulation(
+                self.dut,
+                generator,
+                vcd_name=self.make_vcd_name(testsuffix=testsuffix),
+                clocks={"sys": 12, "usb_48": 48, "usb_12": 192},
+            )
+
+        # Every test starts from a connected device, which is only simulated
+        # once per DUT, see BaseUsbTestCase.checkpoint.
+        self.checkpoint("connected", lambda: run(connect(), "connect"))
+        run(stim())
         print("-"*10)
 
     def tick_sys(self):
@@ -0,0 +1,527 @@
+#!/usr/bin/env python3
+"""Measure how fast the CPU interfaces simulate.
+
+Every interface is fed the same traffic from the host side of a FakeIoBuf:
+SOFs, a GET_DESCRIPTOR control transfer on EP0 and 64 byte bulk OUT and IN
+transfers on EP2.  A minimal firmware, written against each interface's
+CSRs like the tests are, services the endpoints from the sys domain: it
+answers the control transfer with `DEVICE_DESCRIPTOR` and sends each bulk
+OUT packet back on the bulk IN endpoint.  The host retries NAKed
+transactions and checks every byte that comes back, and the firmware has to
+have been given every byte that was sent, so a run that only NAKs fails
+instead of looking fast.
+
+Each interface is measured in a fresh process, so that the peak memory is
+its own, and the results are written as JSON:
+
+    python3 -m usbcore.test.bench -o bench.json
+"""
+
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+from migen.sim import passive
+from migen.sim.core import Simulator
+
+from ..endpoint import EndpointResponse
+from ..io import FakeIoBuf
+from ..pid import PID
+from ..utils.packet import (data_packet, handshake_packet, sof_packet,
+                            token_packet, wrap_handshake_packet, wrap_packet)
+from .reuse import simulator_signals
+
+
+BENCH_CLOCKS = {"sys": 2, "usb_48": 8, "usb_12": 32}
+
+# usb_48 cycles to wait for a device response, a little over the 16 bit
+# times after which a host gives up.
+RESPONSE_TIMEOUT = 18*4
+
+# Captures longer than this are data packets, which the host ACKs.
+HANDSHAKE_SAMPLES = len(wrap_handshake_packet(PID.ACK)) + 8
+
+# Times the host repeats a NAKed transaction before giving up on the device.
+MAX_NAKS = 100
+
+BULK_SIZE = 64
+
+# The bulk endpoint, PerEndpointFifoInterface only has an OUT side on EP0
+# and EP2.
+BULK_EP = 2
+
+GET_DESCRIPTOR = [0x80, 0x06, 0x00, 0x01, 0x00, 0x00, 0x40, 0x00]
+
+# What DummyUsb answers GET_DESCRIPTOR with, the firmware sends the same.
+DEVICE_DESCRIPTOR = [
+    0x12, 0x01, 0x00, 0x02, 0x00, 0x00, 0x00, 0x40,
+    0x09, 0x12, 0xf0, 0x5b, 0x01, 0x01, 0x01, 0x02,
+    0x00, 0x01,
+]
+
+
+# `kind` is one of "sof", "setup", "out" or "in" and `packets` are the
+# unwrapped packets the host sends for it.  `data` is the payload sent by a
+# SETUP or OUT, or expected back from an IN.
+Transaction = collections.namedtuple(
+    "Transaction", ["kind", "ep", "packets", "data"])
+
+
+def traffic(rounds=10, addr=0, ep=BULK_EP):
+    """The transactions the host makes.
+
+    >>> transactions = traffic(rounds=1)
+    >>> [t.kind for t in transactions]
+    ['sof', 'setup', 'in', 'out', 'out', 'in']
+    >>> transactions[2].data == DEVICE_DESCRIPTOR
+    True
+    >>> transactions[-1].data == transactions[-2].data
+    True
+    >>> len(traffic(rounds=3)) == 3*len(transactions)
+    True
+    """
+    transactions = []
+    for i in range(rounds):
+        data = [(i + j) & 0xff for j in range(BULK_SIZE)]
+        transactions += [
+            Transaction("sof", None, [sof_packet(i)], None),
+            # Control transfer
+            Transaction("setup", 0, [
+                token_packet(PID.SETUP, addr, 0),
+                data_packet(PID.DATA0, GET_DESCRIPTOR),
+            ], GET_DESCRIPTOR),
+            Transaction("in", 0, [token_packet(PID.IN, addr, 0)],
+                        _control_response(GET_DESCRIPTOR)),
+            Transaction("out", 0, [
+                token_packet(PID.OUT, addr, 0),
+                data_packet(PID.DATA1, []),
+            ], []),
+            # Bulk OUT, echoed back by the IN
+            Transaction("out", ep, [
+                token_packet(PID.OUT, addr, ep),
+                data_packet((PID.DATA0, PID.DATA1)[i % 2], data),
+            ], data),
+            Transaction("in", ep, [token_packet(PID.IN, addr, ep)], data),
+        ]
+    return transactions
+
+
+def _bytes(packet):
+    """The bytes of an unwrapped packet, as the rx pipeline puts them out.
+
+    >>> _bytes(handshake_packet(PID.ACK)) == [PID.ACK | (PID.ACK ^ 0xf) << 4]
+    True
+    """
+    return [int(packet[i:i+8][::-1], 2) for i in range(0, len(packet), 8)]
+
+
+def _payloads(transactions, endpoints):
+    """What firmware should get: the SETUP and OUT data for `endpoints`."""
+    received = []
+    for t in transactions:
+        if t.kind in ("setup", "out") and t.ep in endpoints:
+            received += t.data
+    return received
+
+
+def _raw(transactions, endpoints):
+    """What firmware that sees the bus itself should get: every packet."""
+    return [b for t in transactions for packet in t.packets for b in _bytes(packet)]
+
+
+def _control_response(setup):
+    """The data the firmware answers a SETUP with."""
+    if setup[:4] == GET_DESCRIPTOR[:4]:
+        return DEVICE_DESCRIPTOR[:setup[6] | setup[7] << 8]
+    return []
+
+
+# Firmware ---------------------------------------------------------------
+#
+# Each runs in the sys domain, adds the payload of every packet it gets to
+# `received` and stops when the host does.
+
+@passive
+def _eptri_firmware(dut, received):
+    usb_in = getattr(dut, "in")
+
+    def read_fifo(handler):
+        # The status crosses over from usb_12 and lags the FIFO, so like
+        # sim/test-eptri.py wait a usb_12 cycle after each read.
+        data = []
+        while (yield from handler.status.read()) & 1 << 4:  # have
+            data.append((yield from handler.data.read()))
+            for i in range(BENCH_CLOCKS["usb_12"]//BENCH_CLOCKS["sys"]):
+                yield
+        return data
+
+    yield from dut.pullup._out.write(1)
+    for epno in (0, BULK_EP):
+        yield from dut.out.ctrl.write(epno | 1 << 4)  # enable
+
+    queue = []  # (epno, data) waiting for the IN FIFO
+    while True:
+        status = yield from dut.setup.status.read()
+        if status & 1 << 4:  # have
+            data = yield from read_fifo(dut.setup)
+            yield from dut.setup.ev.pending.write(0xff)
+            received.extend(data[:-2])
+            queue.append((0, _control_response(data[:-2])))
+
+        status = yield from dut.out.status.read()
+        if status & 1 << 4:  # have
+            epno = status & 0xf
+            data = yield from read_fifo(dut.out)
+            yield from dut.out.ev.pending.write(0xff)
+            yield from dut.out.ctrl.write(epno | 1 << 4)
+            received.extend(data[:-2])
+            if epno == BULK_EP:
+                queue.append((epno, data[:-2]))
+
+        if (yield from usb_in.ev.pending.read()):
+            yield from usb_in.ev.pending.write(0xff)
+        if queue and (yield from usb_in.status.read()) & 1:  # idle
+            epno, data = queue.pop(0)
+            for v in data:
+                yield from usb_in.data.write(v)
+            yield from usb_in.ctrl.write(epno)
+
+
+@passive
+def _epfifo_firmware(dut, received):
+    yield from dut.pullup._out.write(1)
+    # Every endpoint was triggered while disconnected.
+    for ep in (dut.ep_0_out, dut.ep_0_in, dut.ep_2_out, dut.ep_2_in):
+        yield from ep.ev.pending.write(0xf)
+    for ep in (dut.ep_0_out, dut.ep_2_out):
+        yield from ep.respond.write(EndpointResponse.ACK)
+
+    while True:
+        for epno, oep, iep in ((0, dut.ep_0_out, dut.ep_0_in),
+                               (BULK_EP, dut.ep_2_out, dut.ep_2_in)):
+            if (yield from oep.ev.pending.read()) & 0x2:
+                setup = (yield from oep.last_tok.read()) == 0b11
+                data = []
+                while True:
+                    yield from oep.obuf_head.write(0)
+                    if (yield from oep.obuf_empty.read()):
+                        break
+                    data.append((yield from oep.obuf_head.read()))
+                    yield
+                yield from oep.ev.pending.write(0xf)
+                # A SETUP sets both EP0 endpoints back to NAK.
+                yield from oep.respond.write(EndpointResponse.ACK)
+                received.extend(data[:-2])
+                if setup or epno == BULK_EP:
+                    response = data[:-2] if epno else _control_response(data[:-2])
+                    for v in response:
+                        yield from iep.ibuf_head.write(v)
+                    yield from iep.respond.write(EndpointResponse.ACK)
+
+            if (yield from iep.ev.pending.read()) & 0x2:
+                yield from iep.respond.write(EndpointResponse.NAK)
+                yield from iep.ev.pending.write(0xf)
+
+
+@passive
+def _epmem_firmware(dut, received):
+    def set_bits(csr, mask):
+        v = yield from csr.read()
+        yield from csr.write(v | mask)
+
+    # epaddr of each endpoint's OUT side, its IN side is one more.  Each IN
+    # endpoint has its own half of the IN buffer.
+    out_ep0, out_bulk = 0, 2*BULK_EP
+    ibuf_base = {0: 0, BULK_EP: 256}
+
+    yield from dut.pullup._out.write(1)
+    # Every endpoint was triggered while disconnected.
+    yield from dut.ev.pending.write(0x3f)
+    yield from set_bits(dut.arm, 1 << out_ep0 | 1 << out_bulk)
+
+    optr = 0
+    while True:
+        pending = yield from dut.ev.pending.read()
+        for epaddr in (out_ep0, out_bulk):
+            if not pending & 1 << epaddr:
+                continue
+            epno = epaddr >> 1
+            end = yield from getattr(dut, "optr_ep{}".format(epno)).read()
+            data = []
+            while optr != end:
+                data.append((yield dut.obuf[optr]))
+                optr = (optr + 1) & 0x1ff
+            yield from dut.ev.pending.write(1 << epaddr)
+            received.extend(data[:-2])
+            # A SETUP disarms both EP0 endpoints.
+            yield from set_bits(dut.arm, 1 << epaddr)
+
+            # epmem doesn't tell a SETUP from an OUT, but the only 8 byte
+            # packets on EP0 are SETUPs.
+            if epno == BULK_EP or len(data) == 10:
+                response = data[:-2] if epno else _control_response(data[:-2])
+                base = ibuf_base[epno]
+                for i, v in enumerate(response):
+                    yield dut.ibuf[base + i].eq(v)
+                yield from getattr(dut, "iptr_ep{}".format(epno)).write(base)
+                yield from getattr(dut, "ilen_ep{}".format(epno)).write(base + len(response))
+                yield from set_bits(dut.arm, 1 << (epaddr | 1))
+
+        for epaddr in (out_ep0 | 1, out_bulk | 1):
+            if pending & 1 << epaddr:
+                yield from dut.ev.pending.write(1 << epaddr)
+
+
+@passive
+def _unififo_firmware(dut, received):
+    # There's no protocol engine to service endpoints, so the firmware just
+    # drains every packet the host sends.
+    yield from dut.pullup._out.write(1)
+    while True:
+        if (yield from dut.obuf_empty.read()):
+            continue
+        received.append((yield from dut.obuf_head.read()))
+        yield from dut.obuf_head.write(0)
+        # obuf_empty takes a cycle to follow the pop.
+        yield
+
+
+def _eptri():
+    # The firmware runs in the sys domain, which is faster than usb_12.
+    from ..cpu.eptri import TriEndpointInterface
+    return TriEndpointInterface(FakeIoBuf(), cdc=True)
+
+
+def _epfifo():
+    from ..cpu.epfifo import PerEndpointFifoInterface
+    return PerEndpointFifoInterface(FakeIoBuf())
+
+
+def _epmem():
+    from ..cpu.epmem import MemInterface
+    return MemInterface(FakeIoBuf())
+
+
+def _unififo():
+    # UsbUniFifo doesn't put the iobuf into the usb_48 domain itself.
+    from ..cpu.unififo import UsbUniFifo
+    return UsbUniFifo(FakeIoBuf(domain="usb_48"))
+
+
+def _dummyusb():
+    from ..cpu.dummyusb import DummyUsb
+    return DummyUsb(FakeIoBuf())
+
+
+# `endpoints` are the ones the host expects transfers to complete on, and
+# `expect` gives the bytes `firmware` should get from `traffic`.  DummyUsb
+# answers the control transfer itself and has no firmware.
+Interface = collections.namedtuple(
+    "Interface", ["device", "firmware", "endpoints", "expect"])
+
+INTERFACES = collections.OrderedDict([
+    ("TriEndpointInterface", Interface(_eptri, _eptri_firmware, (0, BULK_EP), _payloads)),
+    ("PerEndpointFifoInterface", Interface(_epfifo, _epfifo_firmware, (0, BULK_EP), _payloads)),
+    ("MemInterface", Interface(_epmem, _epmem_firmware, (0, BULK_EP), _payloads)),
+    ("UsbUniFifo", Interface(_unififo, _unififo_firmware, (), _raw)),
+    ("DummyUsb", Interface(_dummyusb, None, (0,), None)),
+])
+
+
+def host(iobuf, transactions, endpoints, stats, idle=16):
+    """Make `transactions` through `iobuf`, runs in the usb_48 domain.
+
+    Transactions on `endpoints` are repeated while they are NAKed and must
+    end with an ACK, or the expected data for an IN.  Any answer is taken
+    from the other endpoints.
+    """
+    handshakes = {wrap_handshake_packet(pid): pid
+                  for pid in (PID.ACK, PID.NAK, PID.STALL)}
+    ack = wrap_handshake_packet(PID.ACK)
+
+    def send(packet):
+        for i in range(idle):
+            yield
+            stats["usb_48_cycles"] += 1
+        yield from iobuf.host.send(packet)
+        stats["packets"] += 1
+        while True:
+            yield
+            stats["usb_48_cycles"] += 1
+            if (yield iobuf.host.done):
+                break
+
+    yield from iobuf.recv('I')
+    for i, (t, packets) in enumerate(transactions):
+        if t.kind == "sof":
+            for packet in packets:
+                yield from send(packet)
+            continue
+
+        checked = t.ep in endpoints
+        for attempt in range(MAX_NAKS + 1):
+            yield from iobuf.monitor.arm()
+            for packet in packets:
+                yield from send(packet)
+
+            # Wait for the device to answer, if it is going to.
+            waited = 0
+            while not (yield iobuf.monitor.ready):
+                if waited >= RESPONSE_TIMEOUT and not (yield iobuf.monitor.length):
+                    break
+                yield
+                stats["usb_48_cycles"] += 1
+                waited += 1
+            samples = (yield from iobuf.monitor.capture()).samples
+            if samples:
+                stats["responses"] += 1
+            response = handshakes.get(samples)
+            if response == PID.NAK and checked:
+                stats["naks"] += 1
+                continue
+            break
+        else:
+            raise AssertionError(
+                "Transaction {} ({} on EP{}) NAKed {} times".format(
+                    i, t.kind, t.ep, MAX_NAKS + 1))
+
+        if len(samples) > HANDSHAKE_SAMPLES:
+            yield from send(ack)
+        if not checked:
+            continue
+        if t.kind == "in":
+            expected = [wrap_packet(data_packet(pid, t.data))
+                        for pid in (PID.DATA0, PID.DATA1)]
+            if samples not in expected:
+                raise AssertionError(
+                    "Transaction {} (IN on EP{}) didn't get {!r}, the response was {}".format(
+                        i, t.ep, t.data, handshakes.get(samples, samples)))
+            stats["in_bytes"] += len(t.data)
+        elif response != PID.ACK:
+            raise AssertionError(
+                "Transaction {} ({} on EP{}) was answered with {}".format(
+                    i, t.kind, t.ep, handshakes.get(samples, samples)))
+
+
+def measure(name, rounds=10):
+    """Simulate `rounds` of traffic through the interface called `name`."""
+    interface = INTERFACES[name]
+    transactions = traffic(rounds)
+    wired = [(t, [wrap_packet(packet) for packet in t.packets]) for t in transactions]
+    stats = collections.Counter(
+        packets=0, responses=0, naks=0, in_bytes=0, usb_48_cycles=0)
+    received = []
+
+    start = time.perf_counter()
+    dut = interface.device()
+    generators = {"usb_48": host(dut.iobuf, wired, interface.endpoints, stats)}
+    if interface.firmware is not None:
+        generators["sys"] = interface.firmware(dut, received)
+    s = Simulator(dut, generators, clocks=BENCH_CLOCKS)
+    elaborate = time.perf_counter() - start
+
+    signals = simulator_signals(s)
+    wall, cpu = time.perf_counter(), time.process_time()
+    with s:
+        s.run()
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+
+    if interface.expect is not None:
+        expected = interface.expect(transactions, interface.endpoints)
+        if received != expected:
+            raise AssertionError(
+                "The firmware got {} bytes, expected {}".format(len(received), len(expected)))
+
+    sys_cycles = stats["usb_48_cycles"]*BENCH_CLOCKS["usb_48"]//BENCH_CLOCKS["sys"]
+    return collections.OrderedDict([
+        ("packets", stats["packets"]),
+        ("responses", stats["responses"]),
+        ("naks", stats["naks"]),
+        ("in_bytes", stats["in_bytes"]),
+        ("out_bytes", len(received)),
+        ("sys_cycles", sys_cycles),
+        ("signals", len(signals)),
+        ("signal_bits", sum(len(signal) for signal in signals)),
+        ("elaborate_seconds", elaborate),
+        ("simulate_seconds", wall),
+        ("cycles_per_second", sys_cycles/wall),
+        ("python_seconds_per_packet", cpu/stats["packets"]),
+    ])
+
+
+def _measure_in_process(args):
+    name, rounds = args
+    try:
+        result = measure(name, rounds)
+    except Exception as e:
+        result = collections.OrderedDict(
+            error="{}: {}".format(type(e).__name__, e))
+    # ru_maxrss is in KiB on Linux
+    result["peak_rss_kib"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return name, result
+
+
+def _commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(names=None, rounds=10):
+    """Measure each interface in `names` in its own process."""
+    names = list(names or INTERFACES)
+    # spawn, rather than fork, so nothing is inherited from this process.
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        results = pool.map(_measure_in_process, [(n, rounds) for n in names],
+                           chunksize=1)
+    return collections.OrderedDict([
+        ("commit", _commit()),
+        ("python", platform.python_version()),
+        ("clocks", BENCH_CLOCKS),
+        ("rounds", rounds),
+        ("packets_per_round", sum(len(t.packets) for t in traffic(1))),
+        ("interfaces", collections.OrderedDict(results)),
+    ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("interfaces", nargs="*", metavar="interface",
+                        help="one of {} (default: all)".format(", ".join(INTERFACES)))
+    parser.add_argument("-r", "--rounds", type=int, default=10,
+                        help="rounds of the traffic mix to send (default: 10)")
+    parser.add_argument("-o", "--output", type=argparse.FileType("w"),
+                        default=sys.stdout, help="JSON file to write")
+    args = parser.parse_args(argv)
+    for name in args.interfaces:
+        if name not in INTERFACES:
+            parser.error("unknown interface: {}".format(name))
+
+    results = run(args.interfaces, args.rounds)
+    json.dump(results, args.output, indent=2)
+    args.output.write("\n")
+
+    for name, result in results["interfaces"].items():
+        if "error" in result:
+            print("{:<26} {}".format(name, result["error"]), file=sys.stderr)
+        else:
+            print("{:<26} {:>10.0f} cycles/s {:>8.1f} ms/packet {:>8d} KiB".format(
+                name, result["cycles_per_second"],
+                1000*result["python_seconds_per_packet"],
+                result["peak_rss_kib"]), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
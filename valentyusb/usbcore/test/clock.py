@@ -1,9 +1,63 @@
 #!/usr/bin/env python3
 
+from collections import namedtuple
+from math import gcd
+
 from migen import *
+from migen.sim.core import TimeManager
+
+
+def clock_levels(clocks, names):
+    """Level of each clock in `names` as read by a sys domain generator.
+
+    Returns one tuple per sys tick covering a full period of all the clocks,
+    after which the pattern repeats.  A generator reads the values committed
+    before the current step, so a clock rising on the same step as sys is
+    still seen as low.
+
+    >>> levels = clock_levels({"sys": 2, "usb_48": 8, "usb_12": 32}, ("usb_48",))
+    >>> len(levels), [l[0] for l in levels[:8]]
+    (16, [0, 0, 1, 1, 0, 0, 1, 1])
+    """
+    time = TimeManager(clocks)
+    level = {n: int(c.high) for n, c in time.clocks.items()}
+
+    period = 1
+    for c in clocks.values():
+        p = c[0] if isinstance(c, tuple) else c
+        period = period * p // gcd(period, p)
+
+    levels = []
+    t = 0
+    while t < period:
+        dt, rising, falling = time.tick()
+        t += dt
+        if "sys" in rising:
+            levels.append(tuple(level[n] for n in names))
+        for n in rising:
+            level[n] = 1
+        for n in falling:
+            level[n] = 0
+    return levels
+
+
+class ClockEdge(namedtuple("ClockEdge", ["domain", "count", "until"])):
+    """Request for the `clock_generators` scheduler, see `wait_for_edge`.
+
+    Yielding it resumes the test bench on the `count`th rising edge of
+    `domain` from now.  If `until` is given, it resumes on the first edge
+    `until` reads non-zero on instead, giving up after `count` edges if
+    `count` isn't None.  Plain `yield` is the same as ClockEdge("sys").
+    """
+
+    def __new__(cls, domain, count=1, until=None):
+        return super().__new__(cls, domain, count, until)
 
 
 class CommonTestMultiClockDomain:
+    # Clock tracking state, saved with simulator checkpoints.
+    checkpoint_attrs = ("cycle_count", "last_value")
+
     def setUp(self, clock_names):
         self.signals = {}
         self.cycle_count = {}
@@ -12,8 +66,77 @@ class CommonTestMultiClockDomain:
             self.signals[n] = ClockSignal(n)
             self.cycle_count[n] = 0
             self.last_value[n] = 0
+        # Scheduler state, see clock_generators
+        self.scheduled = False
+        self._stim = None
+        self._waiting = None
+        self._edges_left = None
+
+    def clock_generators(self, stim, clocks):
+        """Generators to pass to run_simulation for the `stim` test bench.
+
+        One generator per clock domain runs on each of its rising edges,
+        runs the on_<domain>_edge callback and resumes `stim` if it is
+        waiting for that edge (see `ClockEdge`).  So nothing polls the
+        clocks, `stim` only runs when it has something to do, and sys may
+        be slower than the clocks it waits on.
+
+        Plain `yield`s in `stim` wait for the next sys edge as usual.  The
+        sys generator keeps the simulation running until `stim` is done.
+        """
+        self.scheduled = True
+        self._stim = stim
+        self._waiting = ClockEdge("sys")
+        self._edges_left = 1
+        generators = {"sys": [self._dispatch("sys")]}
+        for n in self.signals:
+            generators[n] = [self._dispatch(n)]
+        return generators
+
+    def _dispatch(self, domain):
+        if domain != "sys":
+            yield "passive"
+        while self._stim is not None or domain != "sys":
+            if domain in self.cycle_count:
+                yield from getattr(self, "on_%s_edge" % domain)()
+                self.cycle_count[domain] += 1
+            waiting = self._waiting
+            if waiting is not None and waiting.domain == domain:
+                if self._edges_left is not None:
+                    self._edges_left -= 1
+                ready = self._edges_left == 0
+                if waiting.until is not None and not ready:
+                    ready = yield waiting.until
+                if ready:
+                    yield from self._resume()
+            yield
+
+    def _resume(self):
+        # Runs `stim` until it waits for an edge, passing its reads and
+        # writes on to the simulator.
+        self._waiting = None
+        reply = None
+        while True:
+            try:
+                request = self._stim.send(reply)
+            except StopIteration:
+                self._stim = None
+                return
+            if request is None:
+                request = ClockEdge("sys")
+            if isinstance(request, ClockEdge):
+                self._waiting = request
+                self._edges_left = request.count
+                return
+            if isinstance(request, str):
+                raise ValueError("Test benches can't be {}".format(request))
+            reply = yield request
 
     def update_clocks(self):
+        # The scheduler runs the callbacks when it isn't polling.
+        if self.scheduled:
+            return
+
         for n in self.signals:
             current_value = yield self.signals[n]
             # Run the callback
@@ -22,14 +145,36 @@ class CommonTestMultiClockDomain:
                 self.cycle_count[n] += 1
             self.last_value[n] = current_value
 
-    def wait_for_edge(self, name):
-        count_last = self.cycle_count[name]
-        while True:
-            yield from self.update_internal_signals()
-            count_next = self.cycle_count[name]
-            if count_last != count_next:
+    def wait_for_edge(self, name, count=None, until=None):
+        """Wait for `count` (by default one) rising edges of the `name` clock.
+
+        With `until`, wait for the first edge it reads non-zero on instead,
+        giving up after `count` edges if `count` is given.  Under
+        `clock_generators` this is a single request to the scheduler,
+        otherwise the clocks are polled every sys tick.
+        """
+        if count is None and until is None:
+            count = 1
+        if self.scheduled:
+            yield ClockEdge(name, count, until)
+            return
+        while count is None or count > 0:
+            count_last = self.cycle_count[name]
+            while True:
+                yield from self.update_internal_signals()
+                count_next = self.cycle_count[name]
+                if count_last != count_next:
+                    break
+                yield
+            if count is not None:
+                count -= 1
+            if until is not None and (yield until):
                 break
-            yield
 
     def update_internal_signals(self):
         yield from self.update_clocks()
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from migen import *
+
+from .clock import CommonTestMultiClockDomain
+
+
+class ClockCounters(Module):
+    def __init__(self):
+        self.sys_count = Signal(32)
+        self.usb_48_count = Signal(32)
+        self.usb_12_count = Signal(32)
+        self.sync += self.sys_count.eq(self.sys_count + 1)
+        self.sync.usb_48 += self.usb_48_count.eq(self.usb_48_count + 1)
+        self.sync.usb_12 += self.usb_12_count.eq(self.usb_12_count + 1)
+
+
+class Bench(CommonTestMultiClockDomain):
+    def __init__(self):
+        CommonTestMultiClockDomain.setUp(self, ("usb_12", "usb_48"))
+        self.dut = ClockCounters()
+        self.edges = []
+
+    def on_usb_48_edge(self):
+        if False:
+            yield
+
+    def on_usb_12_edge(self):
+        v = yield self.dut.usb_12_count
+        self.edges.append(v)
+
+    def run(self, stim, clocks, scheduled=True):
+        if scheduled:
+            stim = self.clock_generators(stim, clocks)
+        run_simulation(self.dut, stim, clocks=clocks)
+
+
+CLOCKS = (
+    {"sys": 2, "usb_48": 8, "usb_12": 32},
+    {"sys": 2, "usb_48": (8, 3), "usb_12": 32},
+    # sys slower than the clocks the test bench waits on
+    {"sys": 32, "usb_48": 8, "usb_12": 32},
+)
+
+
+class TestClockGenerators(unittest.TestCase):
+    def test_every_edge(self):
+        for clocks in CLOCKS:
+            with self.subTest(clocks=clocks):
+                bench = Bench()
+                counts = []
+
+                def stim():
+                    for i in range(50):
+                        yield from bench.wait_for_edge("usb_48")
+                        count = yield bench.dut.usb_48_count
+                        # Resumed on the edge, before it updates usb_48
+                        self.assertEqual(count, bench.cycle_count["usb_48"] - 1)
+                        counts.append(count)
+
+                bench.run(stim(), clocks)
+                self.assertEqual(counts, list(range(counts[0], counts[0] + 50)))
+                # Callbacks ran on every usb_12 edge, whatever stim did
+                self.assertEqual(bench.edges, list(range(len(bench.edges))))
+                self.assertEqual(len(bench.edges), bench.cycle_count["usb_12"])
+
+    def test_sys_ticks(self):
+        for clocks in CLOCKS:
+            with self.subTest(clocks=clocks):
+                bench = Bench()
+                counts = []
+
+                def stim():
+                    yield from bench.wait_for_edge("usb_12")
+                    for i in range(5):
+                        yield
+                        counts.append((yield bench.dut.sys_count))
+
+                bench.run(stim(), clocks)
+                self.assertEqual(counts, list(range(counts[0], counts[0] + 5)))
+
+    def test_until(self):
+        for clocks in CLOCKS:
+            for scheduled in (False, True):
+                if not scheduled and clocks["sys"] > 2:
+                    continue
+                with self.subTest(clocks=clocks, scheduled=scheduled):
+                    bench = Bench()
+                    counts = []
+
+                    def stim():
+                        yield from bench.wait_for_edge(
+                            "usb_48", until=bench.dut.usb_48_count[3])
+                        counts.append((yield bench.dut.usb_48_count))
+
+                    bench.run(stim(), clocks, scheduled)
+                    # Both resume with the first count that has bit 3 set
+                    self.assertEqual(counts, [8])
+
+    def test_count(self):
+        for clocks in CLOCKS:
+            for scheduled in (False, True):
+                if not scheduled and clocks["sys"] > 2:
+                    continue
+                with self.subTest(clocks=clocks, scheduled=scheduled):
+                    bench = Bench()
+                    counts = []
+
+                    def stim():
+                        for i in range(3):
+                            yield from bench.wait_for_edge("usb_48", 4)
+                            counts.append((yield bench.dut.usb_48_count))
+                        # Gives up before bit 7 is set
+                        yield from bench.wait_for_edge(
+                            "usb_48", 8, until=bench.dut.usb_48_count[7])
+                        counts.append((yield bench.dut.usb_48_count))
+
+                    bench.run(stim(), clocks, scheduled)
+                    self.assertEqual(
+                        [c - counts[0] for c in counts], [0, 4, 8, 16])
+
+    def test_polled(self):
+        bench = Bench()
+        counts = []
+
+        def stim():
+            for i in range(50):
+                yield from bench.wait_for_edge("usb_48")
+                counts.append((yield bench.dut.usb_48_count))
+
+        bench.run(stim(), CLOCKS[0], scheduled=False)
+        # Polling runs a sys tick after the edge
+        self.assertEqual(counts, list(range(1, 51)))
+        self.assertEqual(bench.edges, list(range(1, len(bench.edges) + 1)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,17 +1,27 @@
 #!/usr/bin/env python3
 
-import unittest
+import copy
+import hashlib
 import inspect
+import os
+import pickle
+import tempfile
+import unittest
 
+from collections import namedtuple
 from itertools import zip_longest
 from litex.soc.interconnect.csr import CSRStorage
 import migen
+from migen.sim.vcd import VCDWriter
 
 from ..endpoint import *
 from ..pid import *
 from ..utils.asserts import assertMultiLineEqualSideBySide
 from ..utils.packet import *
 from ..utils.pprint import pp_packet
+from ..utils.vcd import RingVCDWriter
+from .reuse import restore_state, save_state, simulator, simulator_signals
+from .verilator import run_verilator
 
 
 def grouper(n, iterable, pad=None):
@@ -24,11 +34,197 @@ def grouper(n, iterable, pad=None):
     return zip_longest(*[iter(iterable)]*n, fillvalue=pad)
 
 
+# DUTs shared between tests, see BaseUsbTestCase.cached_dut
+_duts = {}
+
+# Simulator states shared between tests, see BaseUsbTestCase.checkpoint
+Checkpoint = namedtuple("Checkpoint", ["sim", "attrs"])
+_checkpoints = {}
+
+
+class _FailureWatcher:
+    """Passes results on to a TestResult, noting whether the test failed."""
+
+    def __init__(self, result):
+        self.result = result
+        self.failed = False
+        # unittest only reports subtests to results which have addSubTest
+        # (pytest's don't), otherwise their failures come through addFailure.
+        if hasattr(result, "addSubTest"):
+            self.addSubTest = self._addSubTest
+
+    def __getattr__(self, name):
+        return getattr(self.result, name)
+
+    def addError(self, test, err):
+        self.failed = True
+        self.result.addError(test, err)
+
+    def addFailure(self, test, err):
+        self.failed = True
+        self.result.addFailure(test, err)
+
+    def _addSubTest(self, test, subtest, err):
+        if err is not None:
+            self.failed = True
+        self.result.addSubTest(test, subtest, err)
+
+
 class BaseUsbTestCase(unittest.TestCase):
     """
     Test case helpers common to all test cases, simple and complex
     """
 
+    # "migen" or "verilator", see `run_simulation`.
+    simulator = os.environ.get("VALENTYUSB_SIMULATOR", "migen")
+
+    # Waveforms: "failure" keeps the last `vcd_cycles` cycles in memory and
+    # only writes them out if the test fails, "all" writes full dumps and
+    # "none" disables them.  `vcd_signals` optionally limits the capture to
+    # signals matching a list of fnmatch patterns.
+    vcd_mode = os.environ.get("VALENTYUSB_VCD", "failure")
+    vcd_cycles = int(os.environ.get("VALENTYUSB_VCD_CYCLES", "10000"))
+    vcd_signals = None
+
+    def run_simulation(self, dut, generators, vcd_name=None, **kwargs):
+        """
+        Run a simulation with migen's Simulator, or with a Verilator
+        compiled model of the design if `simulator` is "verilator".
+        Waveforms are captured as set by `vcd_mode`.  The same DUT can be
+        simulated more than once, each time starting from reset.
+        """
+        if self.vcd_mode == "none" or (
+                self.vcd_mode != "all" and self.simulator == "verilator"):
+            vcd_name = None
+        restore = self.__dict__.pop("_checkpoint_restore", None)
+        save = self.__dict__.pop("_checkpoint_save", None)
+        if self.simulator == "verilator":
+            if restore is not None or save is not None:
+                raise NotImplementedError("Checkpoints need the migen simulator")
+            return run_verilator(dut, generators, vcd_name=vcd_name, **kwargs)
+
+        with simulator(dut, generators, **kwargs) as s:
+            # Restore first, so the waveform starts from the restored values.
+            if restore is not None:
+                restore_state(s, restore.sim)
+                self.__dict__.update(copy.deepcopy(restore.attrs))
+            if vcd_name is not None:
+                signals = simulator_signals(s)
+                if self.vcd_mode == "all":
+                    s.vcd = VCDWriter(vcd_name)
+                else:
+                    s.vcd = RingVCDWriter(vcd_name, self.vcd_cycles)
+                    s.vcd.select(signals, self.vcd_signals)
+                    self.__dict__.setdefault("_vcd_captures", []).append(s.vcd)
+                values = s.evaluator.signal_values
+                for signal in signals:
+                    s.vcd.set(signal, values.get(signal, signal.reset.value))
+            s.run()
+            if save is not None:
+                attrs = {a: getattr(self, a)
+                         for a in getattr(self, "checkpoint_attrs", ())
+                         if hasattr(self, a)}
+                self._checkpoint_store(
+                    save, Checkpoint(save_state(s), copy.deepcopy(attrs)))
+
+    def cached_dut(self, build, *config):
+        """
+        Return the DUT made by build(), only building (and elaborating) it
+        once per process for each test class and `config`.  Simulations
+        through `run_simulation` always start it from reset.
+        """
+        key = (type(self),) + config
+        if key not in _duts:
+            _duts[key] = build()
+        self._dut_config = config
+        return _duts[key]
+
+    # Directory to share checkpoints between processes, see `checkpoint`.
+    checkpoint_dir = os.environ.get("VALENTYUSB_CHECKPOINT_DIR", None)
+
+    def checkpoint(self, name, preamble):
+        """
+        Make the next `run_simulation` start from the state preamble()
+        leaves the DUT in, where preamble() runs a simulation (such as
+        enumerating the device).  The preamble only runs the first time
+        `name` is used for this test class and DUT config, later tests fork
+        from the saved state.  Attributes listed in `checkpoint_attrs`
+        are saved and restored along with the simulator.
+
+        Setting `checkpoint_dir` (or $VALENTYUSB_CHECKPOINT_DIR) shares
+        checkpoints with other processes.  Clear it when the design changes.
+        """
+        key = (type(self).__module__, type(self).__qualname__,
+               getattr(self, "_dut_config", ()), name)
+        if key not in _checkpoints:
+            checkpoint = self._checkpoint_load(key)
+            if checkpoint is None:
+                self._checkpoint_save = key
+                preamble()
+            else:
+                _checkpoints[key] = checkpoint
+        self._checkpoint_restore = _checkpoints[key]
+
+    def _checkpoint_path(self, key):
+        if not self.checkpoint_dir:
+            return None
+        digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.checkpoint_dir, "%s.%s.pickle" % (key[-1], digest))
+
+    def _checkpoint_load(self, key):
+        path = self._checkpoint_path(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                checkpoint = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            return None
+        if not isinstance(checkpoint, Checkpoint):
+            return None
+        return checkpoint
+
+    def _checkpoint_store(self, key, checkpoint):
+        _checkpoints[key] = checkpoint
+        path = self._checkpoint_path(key)
+        if path is None:
+            return
+        try:
+            data = pickle.dumps(checkpoint)
+        except (pickle.PicklingError, AttributeError, TypeError):
+            # Only shared in process, eg. attributes holding local classes.
+            return
+        try:
+            os.makedirs(self.checkpoint_dir, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.checkpoint_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    def run(self, result=None):
+        # Write out the captured waveforms of a failing test, once the test
+        # (including setUp and tearDown) has finished.
+        if result is None:
+            result = self.defaultTestResult()
+            result.startTestRun()
+            try:
+                return self.run(result)
+            finally:
+                result.stopTestRun()
+
+        self._vcd_captures = []
+        watcher = _FailureWatcher(result)
+        try:
+            super().run(watcher)
+            if watcher.failed:
+                for capture in self._vcd_captures:
+                    capture.write()
+        finally:
+            self._vcd_captures = []
+        return result
+
     def make_vcd_name(self, basename=None, modulename=None, testsuffix=None):
         """
         Create a name for the vcd file based on the test case
@@ -61,6 +257,9 @@ class CommonUsbTestCase:
 
     maxDiff=None
 
+    # Print the data going through endpoints, see `ep_print`.
+    verbose = True
+
     ######################################################################
     # Interface subclasses need to implement.
     ######################################################################
@@ -121,12 +320,18 @@ class CommonUsbTestCase:
         return assertMultiLineEqualSideBySide(data1, data2, msg)
 
     def ep_print(self, epaddr, msg, *args):
+        if not self.verbose:
+            return
         print("ep(%i, %s): %s" % (
             EndpointType.epnum(epaddr),
             EndpointType.epdir(epaddr).name,
             msg) % args)
 
     def patch_csrs(self):
+        # Only once, a cached DUT is shared between tests.
+        if getattr(self.dut, "_csrs_patched", False):
+            return
+        self.dut._csrs_patched = True
         for csr in self.dut.get_csrs():
             if isinstance(csr, CSRStorage) and hasattr(csr, "dat_w"):
                 self.dut.sync += [
@@ -151,19 +356,27 @@ class CommonUsbTestCase:
     # Host->Device
     def _send_packet(self, packet):
         """Send a USB packet."""
-        packet = wrap_packet(packet)
+        yield from self._send_wire(wrap_packet(packet))
+
+    def _send_wire(self, packet):
+        """Send an already wrapped USB packet."""
         self.assertEqual('J', packet[-1], "Packet didn't end in J: "+packet)
 
         # FIXME: Horrible hack...
         # Wait for 4 idle clock cycles before sending the packet..
         yield from self.idle(4)
 
+        # The whole packet is handed to the host transactor in one go, which
+        # plays it back one sample per usb_48 cycle.
+        host = self.dut.iobuf.host
         yield self.packet_h2d.eq(1)
-        for v in packet:
-            yield from self.update_internal_signals()
-            yield from self.dut.iobuf.recv(v)
-            yield from self.update_internal_signals()
+        yield from host.send(packet)
+        done = 0
+        while not done:
             yield from self.tick_usb48()
+            done = yield host.done
+        # Let the device sample the last bit time
+        yield from self.tick_usb48()
         yield from self.update_internal_signals()
         yield self.packet_h2d.eq(0)
         eop = yield from self.dut.iobuf.current()
@@ -171,10 +384,10 @@ class CommonUsbTestCase:
 
     def send_token_packet(self, pid, addr, epaddr):
         epnum = EndpointType.epnum(epaddr)
-        yield from self._send_packet(token_packet(pid, addr, epnum))
+        yield from self._send_wire(wrap_token_packet(pid, addr, epnum))
 
     def send_sof_packet(self, ts):
-        yield from self._send_packet(sof_packet(ts))
+        yield from self._send_wire(wrap_sof_packet(ts))
 
     def send_data_packet(self, pid, data):
         assert pid in (PID.DATA0, PID.DATA1), pid
@@ -182,7 +395,7 @@ class CommonUsbTestCase:
 
     def send_handshake(self, pid):
         assert pid in (PID.ACK, PID.NAK, PID.STALL), pid
-        yield from self._send_packet(handshake_packet(pid))
+        yield from self._send_wire(wrap_handshake_packet(pid))
         # FIXME: Horrible hack...
         # Wait for 16 idle cycles after sending handshake..
         yield from self.idle(16)
@@ -199,38 +412,31 @@ class CommonUsbTestCase:
         """Except to receive the following USB packet."""
         yield self.packet_d2h.eq(1)
 
-        # Wait for transmission to start
+        # The monitor counts the turnaround and records the transmission in
+        # gateware, so only the finished record needs to be read back.
+        monitor = self.dut.iobuf.monitor
         yield from self.dut.iobuf.recv('I')
-        tx = 0
-        bit_times = 0
-        for i in range(0, 100):
+        yield from monitor.arm()
+        for i in range(0, 100 + monitor.depth):
             yield from self.update_internal_signals()
-            tx = yield self.dut.iobuf.usb_tx_en
-            if tx:
+            ready = yield monitor.ready
+            if ready:
                 break
             yield from self.tick_usb48()
-            bit_times = bit_times + 1
-        self.assertTrue(tx, "No packet started, "+msg)
+        capture = yield from monitor.capture()
+        self.assertTrue(capture.samples, "No packet started, "+msg)
+        self.assertTrue(ready, "Packet didn't finish, "+msg)
+        self.assertFalse(capture.overflow,
+            "Packet longer than the {} sample monitor, {}".format(monitor.depth, msg))
 
         # USB specifies that the turn-around time is 7.5 bit times for the device
+        bit_times = capture.turnaround
         bit_time_max = 12.5
         bit_time_acceptable = 7.5
         self.assertLessEqual(bit_times/4.0, bit_time_max,
             msg="Response came in {} bit times, which is more than {}".format(bit_times / 4.0, bit_time_max))
         if (bit_times/4.0) > bit_time_acceptable:
             print("WARNING: Response came in {} bit times (> {})".format(bit_times / 4.0, bit_time_acceptable))
-
-        # Read in the transmission data
-        result = ""
-        for i in range(0, 512):
-            yield from self.update_internal_signals()
-
-            result += yield from self.iobuf.current()
-            yield from self.tick_usb48()
-            tx = yield self.dut.iobuf.usb_tx_en
-            if not tx:
-                break
-        self.assertFalse(tx, "Packet didn't finish, "+msg)
         yield self.packet_d2h.eq(0)
 
         # FIXME: Get the tx_en back into the USB12 clock domain...
@@ -238,10 +444,12 @@ class CommonUsbTestCase:
         for i in range(0, 4):
             yield from self.tick_usb12()
 
-        # Check the packet received matches
-        expected = pp_packet(wrap_packet(packet))
-        actual = pp_packet(result)
-        self.assertMultiLineEqualSideBySide(expected, actual, msg)
+        # Check the packet received matches, only annotating it on a mismatch
+        expected = wrap_packet(packet)
+        actual = capture.samples
+        if expected != actual:
+            self.assertMultiLineEqualSideBySide(
+                pp_packet(expected), pp_packet(actual), msg)
 
     # No expect_token_packet, as the host is the only one who generates tokens.
 
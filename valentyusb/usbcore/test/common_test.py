@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import unittest
+
+from migen import *
+
+from . import common
+from .common import BaseUsbTestCase
+
+
+class Counter(Module):
+    def __init__(self):
+        self.count = Signal(8)
+        self.sync += self.count.eq(self.count + 1)
+
+
+class ResultWithoutSubTests:
+    """A result without addSubTest, like pytest's."""
+
+    def __init__(self):
+        self.failures = []
+
+    def startTest(self, test):
+        pass
+
+    def stopTest(self, test):
+        pass
+
+    def addSuccess(self, test):
+        pass
+
+    def addError(self, test, err):
+        self.failures.append((test, err))
+
+    def addFailure(self, test, err):
+        self.failures.append((test, err))
+
+
+class TestVcdCapture(unittest.TestCase):
+    def run_case(self, fail, result=None, subtest=False, **attrs):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        vcd_name = os.path.join(tmp.name, "capture.vcd")
+
+        class Case(BaseUsbTestCase):
+            def runTest(case):
+                def stim():
+                    for i in range(100):
+                        yield
+                    if subtest:
+                        with case.subTest(fail=fail):
+                            case.assertFalse(fail)
+                    else:
+                        case.assertFalse(fail)
+                case.run_simulation(Counter(), stim(), vcd_name=vcd_name)
+        for k, v in attrs.items():
+            setattr(Case, k, v)
+
+        if result is None:
+            result = unittest.TestResult()
+        Case().run(result)
+        self.assertEqual(len(result.failures), int(fail))
+        if os.path.exists(vcd_name):
+            with open(vcd_name) as f:
+                return f.read()
+        return None
+
+    def test_pass_writes_nothing(self):
+        self.assertIsNone(self.run_case(False, vcd_mode="failure"))
+
+    def test_failure_writes_tail(self):
+        vcd = self.run_case(True, vcd_mode="failure", vcd_cycles=10)
+        self.assertIn("count", vcd)
+        self.assertNotIn("\n#10\n", vcd)
+        self.assertIn("$dumpvars", vcd)
+        self.assertEqual(vcd.count("\n#"), 2*10 + 1)
+
+    def test_signal_selection(self):
+        vcd = self.run_case(True, vcd_mode="failure", vcd_signals=["sys_clk"])
+        self.assertIn("sys_clk", vcd)
+        self.assertNotIn("count", vcd)
+
+    def test_all(self):
+        self.assertIn("count", self.run_case(False, vcd_mode="all"))
+
+    def test_none(self):
+        self.assertIsNone(self.run_case(True, vcd_mode="none"))
+
+    def test_subtest_failure(self):
+        for result in (unittest.TestResult, ResultWithoutSubTests):
+            with self.subTest(result=result.__name__):
+                self.assertIn("count", self.run_case(
+                    True, result(), subtest=True, vcd_mode="failure"))
+                self.assertIsNone(self.run_case(
+                    False, result(), subtest=True, vcd_mode="failure"))
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.preambles = []
+        self.results = []
+        self.addCleanup(common._checkpoints.clear)
+        self.addCleanup(common._duts.clear)
+
+    def make_case(self, **attrs):
+        outer = self
+
+        class Case(BaseUsbTestCase):
+            checkpoint_attrs = ("model",)
+            vcd_mode = "none"
+            vcd_file = None
+
+            def runTest(case):
+                case.dut = case.cached_dut(Counter)
+                case.model = []
+
+                def preamble():
+                    for i in range(10):
+                        yield
+                    case.model.append("enumerated")
+
+                def run(stim):
+                    case.run_simulation(case.dut, stim(), vcd_name=case.vcd_file)
+
+                def stim():
+                    yield
+                    outer.results.append(((yield case.dut.count), list(case.model)))
+
+                case.checkpoint("enumerated", lambda: (
+                    outer.preambles.append(1), run(preamble)))
+                run(stim)
+        for k, v in attrs.items():
+            setattr(Case, k, v)
+        return Case
+
+    def run_cases(self, cases):
+        result = unittest.TestResult()
+        for case in cases:
+            case().run(result)
+        self.assertEqual(result.errors + result.failures, [])
+
+    def test_fork(self):
+        Case = self.make_case()
+        self.run_cases([Case, Case, Case])
+        self.assertEqual(len(self.preambles), 1)
+        self.assertEqual(self.results, [(12, ["enumerated"])] * 3)
+
+    def test_shared_between_processes(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        Case = self.make_case(checkpoint_dir=tmp.name)
+        self.run_cases([Case])
+        # As if in a new process
+        common._checkpoints.clear()
+        common._duts.clear()
+        self.run_cases([Case])
+        self.assertEqual(len(self.preambles), 1)
+        self.assertEqual(self.results, [(12, ["enumerated"])] * 2)
+
+    def test_vcd_starts_from_restored_state(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        vcd_name = os.path.join(tmp.name, "capture.vcd")
+        Case = self.make_case(vcd_mode="all", vcd_file=vcd_name)
+        self.run_cases([Case, Case])
+        with open(vcd_name) as f:
+            lines = f.read().split("\n")
+        code = [l.split()[3] for l in lines if l.endswith(" count $end")][0]
+        values = lines[lines.index("#0"):]
+        first = [l for l in values if l.endswith(" " + code)][0]
+        self.assertEqual(first, "b00001011 " + code)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""Simulate the same DUT many times while only elaborating it once.
+
+A Module only hands out its fragment once and migen's Simulator lowers it in
+place, so normally every simulation needs a freshly built DUT.  `simulator`
+remembers the lowered fragment of every DUT it has simulated, and later
+simulations of the same DUT start from a new Evaluator, which puts every
+signal (and memory) back at its reset value.
+
+`save_state` and `restore_state` go the other way, letting a simulation
+start from where an earlier one (such as enumeration) finished.
+"""
+
+import collections
+import collections.abc
+import hashlib
+import inspect
+import operator
+import weakref
+
+from migen import *
+from migen.fhdl.tools import list_signals
+from migen.sim.core import Evaluator, Simulator, TimeManager
+from migen.sim.vcd import DummyVCDWriter
+
+
+_Prepared = collections.namedtuple("_Prepared", ["fragment", "replaced_memories", "clocks"])
+
+SimulatorState = collections.namedtuple("SimulatorState", ["design", "values", "clocks"])
+
+_prepared = weakref.WeakKeyDictionary()
+
+
+class ReusedSimulator(Simulator):
+    """A Simulator for a fragment an earlier Simulator already lowered."""
+
+    def __init__(self, prepared, generators, clocks={"sys": 10}):
+        if dict(clocks) != prepared.clocks:
+            raise ValueError("DUT was first simulated with clocks {}, not {}"
+                             .format(prepared.clocks, clocks))
+        self.fragment = prepared.fragment
+
+        if not isinstance(generators, dict):
+            generators = {"sys": generators}
+        self.generators = dict()
+        self.passive_generators = set()
+        for k, v in generators.items():
+            if (isinstance(v, collections.abc.Iterable)
+                    and not inspect.isgenerator(v)):
+                self.generators[k] = list(v)
+            else:
+                self.generators[k] = [v]
+
+        clocks = collections.OrderedDict(sorted(clocks.items(),
+                                                key=operator.itemgetter(0)))
+        self.time = TimeManager(clocks)
+        self.evaluator = Evaluator(self.fragment.clock_domains,
+                                   prepared.replaced_memories)
+        self.vcd = DummyVCDWriter()
+
+
+def simulator(dut, generators, clocks={"sys": 10}, **kwargs):
+    """Return a Simulator for `dut`, reusing its lowered fragment if possible.
+
+    >>> class Counter(Module):
+    ...     def __init__(self):
+    ...         self.count = Signal(8)
+    ...         self.sync += self.count.eq(self.count + 1)
+    >>> dut, counts = Counter(), []
+    >>> def stim():
+    ...     for i in range(3):
+    ...         yield
+    ...     counts.append((yield dut.count))
+    >>> for i in range(2):
+    ...     with simulator(dut, stim()) as s:
+    ...         s.run()
+    >>> counts
+    [3, 3]
+    """
+    prepared = _prepared.get(dut) if isinstance(dut, Module) else None
+    if prepared is not None:
+        return ReusedSimulator(prepared, generators, clocks)
+
+    s = Simulator(dut, generators, clocks=clocks, **kwargs)
+    if isinstance(dut, Module):
+        _prepared[dut] = _Prepared(
+            s.fragment, s.evaluator.replaced_memories, dict(clocks))
+    return s
+
+
+def simulator_signals(s):
+    """All the signals migen's Simulator would write to a VCD file."""
+    signals = list_signals(s.fragment)
+    for cd in s.fragment.clock_domains:
+        signals.add(cd.clk)
+        if cd.rst is not None:
+            signals.add(cd.rst)
+    for memory_array in s.evaluator.replaced_memories.values():
+        signals |= set(memory_array)
+    return sorted(signals, key=lambda x: x.duid)
+
+
+def design_signature(signals):
+    """Identifies a design by the widths of its signals, in simulator order."""
+    h = hashlib.sha1()
+    for signal in signals:
+        h.update(b"%d%s," % (len(signal), b"s" if signal.signed else b""))
+    return h.hexdigest()
+
+
+def save_state(s):
+    """Signal and memory values and clock phases of a Simulator between steps.
+
+    Values are stored in the order of `simulator_signals`, so the state can be
+    restored into another instance of the same design, even in another
+    process.  Signals outside the design aren't saved.
+
+    >>> class Counter(Module):
+    ...     def __init__(self):
+    ...         self.count = Signal(8)
+    ...         self.sync += self.count.eq(self.count + 1)
+    >>> def stim(dut, log):
+    ...     for i in range(3):
+    ...         yield
+    ...     log.append((yield dut.count))
+    >>> dut, log = Counter(), []
+    >>> with simulator(dut, stim(dut, log)) as s:
+    ...     s.run()
+    ...     state = save_state(s)
+    >>> dut = Counter()
+    >>> with simulator(dut, stim(dut, log)) as s:
+    ...     restore_state(s, state)
+    ...     s.run()
+    >>> log
+    [3, 7]
+    """
+    signals = simulator_signals(s)
+    values = s.evaluator.signal_values
+    return SimulatorState(
+        design_signature(signals),
+        tuple(values.get(signal, signal.reset.value) for signal in signals),
+        tuple((cs.high, cs.half_period, cs.time_before_trans)
+              for cs in s.time.clocks.values()))
+
+
+def restore_state(s, state):
+    """Put a Simulator which hasn't run yet into a state from `save_state`."""
+    signals = simulator_signals(s)
+    if design_signature(signals) != state.design:
+        raise ValueError("State was saved from a different design")
+    if len(s.time.clocks) != len(state.clocks):
+        raise ValueError("State was saved with different clocks")
+    s.evaluator.signal_values.update(zip(signals, state.values))
+    for cs, (high, half_period, time_before_trans) in zip(
+            s.time.clocks.values(), state.clocks):
+        if cs.half_period != half_period:
+            raise ValueError("State was saved with different clocks")
+        cs.high = high
+        cs.time_before_trans = time_before_trans
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""Run the CPU interface tests across sys clock speeds and `cdc` settings.
+
+At each point of the sweep the compliance suite of the interface is run,
+then a throughput workload: back to back 64 byte bulk IN and OUT transfers
+through the `CommonUsbSoakTestCase` scoreboard, serviced by the test's
+Python firmware.  The bytes moved per 1 ms frame (12000 usb_12 cycles) show
+how far the sys clock can drop before the interface falls behind:
+
+    python3 -m usbcore.test.sweep -o sweep.json
+
+The test bench polls the other clocks from the sys domain, so sys can not
+run slower than usb_48 (see `sees_every_edge`); the sweep covers the
+rates between 192 MHz and 96 MHz.  Each point is given `--timeout` seconds
+before it is recorded as an error.
+
+The test bench leaves idle time between packets, so throughputs are only
+comparable with each other, not with a real host.
+"""
+
+import argparse
+import collections
+import contextlib
+import importlib
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import unittest
+
+from ..endpoint import EndpointType
+from .bench import _commit
+from .clock import clock_levels
+from .traffic import TrafficConfig
+
+
+# Interface -> (test module, test class, cdc settings to try).  None means
+# the interface has no `cdc` option.  TriEndpointInterface joins once its
+# test has get_endpoint and the soak hooks, until then every point errors.
+SWEEPS = collections.OrderedDict([
+    ("PerEndpointFifoInterface", ("..cpu.epfifo_test", "TestPerEndpointFifoInterface", (None,))),
+])
+
+# sys clock periods, in the same units as "usb_48": 8.  2 is the tests'
+# default of 192 MHz, 4 is 96 MHz.  Anything slower misses usb_48 edges.
+SYS_PERIODS = (2, 4)
+
+# Seconds each point may take before it is recorded as an error.
+TIMEOUT = 30*60
+
+# Bytes per frame of a full speed bus, 19 maximum sized bulk packets.
+FULL_SPEED = 19*64
+
+USB_12_PER_FRAME = 12000
+
+
+def sees_every_edge(clocks):
+    """Whether a sys domain test bench sees every edge of the other clocks.
+
+    wait_for_edge polls the clock levels on sys ticks, so when sys is too
+    slow edges are lost and, with sys no faster than usb_48, it never
+    returns at all.
+
+    >>> sees_every_edge({"sys": 4, "usb_48": 8, "usb_12": 32})
+    True
+    >>> sees_every_edge({"sys": 6, "usb_48": 8, "usb_12": 32})
+    False
+    >>> sees_every_edge({"sys": 8, "usb_48": 8, "usb_12": 32})
+    False
+    """
+    names = [n for n in clocks if n != "sys"]
+    levels = clock_levels(clocks, names)
+    time = len(levels)*clocks["sys"]
+    for i, n in enumerate(names):
+        edges = sum(1 for t in range(len(levels))
+                    if levels[t][i] and not levels[t - 1][i])
+        if edges != time // clocks[n]:
+            return False
+    return True
+
+
+def sweep_case(name, sys_period, cdc):
+    """The test class of interface `name`, at one point of the sweep."""
+    module, cls, _ = SWEEPS[name]
+    base = getattr(importlib.import_module(module, __package__), cls)
+    attrs = {
+        "clocks": dict(base.clocks, sys=sys_period),
+        "vcd_mode": "none",
+    }
+    if cdc is not None:
+        attrs["cdc"] = cdc
+    return type(base.__name__, (base,), attrs)
+
+
+def compliance(case):
+    """Run the tests of `case`, except the random traffic one."""
+    loader = unittest.TestLoader()
+    names = [n for n in loader.getTestCaseNames(case) if n != "test_random_traffic"]
+    result = unittest.TestResult()
+    unittest.TestSuite(case(n) for n in names).run(result)
+    failed = [t._testMethodName for t, _ in result.failures + result.errors]
+    return collections.OrderedDict([
+        ("tests", result.testsRun),
+        ("passed", result.testsRun - len(failed)),
+        ("failed", sorted(failed)),
+    ])
+
+
+def throughput(case, transactions):
+    """Bytes per frame the test firmware moves through bulk endpoints."""
+    class Throughput(case):
+        def runTest(self):
+            self.verbose = False
+            config = TrafficConfig(
+                endpoints=[ep for ep in self.soak_endpoints if EndpointType.epnum(ep)],
+                min_size=64, max_size=64,
+                sof=0, reset=0, setup=0, nak=0, bad_crc=0)
+
+            def stim():
+                start = self.cycle_count["usb_12"]
+                yield from self.soak(28, transactions, config=config)
+                self.measured = (self.scoreboard.stats["bytes"],
+                                 self.cycle_count["usb_12"] - start)
+            self.run_sim(stim)
+
+    test = Throughput()
+    result = unittest.TestResult()
+    test.run(result)
+    for _, error in result.failures + result.errors:
+        return collections.OrderedDict(error=error.strip().splitlines()[-1])
+    data, cycles = test.measured
+    return collections.OrderedDict([
+        ("bytes", data),
+        ("usb_12_cycles", cycles),
+        ("bytes_per_frame", data*USB_12_PER_FRAME/cycles),
+    ])
+
+
+def _run_point(args):
+    name, sys_period, cdc, transactions = args
+    case = sweep_case(name, sys_period, cdc)
+    clocks = case.clocks
+    result = collections.OrderedDict([
+        ("interface", name),
+        ("cdc", cdc),
+        ("clocks", clocks),
+        ("sys_mhz", 48*clocks["usb_48"]/sys_period),
+    ])
+    # The tests print a lot.
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        result["compliance"] = compliance(case)
+        result["throughput"] = throughput(case, transactions)
+    return result
+
+
+def recommend(points, target):
+    """The slowest sys clock of each interface and `cdc` setting that passes
+    every test and moves at least `target` bytes per frame.
+
+    >>> points = [
+    ...     {"interface": "a", "cdc": True, "sys_mhz": mhz,
+    ...      "compliance": {"failed": []},
+    ...      "throughput": {"bytes_per_frame": bpf}}
+    ...     for mhz, bpf in ((96, 900), (48, 850), (24, 400))]
+    >>> dict(recommend(points, 800))
+    {'a cdc=True': 48}
+    >>> dict(recommend(points, 1000))
+    {'a cdc=True': None}
+    """
+    best = collections.OrderedDict()
+    for p in points:
+        key = "{} cdc={}".format(p["interface"], p["cdc"])
+        best.setdefault(key, None)
+        ok = (not p["compliance"]["failed"]
+              and p["throughput"].get("bytes_per_frame", 0) >= target)
+        if ok and (best[key] is None or p["sys_mhz"] < best[key]):
+            best[key] = p["sys_mhz"]
+    return best
+
+
+def _timed_out(args, timeout):
+    """The result of a point that did not finish in `timeout` seconds."""
+    name, sys_period, cdc, _ = args
+    clocks = sweep_case(name, sys_period, cdc).clocks
+    error = collections.OrderedDict(error="timed out after {}s".format(timeout))
+    return collections.OrderedDict([
+        ("interface", name),
+        ("cdc", cdc),
+        ("clocks", clocks),
+        ("sys_mhz", 48*clocks["usb_48"]/sys_period),
+        ("compliance", collections.OrderedDict([
+            ("tests", 0), ("passed", 0), ("failed", ["timeout"])])),
+        ("throughput", error),
+    ])
+
+
+def run(names=None, sys_periods=SYS_PERIODS, transactions=32, target=None, jobs=None,
+        timeout=TIMEOUT):
+    """Run every point of the sweep, each in its own process."""
+    names = list(names or SWEEPS)
+    points = [(name, sys_period, cdc, transactions)
+              for name in names
+              for cdc, sys_period in itertools.product(SWEEPS[name][2], sys_periods)]
+    # spawn, rather than fork, so nothing is shared between points.
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(jobs, maxtasksperchild=1) as pool:
+        pending = [pool.apply_async(_run_point, (p,)) for p in points]
+        results = []
+        for p, r in zip(points, pending):
+            try:
+                results.append(r.get(timeout))
+            except multiprocessing.TimeoutError:
+                results.append(_timed_out(p, timeout))
+        # Leaving the with block terminates any point still running.
+
+    if target is None:
+        # The best any point managed, less a margin for the test's jitter.
+        target = 0.95*max(
+            [r["throughput"].get("bytes_per_frame", 0) for r in results] + [0])
+    return collections.OrderedDict([
+        ("commit", _commit()),
+        ("python", platform.python_version()),
+        ("transactions", transactions),
+        ("target_bytes_per_frame", target),
+        ("full_speed_bytes_per_frame", FULL_SPEED),
+        ("points", results),
+        ("recommended_sys_mhz", recommend(results, target)),
+    ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("interfaces", nargs="*", metavar="interface",
+                        help="one of {} (default: all)".format(", ".join(SWEEPS)))
+    parser.add_argument("-s", "--sys-period", type=int, action="append",
+                        help="sys clock period to try, usb_48 is 8 (default: {})".format(
+                            ", ".join(str(p) for p in SYS_PERIODS)))
+    parser.add_argument("-n", "--transactions", type=int, default=32,
+                        help="bulk transfers in the throughput workload (default: 32)")
+    parser.add_argument("-t", "--target", type=float,
+                        help="bytes per frame to sustain (default: 95%% of the best point)")
+    parser.add_argument("-j", "--jobs", type=int, help="points to run at once")
+    parser.add_argument("--timeout", type=float, default=TIMEOUT,
+                        help="seconds each point may take (default: {})".format(TIMEOUT))
+    parser.add_argument("-o", "--output", type=argparse.FileType("w"),
+                        default=sys.stdout, help="JSON file to write")
+    args = parser.parse_args(argv)
+    for name in args.interfaces:
+        if name not in SWEEPS:
+            parser.error("unknown interface: {}".format(name))
+    for period in args.sys_period or ():
+        if period <= 0 or period % 2:
+            parser.error("sys period must be even: {}".format(period))
+        for name in args.interfaces or SWEEPS:
+            if not sees_every_edge(sweep_case(name, period, None).clocks):
+                parser.error("sys period {} misses clock edges".format(period))
+
+    results = run(args.interfaces, args.sys_period or SYS_PERIODS,
+                  args.transactions, args.target, args.jobs, args.timeout)
+    json.dump(results, args.output, indent=2)
+    args.output.write("\n")
+
+    for p in results["points"]:
+        throughput = p["throughput"]
+        print("{:<26} cdc={:<5} {:>6.1f} MHz {:>3}/{:<3} passed {}".format(
+            p["interface"], str(p["cdc"]), p["sys_mhz"],
+            p["compliance"]["passed"], p["compliance"]["tests"],
+            throughput["error"] if "error" in throughput else
+            "{:8.1f} bytes/frame".format(throughput["bytes_per_frame"])),
+            file=sys.stderr)
+    for key, mhz in results["recommended_sys_mhz"].items():
+        print("{}: {}".format(key, "none" if mhz is None else "{:.1f} MHz".format(mhz)),
+              file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
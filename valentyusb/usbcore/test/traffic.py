@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""Constrained random USB traffic, checked by a scoreboard.
+
+`random_traffic` draws an endless stream of `Transaction`s: SOFs, bus
+resets, SETUPs and IN/OUT transfers on a mix of endpoints, where the
+firmware holds off the data for a few NAKs and the host sometimes sends an
+OUT with a bad CRC16.  `Scoreboard` keeps what the host and the firmware
+know (the data toggles, running digests of the data moved each way), so
+checking a transaction doesn't depend on remembering earlier ones.
+
+`CommonUsbSoakTestCase` plays the traffic through the `CommonUsbTestCase`
+helpers.  Only the generator's state and one transaction are held at a
+time, so memory use stays flat however long it runs:
+
+    VALENTYUSB_SOAK_TRANSACTIONS=1000000 python3 -m unittest \\
+        usbcore.cpu.epfifo_test.TestPerEndpointFifoInterface.test_random_traffic
+"""
+
+import collections
+import os
+import random
+import zlib
+
+from ..endpoint import EndpointResponse, EndpointType
+from ..pid import PID
+from ..utils.packet import crc16, encode_data, encode_pid
+
+
+EP0_OUT = EndpointType.epaddr(0, EndpointType.OUT)
+EP0_IN = EndpointType.epaddr(0, EndpointType.IN)
+
+
+# `kind` is one of "sof", "reset", "setup", "in" or "out".  `data` is the
+# frame number for a SOF and the SE0 length in usb_48 cycles for a reset.
+# `naks` is how many times the firmware NAKs before accepting or providing
+# the data, and `bad_crc` marks an OUT sent with a corrupted CRC16.
+Transaction = collections.namedtuple(
+    "Transaction", ["kind", "epaddr", "data", "naks", "bad_crc"])
+
+
+# Rates are the chance of each transaction being of that kind, the rest are
+# IN and OUT transfers of `min_size` to `max_size` bytes on a random endpoint
+# from `endpoints`.  `nak` and `bad_crc` are the chances of a transfer being
+# NAKed (up to `max_naks` times) or corrupted.
+TrafficConfig = collections.namedtuple("TrafficConfig", [
+    "endpoints", "max_size", "sof", "reset", "setup", "nak", "max_naks",
+    "bad_crc", "reset_cycles", "min_size",
+])
+TrafficConfig.__new__.__defaults__ = (64, 0.1, 0.01, 0.05, 0.2, 3, 0.02, 320, 0)
+
+
+def random_traffic(config, seed=0):
+    """Yield an endless stream of random `Transaction`s.
+
+    The same seed always gives the same stream.
+
+    >>> config = TrafficConfig(endpoints=(EP0_OUT, EP0_IN, 3), max_size=8)
+    >>> from itertools import islice
+    >>> a = list(islice(random_traffic(config, seed=1), 100))
+    >>> a == list(islice(random_traffic(config, seed=1), 100))
+    True
+    >>> sorted(set(t.kind for t in a))
+    ['in', 'out', 'reset', 'setup', 'sof']
+    >>> max(len(t.data) for t in a if t.kind in ("in", "out"))
+    8
+    >>> all(t.epaddr == EP0_OUT and len(t.data) == 8
+    ...     for t in a if t.kind == "setup")
+    True
+    """
+    rng = random.Random(seed)
+    endpoints = list(config.endpoints)
+    can_setup = EP0_OUT in endpoints and EP0_IN in endpoints
+    frame = 0
+    while True:
+        r = rng.random()
+        if r < config.sof:
+            yield Transaction("sof", None, frame, 0, False)
+            frame = (frame + 1) & 0x7ff
+            continue
+        r -= config.sof
+
+        if r < config.reset:
+            yield Transaction("reset", None, config.reset_cycles, 0, False)
+            continue
+        r -= config.reset
+
+        if can_setup and r < config.setup:
+            # bmRequestType, bRequest, wValue, wIndex and wLength
+            data = (rng.choice((0x00, 0x80)), rng.randrange(13),
+                    rng.randrange(256), rng.randrange(256), 0, 0,
+                    rng.randrange(config.max_size + 1), 0)
+            yield Transaction("setup", EP0_OUT, data, 0, False)
+            continue
+
+        epaddr = rng.choice(endpoints)
+        data = tuple(rng.randrange(256)
+                     for i in range(rng.randint(config.min_size, config.max_size)))
+        naks = 0
+        if rng.random() < config.nak:
+            naks = rng.randint(1, config.max_naks)
+        if EndpointType.epdir(epaddr) == EndpointType.IN:
+            yield Transaction("in", epaddr, data, naks, False)
+        else:
+            bad_crc = rng.random() < config.bad_crc
+            yield Transaction("out", epaddr, data, naks, bad_crc)
+
+
+def _ep(epaddr):
+    return "ep%d %s" % (EndpointType.epnum(epaddr), EndpointType.epdir(epaddr).name)
+
+
+class ScoreboardError(AssertionError):
+    pass
+
+
+class Scoreboard:
+    """What the host and firmware expect of the device.
+
+    Data toggles follow the gateware: a SETUP sets both EP0 toggles to
+    DATA1, and every ACKed transfer flips the toggle of its endpoint.  The
+    data moved each way is folded into a CRC32 per endpoint, so the payloads
+    themselves aren't kept.
+
+    >>> sb = Scoreboard({EP0_OUT: True, 3: True})
+    >>> sb.expected_pid(3)
+    <PID.DATA1: 11>
+    >>> sb.sent(3, [1, 2, 3])
+    >>> sb.received(3, [1, 2, 3])
+    >>> sb.acked(3)
+    >>> sb.expected_pid(3)
+    <PID.DATA0: 3>
+    >>> sb.check_dtb(3, True)
+    Traceback (most recent call last):
+    ...
+    usbcore.test.traffic.ScoreboardError: ep1 IN data toggle is DATA1, expected DATA0
+    >>> sb.sent(3, [4])
+    >>> sb.received(3, [5])
+    Traceback (most recent call last):
+    ...
+    usbcore.test.traffic.ScoreboardError: ep1 IN got [5], expected [4]
+    """
+
+    def __init__(self, toggles):
+        self.toggles = dict(toggles)
+        self.expected = {}
+        self.sent_crc = collections.Counter()
+        self.received_crc = collections.Counter()
+        self.stats = collections.Counter()
+
+    def expected_pid(self, epaddr):
+        return PID.DATA1 if self.toggles[epaddr] else PID.DATA0
+
+    def acked(self, epaddr):
+        self.toggles[epaddr] = not self.toggles[epaddr]
+        self.stats["acked"] += 1
+
+    def setup(self):
+        self.toggles[EP0_OUT] = True
+        self.toggles[EP0_IN] = True
+
+    def check_dtb(self, epaddr, dtb):
+        if bool(dtb) != self.toggles[epaddr]:
+            raise ScoreboardError("%s data toggle is %s, expected %s" % (
+                _ep(epaddr), "DATA1" if dtb else "DATA0",
+                self.expected_pid(epaddr).name))
+
+    def sent(self, epaddr, data):
+        data = bytes(data)
+        self.expected[epaddr] = data
+        self.sent_crc[epaddr] = zlib.crc32(data, self.sent_crc[epaddr])
+        self.stats["bytes"] += len(data)
+
+    def received(self, epaddr, data):
+        data = bytes(data)
+        expected = self.expected.pop(epaddr, None)
+        if data != expected:
+            raise ScoreboardError("%s got %r, expected %r" % (
+                _ep(epaddr), list(data), None if expected is None else list(expected)))
+        self.received_crc[epaddr] = zlib.crc32(data, self.received_crc[epaddr])
+
+    def check_digests(self):
+        """Check every transfer so far arrived, and arrived intact."""
+        if self.expected:
+            raise ScoreboardError("Never received data for %s" % ", ".join(
+                _ep(epaddr) for epaddr in sorted(self.expected)))
+        for epaddr in set(self.sent_crc) | set(self.received_crc):
+            if self.sent_crc[epaddr] != self.received_crc[epaddr]:
+                raise ScoreboardError("%s data digests differ: sent %08x, received %08x" % (
+                    _ep(epaddr), self.sent_crc[epaddr], self.received_crc[epaddr]))
+
+
+class CommonUsbSoakTestCase:
+    """Random traffic soak test, to mix in with `CommonUsbTestCase`.
+
+    Besides the `CommonUsbTestCase` helpers, interfaces need `read_data`
+    returning the raw bytes (including the CRC16) of a received packet.
+    """
+
+    # Endpoint addresses to send traffic to, see `TrafficConfig`.
+    soak_endpoints = (EP0_OUT, EP0_IN)
+    soak_transactions = int(os.environ.get("VALENTYUSB_SOAK_TRANSACTIONS", "16"))
+    soak_seed = int(os.environ.get("VALENTYUSB_SOAK_SEED", "0"))
+
+    def read_data(self, epaddr):
+        raise NotImplementedError
+
+    def soak(self, addr, transactions, seed=0, config=None):
+        """Play `transactions` of `random_traffic` through the DUT."""
+        if config is None:
+            config = TrafficConfig(endpoints=self.soak_endpoints)
+        if hasattr(self.dut, "address"):
+            yield from self.dut.address.write(addr)
+
+        toggles = {}
+        for epaddr in config.endpoints:
+            yield from self.clear_pending(epaddr)
+            yield from self.set_response(epaddr, EndpointResponse.NAK)
+            toggles[epaddr] = yield from self.dtb(epaddr)
+        self.scoreboard = scoreboard = Scoreboard(toggles)
+        yield from self.tick_usb12()
+
+        traffic = random_traffic(config, seed)
+        for i in range(transactions):
+            t = next(traffic)
+            try:
+                yield from getattr(self, "soak_" + t.kind)(addr, t, scoreboard)
+                if t.epaddr is not None:
+                    scoreboard.check_dtb(t.epaddr, (yield from self.dtb(t.epaddr)))
+            except AssertionError as e:
+                raise AssertionError("Transaction %d of seed %d, %r: %s" % (
+                    i, seed, t, e)) from e
+            scoreboard.stats[t.kind] += 1
+        scoreboard.check_digests()
+
+    def soak_sof(self, addr, t, scoreboard):
+        yield from self.send_sof_packet(t.data)
+
+    def soak_reset(self, addr, t, scoreboard):
+        # The gateware leaves bus resets to the firmware, which keeps the
+        # endpoints as they are.
+        yield from self.dut.iobuf.recv('_')
+        for i in range(t.data):
+            yield from self.tick_usb48()
+        yield from self.idle()
+        for epaddr in scoreboard.toggles:
+            scoreboard.check_dtb(epaddr, (yield from self.dtb(epaddr)))
+
+    def soak_setup(self, addr, t, scoreboard):
+        yield from self.transaction_setup(addr, list(t.data))
+        scoreboard.setup()
+        scoreboard.check_dtb(EP0_IN, (yield from self.dtb(EP0_IN)))
+
+    def soak_in(self, addr, t, scoreboard):
+        epaddr, data = t.epaddr, list(t.data)
+        yield from self.set_response(epaddr, EndpointResponse.NAK)
+        yield from self.set_data(epaddr, data)
+        for i in range(t.naks):
+            yield from self.send_token_packet(PID.IN, addr, epaddr)
+            yield from self.expect_nak()
+            yield from self.check_no_pending(epaddr)
+        scoreboard.check_dtb(epaddr, (yield from self.dtb(epaddr)))
+
+        scoreboard.sent(epaddr, data)
+        yield from self.set_response(epaddr, EndpointResponse.ACK)
+        yield from self.send_token_packet(PID.IN, addr, epaddr)
+        yield from self.expect_data_packet(scoreboard.expected_pid(epaddr), data)
+        scoreboard.received(epaddr, data)
+        yield from self.send_ack()
+        yield from self.clear_pending(epaddr)
+        yield from self.set_response(epaddr, EndpointResponse.NAK)
+        scoreboard.acked(epaddr)
+
+    def soak_out(self, addr, t, scoreboard):
+        epaddr, data = t.epaddr, list(t.data)
+        crc = crc16(data)
+        if t.bad_crc:
+            crc = [crc[0], crc[1] ^ 0xff]
+        # The gateware doesn't check the DATA PID of an OUT.
+        packet = encode_pid(scoreboard.expected_pid(epaddr)) + encode_data(data + crc)
+
+        yield from self.set_response(epaddr, EndpointResponse.NAK)
+        for i in range(t.naks):
+            yield from self.send_token_packet(PID.OUT, addr, epaddr)
+            yield from self._send_packet(packet)
+            yield from self.expect_nak()
+            yield from self.check_no_pending(epaddr)
+        scoreboard.check_dtb(epaddr, (yield from self.dtb(epaddr)))
+
+        if not t.bad_crc:
+            scoreboard.sent(epaddr, data)
+        yield from self.set_response(epaddr, EndpointResponse.ACK)
+        yield from self.send_token_packet(PID.OUT, addr, epaddr)
+        yield from self._send_packet(packet)
+        # The gateware doesn't check CRCs, a bad one is ACKed and left to the
+        # firmware to catch.
+        yield from self.expect_ack()
+        actual = yield from self.read_data(epaddr)
+        yield from self.clear_pending(epaddr)
+        yield from self.set_response(epaddr, EndpointResponse.NAK)
+        scoreboard.acked(epaddr)
+
+        actual_data, actual_crc = actual[:-2], actual[-2:]
+        if list(actual_crc) == crc16(actual_data):
+            self.assertFalse(t.bad_crc, "Firmware missed a bad CRC")
+            scoreboard.received(epaddr, actual_data)
+        else:
+            self.assertTrue(t.bad_crc, "Unexpected bad CRC on %r" % actual)
+            self.assertSequenceEqual(crc, actual_crc)
+            scoreboard.stats["bad_crc"] += 1
+
+    def test_random_traffic(self):
+        # Only the scoreboard's verdict, the per packet output adds up.
+        self.verbose = False
+
+        def stim():
+            yield from self.soak(28, self.soak_transactions, self.soak_seed)
+        self.run_sim(stim)
@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""Run migen simulations against a Verilator compiled model of the design.
+
+`run_verilator` takes the same arguments as migen's `run_simulation`.  The
+design is converted to Verilog, compiled by Verilator (5.x, or 4.2xx with
+VerilatedContext) into a shared library (see verilator_model.cpp) and driven
+by the same generators.  verilator_test.py checks it against migen's
+simulator cycle by cycle and runs the TX and RX pipeline tests through it.
+Compiled models are cached by a hash of the design, so only the first run of
+a design pays for the build.
+
+Generators can read any expression and assign to signals or slices of
+signals.  Signals which aren't part of the design (such as the packet_h2d
+markers in the test cases) are kept on the Python side.  Reading memories
+directly isn't supported.
+"""
+
+import collections
+import collections.abc
+import ctypes
+import functools
+import hashlib
+import inspect
+import operator
+import os
+import shutil
+import subprocess
+import tempfile
+import weakref
+
+from migen import *
+from migen.fhdl import verilog
+from migen.fhdl.structure import _Assign, _Slice, _Statement, _Value, _Fragment
+from migen.fhdl.visit import NodeVisitor
+from migen.genlib.resetsync import AsyncResetSynchronizer
+from migen.sim.core import (Evaluator, TimeManager, DummyAsyncResetSynchronizer,
+                            _truncate)
+
+
+VERILATOR = os.environ.get("VERILATOR", "verilator")
+VERILATOR_CACHE_DIR = os.environ.get(
+    "VALENTYUSB_VERILATOR_CACHE",
+    os.path.join(
+        os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+        "valentyusb", "verilator"))
+VERILATOR_FLAGS = [
+    "--cc", "--exe", "--build",
+    "--vpi", "--public-flat-rw",
+    "--top-module", "top",
+    "-O3", "--x-assign", "fast", "--x-initial", "fast", "--noassert",
+    "-Wno-fatal", "-Wno-lint", "-Wno-style",
+    "-CFLAGS", "-fPIC -O2",
+    "-LDFLAGS", "-shared",
+    "-o", "libmodel.so",
+]
+
+_MODEL_SOURCE = os.path.join(os.path.dirname(__file__), "verilator_model.cpp")
+
+_fragments = weakref.WeakKeyDictionary()
+
+
+def have_verilator():
+    return shutil.which(VERILATOR) is not None
+
+
+@functools.lru_cache(maxsize=None)
+def verilator_version():
+    return subprocess.run(
+        [VERILATOR, "--version"], check=True, universal_newlines=True,
+        stdout=subprocess.PIPE).stdout.strip()
+
+
+def design_hash(source, data_files={}, trace=False, version=None):
+    """Hash of everything which goes into a compiled model.
+
+    >>> design_hash("module top; endmodule", version="") == design_hash("module top; endmodule", version="")
+    True
+    >>> design_hash("module top; endmodule", version="") == design_hash("module top; endmodule", trace=True, version="")
+    False
+    """
+    if version is None:
+        version = verilator_version()
+    h = hashlib.sha256()
+    with open(_MODEL_SOURCE, "rb") as f:
+        model_source = f.read()
+    for part in [version, " ".join(VERILATOR_FLAGS), str(trace), source]:
+        h.update(part.encode("utf-8") + b"\0")
+    h.update(model_source + b"\0")
+    for name, contents in sorted(data_files.items()):
+        h.update(name.encode("utf-8") + b"\0" + contents.encode("utf-8") + b"\0")
+    return h.hexdigest()[:24]
+
+
+def build_model(source, data_files={}, trace=False, cache_dir=None):
+    """Compile Verilog for module `top`, returning the model's directory.
+
+    The model is built in a temporary directory which is renamed into
+    `cache_dir` (default VERILATOR_CACHE_DIR) once complete, so an existing
+    directory always holds a finished build.
+    """
+    if cache_dir is None:
+        cache_dir = VERILATOR_CACHE_DIR
+
+    key = design_hash(source, data_files, trace)
+    directory = os.path.join(cache_dir, key)
+    if os.path.exists(os.path.join(directory, "obj", "libmodel.so")):
+        return directory
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=cache_dir, prefix=key + ".", suffix=".tmp")
+    try:
+        with open(os.path.join(tmp, "top.v"), "w") as f:
+            f.write(source)
+        for name, contents in data_files.items():
+            with open(os.path.join(tmp, name), "w") as f:
+                f.write(contents)
+        shutil.copy(_MODEL_SOURCE, tmp)
+
+        cmd = [VERILATOR] + VERILATOR_FLAGS + ["--Mdir", "obj"]
+        if trace:
+            cmd.append("--trace")
+        cmd += ["top.v", os.path.basename(_MODEL_SOURCE)]
+        result = subprocess.run(
+            cmd, cwd=tmp, universal_newlines=True,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        if result.returncode != 0:
+            raise RuntimeError("Verilator build failed:\n%s\n%s" % (
+                " ".join(cmd), result.stdout))
+
+        try:
+            os.rename(tmp, directory)
+        except OSError:
+            # Another process finished the same model first.
+            if not os.path.exists(directory):
+                raise
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return directory
+
+
+class _ReadLister(NodeVisitor):
+    """Signals an expression reads, including its clock and reset signals."""
+
+    def __init__(self, clock_domains):
+        self.clock_domains = clock_domains
+        self.output = set()
+
+    def visit_Signal(self, node):
+        self.output.add(node)
+
+    def visit_ClockSignal(self, node):
+        self.output.add(self.clock_domains[node.cd].clk)
+
+    def visit_ResetSignal(self, node):
+        rst = self.clock_domains[node.cd].rst
+        if rst is not None:
+            self.output.add(rst)
+
+
+class VerilatorModel:
+    """ctypes wrapper around a model built by `build_model`."""
+
+    def __init__(self, directory, vcd_name=None):
+        lib = ctypes.CDLL(os.path.join(directory, "obj", "libmodel.so"))
+        lib.model_new.restype = ctypes.c_void_p
+        lib.model_new.argtypes = [ctypes.c_char_p]
+        lib.model_free.argtypes = [ctypes.c_void_p]
+        lib.model_handle.restype = ctypes.c_void_p
+        lib.model_handle.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+        lib.model_get.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int]
+        lib.model_put.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int]
+        lib.model_eval.argtypes = [ctypes.c_void_p]
+        lib.model_dump.argtypes = [ctypes.c_void_p, ctypes.c_uint64]
+        self.lib = lib
+
+        if vcd_name is not None:
+            vcd_name = os.path.abspath(vcd_name).encode("utf-8")
+        # $readmemh in the design opens its files relative to the cwd.
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            self.model = lib.model_new(vcd_name)
+        finally:
+            os.chdir(cwd)
+
+    def handle(self, name):
+        """VPI handle for the signal called `name`, or None."""
+        return self.lib.model_handle(self.model, name.encode("utf-8"))
+
+    def get(self, handle, nbits):
+        nwords = (nbits + 31) // 32
+        words = (ctypes.c_uint32 * nwords)()
+        self.lib.model_get(handle, words, nwords)
+        return int.from_bytes(bytes(words), "little") & ((1 << nbits) - 1)
+
+    def put(self, handle, nbits, value):
+        nwords = (nbits + 31) // 32
+        value &= (1 << nbits) - 1
+        words = (ctypes.c_uint32 * nwords).from_buffer_copy(
+            value.to_bytes(4*nwords, "little"))
+        self.lib.model_put(handle, words, nwords)
+
+    def eval(self):
+        self.lib.model_eval(self.model)
+
+    def dump(self, time):
+        self.lib.model_dump(self.model, time)
+
+    def close(self):
+        if self.model is not None:
+            self.lib.model_free(self.model)
+            self.model = None
+
+
+class VerilatorSimulator:
+    """Same interface and generator protocol as migen's Simulator."""
+
+    def __init__(self, fragment_or_module, generators, clocks={"sys": 10}, vcd_name=None,
+                 special_overrides={}, cache_dir=None):
+        if isinstance(fragment_or_module, _Fragment):
+            fragment = fragment_or_module
+        else:
+            # Modules only give out their fragment once, keep it so the same
+            # DUT can be simulated again.
+            fragment = _fragments.get(fragment_or_module)
+            if fragment is None:
+                fragment = fragment_or_module.get_fragment()
+                _fragments[fragment_or_module] = fragment
+
+        if not isinstance(generators, dict):
+            generators = {"sys": generators}
+        self.generators = dict()
+        self.passive_generators = set()
+        for k, v in generators.items():
+            if (isinstance(v, collections.abc.Iterable)
+                    and not inspect.isgenerator(v)):
+                self.generators[k] = list(v)
+            else:
+                self.generators[k] = [v]
+
+        clocks = collections.OrderedDict(sorted(clocks.items(),
+                                                key=operator.itemgetter(0)))
+        self.time = TimeManager(clocks)
+        for clock in clocks.keys():
+            if clock not in fragment.clock_domains:
+                cd = ClockDomain(name=clock, reset_less=True)
+                cd.clk.reset = C(self.time.clocks[clock].high)
+                fragment.clock_domains.append(cd)
+
+        ios = set()
+        for cd in fragment.clock_domains:
+            ios.add(cd.clk)
+            if cd.rst is not None:
+                ios.add(cd.rst)
+        overrides = {AsyncResetSynchronizer: DummyAsyncResetSynchronizer}
+        overrides.update(special_overrides)
+        output = verilog.convert(fragment, ios, special_overrides=overrides)
+        self.ns = output.ns
+        self.clock_domains = fragment.clock_domains
+
+        directory = build_model(
+            output.main_source, output.data_files,
+            trace=vcd_name is not None, cache_dir=cache_dir)
+        self.model = VerilatorModel(directory, vcd_name)
+
+        self.handles = dict()
+        self.shadow = dict()
+        self.pending = dict()
+        # Expressions are evaluated in Python from the signals they read.
+        self.evaluator = Evaluator(self.clock_domains, {})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        self.model.close()
+
+    def _handle(self, signal):
+        try:
+            return self.handles[signal]
+        except KeyError:
+            pass
+        try:
+            handle = self.model.handle(self.ns.get_name(signal))
+        except KeyError:
+            handle = None
+        self.handles[signal] = handle
+        return handle
+
+    def _read(self, signal):
+        handle = self._handle(signal)
+        if handle is None:
+            return self.shadow.get(signal, signal.reset.value)
+        value = self.model.get(handle, len(signal))
+        if signal.signed and value & (1 << (len(signal) - 1)):
+            value -= 1 << len(signal)
+        return value
+
+    def _eval(self, node):
+        if isinstance(node, Signal):
+            return self._read(node)
+        lister = _ReadLister(self.clock_domains)
+        lister.visit(node)
+        values = self.evaluator.signal_values
+        for signal in lister.output:
+            values[signal] = self._read(signal)
+        return self.evaluator.eval(node)
+
+    def _execute(self, statement):
+        if not isinstance(statement, _Assign):
+            raise NotImplementedError("Unsupported statement", statement)
+        value = self._eval(statement.r)
+        target = statement.l
+        if isinstance(target, _Slice) and isinstance(target.value, Signal):
+            mask = ((1 << (target.stop - target.start)) - 1) << target.start
+            value <<= target.start
+            target = target.value
+        elif isinstance(target, Signal):
+            mask = (1 << len(target)) - 1
+        else:
+            raise NotImplementedError("Unsupported assignment target", target)
+        # Slices are merged into the value the signal has after the edge,
+        # as migen does, so keep the bits written rather than the result.
+        old_mask, old_value = self.pending.get(target, (0, 0))
+        self.pending[target] = (old_mask | mask,
+                                (old_value & ~mask) | (value & mask))
+
+    def _commit(self):
+        for signal, (mask, value) in self.pending.items():
+            full = (1 << len(signal)) - 1
+            if mask != full:
+                value |= self._read(signal) & full & ~mask
+            value = _truncate(value, len(signal), signal.signed)
+            handle = self._handle(signal)
+            if handle is None:
+                self.shadow[signal] = value
+            else:
+                self.model.put(handle, len(signal), value)
+        self.pending.clear()
+
+    def _set_clock(self, cd, level):
+        handle = self._handle(self.clock_domains[cd].clk)
+        if handle is not None:
+            self.model.put(handle, 1, level)
+
+    def _evalexec_nested_lists(self, x):
+        if isinstance(x, list):
+            return [self._evalexec_nested_lists(e) for e in x]
+        elif isinstance(x, _Value):
+            return self._eval(x)
+        elif isinstance(x, _Statement):
+            self._execute(x)
+            return None
+        else:
+            raise ValueError("Invalid simulator exec/eval request", x)
+
+    def _process_generators(self, cd):
+        exhausted = []
+        for generator in self.generators[cd]:
+            reply = None
+            while True:
+                try:
+                    request = generator.send(reply)
+                    if request is None:
+                        break  # next cycle
+                    elif isinstance(request, str):
+                        if request == "passive":
+                            self.passive_generators.add(generator)
+                        elif request == "active":
+                            self.passive_generators.discard(generator)
+                        else:
+                            raise ValueError("Unknown simulator command: '{}'"
+                                             .format(request))
+                    else:
+                        reply = self._evalexec_nested_lists(request)
+                except StopIteration:
+                    exhausted.append(generator)
+                    break
+        for generator in exhausted:
+            self.generators[cd].remove(generator)
+
+    def _continue_simulation(self):
+        for cd_generators in self.generators.values():
+            if set(cd_generators) - self.passive_generators:
+                return True
+        return False
+
+    def run(self):
+        for cd, state in self.time.clocks.items():
+            self._set_clock(cd, int(state.high))
+        self.model.eval()
+        now = 0
+        self.model.dump(now)
+
+        while True:
+            dt, rising, falling = self.time.tick()
+            now += dt
+            # Generators see the values from before the edge, and their
+            # writes land together with the edge's sync updates.
+            for cd in self.time.clocks:
+                if cd in rising and cd in self.generators:
+                    self._process_generators(cd)
+            for cd in rising:
+                self._set_clock(cd, 1)
+            for cd in falling:
+                self._set_clock(cd, 0)
+            self.model.eval()
+            if self.pending:
+                self._commit()
+                self.model.eval()
+            self.model.dump(now)
+
+            if not self._continue_simulation():
+                break
+
+
+def run_verilator(*args, **kwargs):
+    with VerilatorSimulator(*args, **kwargs) as s:
+        s.run()
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
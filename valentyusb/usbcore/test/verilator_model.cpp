@@ -0,0 +1,112 @@
+// Wraps a Verilated migen design ("top") in a small C API, so that
+// test/verilator.py can drive it with ctypes.  Signals are accessed through
+// VPI by name, which needs the model built with --vpi --public-flat-rw.
+
+#include <cstdint>
+#include <string>
+#include <vector>
+
+#include "verilated.h"
+#include "verilated_vpi.h"
+#include "Vtop.h"
+#if VM_TRACE
+#include "verilated_vcd_c.h"
+#endif
+
+struct Model {
+    VerilatedContext* context;
+    Vtop* top;
+#if VM_TRACE
+    VerilatedVcdC* trace;
+#endif
+};
+
+extern "C" {
+
+void* model_new(const char* vcd_name) {
+    Model* m = new Model();
+    m->context = new VerilatedContext;
+#if VM_TRACE
+    m->trace = nullptr;
+    if (vcd_name) {
+        m->context->traceEverOn(true);
+    }
+#endif
+    m->top = new Vtop(m->context, "TOP");
+#if VM_TRACE
+    if (vcd_name) {
+        m->trace = new VerilatedVcdC;
+        m->top->trace(m->trace, 99);
+        m->trace->open(vcd_name);
+    }
+#endif
+    return m;
+}
+
+void model_free(void* p) {
+    Model* m = static_cast<Model*>(p);
+    m->top->final();
+#if VM_TRACE
+    if (m->trace) {
+        m->trace->close();
+        delete m->trace;
+    }
+#endif
+    delete m->top;
+    delete m->context;
+    delete m;
+}
+
+void* model_handle(void* p, const char* name) {
+    // Scopes are named after the model instance ("TOP"): ports live in its
+    // "TOP" scope, the rest of the design in "top".  Look for ports first,
+    // "top" holds copies of them which eval() overwrites.
+    Model* m = static_cast<Model*>(p);
+    std::string instance = m->top->name();
+    const char* scopes[] = {".TOP.", ".top."};
+    for (const char* scope : scopes) {
+        std::string full = instance + scope + name;
+        vpiHandle h = vpi_handle_by_name((PLI_BYTE8*)full.c_str(), NULL);
+        if (h) {
+            return h;
+        }
+    }
+    return nullptr;
+}
+
+void model_get(void* h, uint32_t* words, int nwords) {
+    s_vpi_value v;
+    v.format = vpiVectorVal;
+    vpi_get_value(static_cast<vpiHandle>(h), &v);
+    for (int i = 0; i < nwords; i++) {
+        words[i] = v.value.vector[i].aval;
+    }
+}
+
+void model_put(void* h, const uint32_t* words, int nwords) {
+    std::vector<s_vpi_vecval> vector(nwords);
+    for (int i = 0; i < nwords; i++) {
+        vector[i].aval = words[i];
+        vector[i].bval = 0;
+    }
+    s_vpi_value v;
+    v.format = vpiVectorVal;
+    v.value.vector = vector.data();
+    vpi_put_value(static_cast<vpiHandle>(h), &v, NULL, vpiNoDelay);
+}
+
+void model_eval(void* p) {
+    static_cast<Model*>(p)->top->eval();
+}
+
+void model_dump(void* p, uint64_t time) {
+    Model* m = static_cast<Model*>(p);
+    m->context->time(time);
+#if VM_TRACE
+    if (m->trace) {
+        m->trace->dump(time);
+    }
+#endif
+}
+
+}
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import unittest
+
+from migen import *
+
+from ..io import FakeIoBuf
+from ..rx import pipeline_test as rx_pipeline_test
+from ..tx import pipeline_test as tx_pipeline_test
+from .verilator import build_model, have_verilator, run_verilator
+
+
+class Counters(Module):
+    def __init__(self):
+        self.sys_count = Signal(8)
+        self.usb_48_count = Signal(8)
+        self.load = Signal(8)
+        self.wide = Signal(100, reset=(1 << 99) | 1)
+        self.sync += [
+            self.sys_count.eq(self.sys_count + 1),
+            self.wide.eq(Cat(self.wide[-1], self.wide[:-1])),
+        ]
+        self.sync.usb_48 += [
+            self.usb_48_count.eq(self.usb_48_count + self.load + 1),
+        ]
+
+
+@unittest.skipUnless(have_verilator(), "verilator not found")
+class TestVerilator(unittest.TestCase):
+    def setUp(self):
+        self.cache = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache.cleanup)
+
+    def run_both(self, make_dut, stim, clocks):
+        logs = []
+        for run in (run_simulation, run_verilator):
+            dut = make_dut()
+            log = []
+            kwargs = {}
+            if run is run_verilator:
+                kwargs["cache_dir"] = self.cache.name
+            run(dut, stim(dut, log), clocks=clocks, **kwargs)
+            logs.append(log)
+        self.assertEqual(logs[0], logs[1])
+        return logs[0]
+
+    def test_counters(self):
+        loose = Signal(4)
+        def stim(dut, log):
+            for i in range(40):
+                if i == 10:
+                    yield dut.load.eq(3)
+                    yield dut.sys_count[4:].eq(0b1010)
+                    yield loose.eq(9)
+                log.append((
+                    (yield dut.sys_count),
+                    (yield dut.usb_48_count),
+                    (yield dut.wide),
+                    (yield dut.wide[98:]),
+                    (yield loose),
+                ))
+                yield
+        log = self.run_both(Counters, stim, {"sys": 2, "usb_48": 8})
+        self.assertEqual(log[-1][-1], 9)
+
+    def test_fakeiobuf(self):
+        packet = "KJKJKJKK" + "JKKKJJKK" + "__J"
+        def stim(dut, log):
+            yield
+            yield from dut.host.send(packet)
+            for i in range(len(packet) + 2):
+                yield
+                log.append((yield from dut.current()))
+        log = self.run_both(FakeIoBuf, stim, {"sys": 10})
+        self.assertEqual("".join(log[1:len(packet)+1]), packet)
+
+    def test_model_cached(self):
+        source = "module top(input sys_clk);\nendmodule\n"
+        directory = build_model(source, cache_dir=self.cache.name)
+        library = os.path.join(directory, "obj", "libmodel.so")
+        mtime = os.stat(library).st_mtime_ns
+        self.assertEqual(build_model(source, cache_dir=self.cache.name), directory)
+        self.assertEqual(os.stat(library).st_mtime_ns, mtime)
+        self.assertNotEqual(build_model(source, trace=True, cache_dir=self.cache.name), directory)
+
+
+@unittest.skipUnless(have_verilator(), "verilator not found")
+class TestTxPipelineVerilator(tx_pipeline_test.TestTxPipeline):
+    simulator = "verilator"
+
+
+@unittest.skipUnless(have_verilator(), "verilator not found")
+class TestRxPipelineVerilator(rx_pipeline_test.TestRxPipeline):
+    simulator = "verilator"
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 
 import functools
+import json
 import operator
+import os
+import tempfile
 import unittest
 
 from migen import *
@@ -9,6 +12,7 @@ from migen import *
 from migen.fhdl.decorators import CEInserter, ResetInserter
 
 from ..utils.CrcMoose3 import CrcAlgorithm
+from ..utils.bits import BitVector, transpose, gf2_matvec
 from ..utils.packet import crc16, encode_data, b
 from .shifter import TxShifter
 from .tester import module_tester
@@ -120,15 +124,39 @@ def cols(rows):
     [2, 'b']
     [3, 'c']
 
+    >>> cols([BitVector(0b01, 2), BitVector(0b11, 2), BitVector(0b10, 2)])
+    [BitVector(0b011, 3), BitVector(0b110, 3)]
     """
-    all_c = []
-    for ci in range(len(rows[0])):
-        all_c.append([])
-    for ci in range(len(rows[0])):
-        for ri in range(len(rows)):
-            assert len(rows[ri]) == len(all_c), "len(%r) != %i" % (rows[ri], len(all_c))
-            all_c[ci].append(rows[ri][ci])
-    return all_c
+    if all(isinstance(r, BitVector) for r in rows):
+        return transpose(rows)
+    for r in rows:
+        assert len(r) == len(rows[0]), "len(%r) != %i" % (r, len(rows[0]))
+    return [list(c) for c in zip(*rows)]
+
+
+def lfsr_serial_shift(poly, state, data):
+    """Shift `data` (MSB first) through a Galois LFSR.
+
+    `poly` and `state` are BitVectors of the CRC width with bit i holding
+    the coefficient of x^i, the x^0 term is always fed back.
+
+    >>> lfsr_serial_shift(BitVector(0b00101, 5), BitVector(0, 5), BitVector(0b0001, 4))
+    BitVector(0b00101, 5)
+    """
+    width = len(poly)
+    assert width > 1
+    assert len(state) == width
+    mask = (1 << width) - 1
+    feedback = poly.value | 1
+    top = width - 1
+    s = state.value
+    d = data.value
+    for j in range(len(data) - 1, -1, -1):
+        if ((s >> top) ^ (d >> j)) & 1:
+            s = ((s << 1) & mask) ^ feedback
+        else:
+            s = (s << 1) & mask
+    return BitVector(s, width)
 
 
 def lfsr_serial_shift_crc(lfsr_poly, lfsr_cur, data):
@@ -163,24 +191,10 @@ def lfsr_serial_shift_crc(lfsr_poly, lfsr_cur, data):
     Nin[3] = [0, 1, 1, 0, 1]
 
     """
-    lfsr_poly = lfsr_poly[::-1]
-    data = data[::-1]
-
-    shift_by = len(data)
-    lfsr_poly_size = len(lfsr_poly)
-    assert lfsr_poly_size > 1
-    assert len(lfsr_cur) == lfsr_poly_size
-
-    lfsr_next = list(lfsr_cur)
-    for j in range(shift_by):
-        lfsr_upper_bit = lfsr_next[lfsr_poly_size-1]
-        for i in range(lfsr_poly_size-1, 0, -1):
-            if lfsr_poly[i]:
-                lfsr_next[i] = lfsr_next[i-1] ^ lfsr_upper_bit ^ data[j]
-            else:
-                lfsr_next[i] = lfsr_next[i-1]
-        lfsr_next[0] = lfsr_upper_bit ^ data[j]
-    return list(lfsr_next[::-1])
+    return lfsr_serial_shift(
+        BitVector.from_rbits(lfsr_poly),
+        BitVector.from_bits(lfsr_cur),
+        BitVector.from_bits(data)).reversed().bits()
 
 
 def print_matrix(crc_width, cols_nin, cols_min):
@@ -232,55 +246,146 @@ def build_matrix(lfsr_poly, data_width):
     Mout[0] = [1, 0, 0, 1] [0, 1, 0, 0, 1]
     """
     lfsr_poly_size = len(lfsr_poly)
+    cols_nin, cols_min = parallel_crc_matrix(BitVector.from_rbits(lfsr_poly), data_width)
 
-    # data_width*lfsr_polysize matrix == lfsr(0,Nin)
-    rows_nin = []
-
-    # (a) calculate the N values when Min=0 and Build NxM matrix
-    #  - Each value is one hot encoded (there is only one bit)
-    #  - IE N=4, 0x1, 0x2, 0x4, 0x8
-    #  - Mout = F(Nin,Min=0)
-    #  - Each row contains the results of (a)
-    #  - IE row[0] == 0x1, row[1] == 0x2
-    #  - Output is M-bit wide (CRC width)
-    #  - Each column of the matrix represents an output bit Mout[i] as a function of Nin
     info = []
-    for i in range(data_width):
-        # lfsr_cur = [0,...,0] = Min
-        lfsr_cur = [0,]*lfsr_poly_size
-        # data = [0,..,1,..,0] = Nin
-        data = [0,]*data_width
-        data[i] = 1
-        # Calculate the CRC
-        rows_nin.append(lfsr_serial_shift_crc(lfsr_poly, lfsr_cur, data))
-        info.append("lfsr(%r, %r, %r) = %r" % (lfsr_poly, lfsr_cur, data, rows_nin[-1]))
-    assert len(rows_nin) == data_width
-    cols_nin = cols(rows_nin)[::-1]
-
-    # lfsr_polysize*lfsr_polysize matrix == lfsr(Min,0)
+    zero_cur = [0,]*lfsr_poly_size
+    zero_data = [0,]*data_width
+    for i, row in enumerate(transpose(cols_nin[::-1])):
+        info.append("lfsr(%r, %r, %r) = %r" % (
+            lfsr_poly, zero_cur, BitVector.one_hot(i, data_width).bits(), row.bits()))
     info.append("")
-    rows_min = []
-    for i in range(lfsr_poly_size):
-        # lfsr_cur = [0,..,1,...,0] = Min
-        lfsr_cur = [0,]*lfsr_poly_size
-        lfsr_cur[i] = 1
-        # data = [0,..,0] = Nin
-        data = [0,]*data_width
-        # Calculate the crc
-        rows_min.append(lfsr_serial_shift_crc(lfsr_poly, lfsr_cur, data))
-        info.append("lfsr(%r, %r, %r) = %r" % (lfsr_poly, lfsr_cur, data, rows_min[-1]))
-    assert len(rows_min) == lfsr_poly_size
-    cols_min = cols(rows_min)[::-1]
-
-    # (c) Calculate CRC for the M values when Nin=0 and Build MxM matrix
-    #  - Each value is one hot encoded
-    #  - Mout = F(Nin=0,Min)
-    #  - Each row contains results from (7)
+    for i, row in enumerate(transpose(cols_min[::-1])):
+        info.append("lfsr(%r, %r, %r) = %r" % (
+            lfsr_poly, BitVector.one_hot(i, lfsr_poly_size).bits(), zero_data, row.bits()))
     info.append("")
-    for i in range(data_width, -1, -1):
-        info.append("Mout[%i] = %r %r" % (i, cols_nin[i], cols_min[i]))
+    for i in range(lfsr_poly_size-1, -1, -1):
+        info.append("Mout[%i] = %r %r" % (i, cols_nin[i].bits(), cols_min[i].bits()))
+
+    return info, [c.bits() for c in cols_nin], [c.bits() for c in cols_min]
 
-    return info, cols_nin, cols_min
+
+def parallel_crc_matrix(poly, data_width):
+    """Build the GF(2) matrices for a `data_width` bit parallel CRC.
+
+    `poly` is a BitVector of the CRC width, see `lfsr_serial_shift`.
+    Returns (cols_nin, cols_min), one BitVector per output bit Mout[i]
+    selecting the data (Nin) and current CRC (Min) bits it is the XOR of,
+    so Mout = gf2_matvec(cols_nin, Nin) ^ gf2_matvec(cols_min, Min).
+
+    >>> cols_nin, cols_min = parallel_crc_matrix(BitVector(0b00101, 5), 4)
+    >>> cols_nin[0], cols_min[0]
+    (BitVector(0b1001, 4), BitVector(0b10010, 5))
+    """
+    width = len(poly)
+    assert width > 1
+
+    # Shift the LFSR symbolically, every register bit is kept as the set of
+    # inputs it is the XOR of.  Bits [0, data_width) of a set are the data
+    # bits (Nin), bits [data_width, data_width+width) the current CRC (Min).
+    #  - Mout = F(Nin,Min) is linear, so the final register bits are the
+    #    columns of both matrices at once.
+    state = [1 << (data_width + k) for k in range(width)]
+    taps = [k for k in range(1, width) if (poly.value >> k) & 1]
+    for j in range(data_width - 1, -1, -1):
+        feedback = state[-1] ^ (1 << j)
+        state = [feedback] + state[:-1]
+        for k in taps:
+            state[k] ^= feedback
+
+    data_mask = (1 << data_width) - 1
+    cols_nin = [BitVector(s & data_mask, data_width) for s in state]
+    cols_min = [BitVector(s >> data_width, width) for s in state]
+    return cols_nin, cols_min
+
+
+# Directory to keep parallel CRC matrices in between runs, None disables the
+# on-disk cache.  Defaults to $VALENTYUSB_CRC_CACHE.
+CRC_MATRIX_CACHE_DIR = os.environ.get("VALENTYUSB_CRC_CACHE", None)
+CRC_MATRIX_CACHE_VERSION = 1
+
+
+def _crc_matrix_load(path, params):
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get("params") != params:
+        return None
+    try:
+        cols_nin = [BitVector(v, params["data_width"]) for v in cached["cols_nin"]]
+        cols_min = [BitVector(v, params["crc_width"]) for v in cached["cols_min"]]
+        reset = BitVector(cached["reset"], params["crc_width"])
+    except (KeyError, TypeError, AssertionError):
+        return None
+    if len(cols_nin) != params["crc_width"] or len(cols_min) != params["crc_width"]:
+        return None
+    return tuple(cols_nin), tuple(cols_min), reset
+
+
+def _crc_matrix_store(path, params, matrix):
+    cols_nin, cols_min, reset = matrix
+    cached = {
+        "params": params,
+        "cols_nin": [c.value for c in cols_nin],
+        "cols_min": [c.value for c in cols_min],
+        "reset": reset.value,
+    }
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(cached, f)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+@functools.lru_cache(maxsize=None)
+def crc_matrix(crc_width, polynomial, data_width, initial=0, cache_dir=None):
+    """Parallel CRC matrices for TxParallelCrcGenerator, memoized.
+
+    Returns (cols_nin, cols_min, reset) where reset is the value of the
+    next CRC while the data input is zero and the register holds `initial`.
+
+    Results are kept for the life of the process, and in `cache_dir`
+    (default CRC_MATRIX_CACHE_DIR) if set.  Cached files store the
+    parameters they were built from and are ignored if they don't match.
+
+    >>> cols_nin, cols_min, reset = crc_matrix(5, 0b00101, 4, 0b11111)
+    >>> cols_nin[0], cols_min[0], reset
+    (BitVector(0b1001, 4), BitVector(0b10010, 5), BitVector(0b00110, 5))
+    >>> crc_matrix(5, 0b00101, 4, 0b11111) is crc_matrix(5, 0b00101, 4, 0b11111)
+    True
+    """
+    if cache_dir is None:
+        cache_dir = CRC_MATRIX_CACHE_DIR
+
+    params = {
+        "version": CRC_MATRIX_CACHE_VERSION,
+        "crc_width": crc_width,
+        "polynomial": polynomial,
+        "data_width": data_width,
+        "initial": initial,
+    }
+    path = None
+    if cache_dir:
+        path = os.path.join(cache_dir, "crc%i_%x_d%i_i%x.json" % (
+            crc_width, polynomial, data_width, initial))
+        matrix = _crc_matrix_load(path, params)
+        if matrix is not None:
+            return matrix
+
+    poly = BitVector(polynomial & ((1 << crc_width) - 1), crc_width)
+    cols_nin, cols_min = parallel_crc_matrix(poly, data_width)
+    # Data is all zeros at reset, so only the current CRC bits matter.
+    reset = gf2_matvec(cols_min, BitVector(initial, crc_width))
+    matrix = (tuple(cols_nin), tuple(cols_min), reset)
+
+    if path is not None:
+        _crc_matrix_store(path, params, matrix)
+    return matrix
 
 
 @ResetInserter()
@@ -328,10 +433,6 @@ class TxParallelCrcGenerator(Module):
         crc_cur = Signal(crc_width, reset=initial)
         crc_next = Signal(crc_width, reset_less=True)
 
-        crc_cur_reset_bits = [
-            int(i) for i in "{0:0{width}b}".format(
-                crc_cur.reset.value,width=crc_width)[::-1]]
-
         self.comb += [
             crc_dat.eq(self.i_data_payload[::-1]),
             # FIXME: Is XOR ^ initial actually correct here?
@@ -344,34 +445,23 @@ class TxParallelCrcGenerator(Module):
             ),
         ]
 
-        poly_list = []
-        for i in range(crc_width):
-            poly_list.insert(0, polynomial >> i & 0x1)
-        assert len(poly_list) == crc_width
-
-        _, cols_nin, cols_min = build_matrix(poly_list, data_width)
+        cols_nin, cols_min, crc_next_reset = crc_matrix(
+            crc_width, polynomial, data_width, initial)
 
-        crc_next_reset_bits = list(crc_cur_reset_bits)
         for i in range(crc_width):
             to_xor = []
-            crc_next_reset_bit_i = []
             for j, use in enumerate(cols_nin[i]):
                 if use:
                     to_xor.append(crc_dat[j])
-                    crc_next_reset_bit_i.append(0)
             for j, use in enumerate(cols_min[i]):
                 if use:
                     to_xor.append(crc_cur[j])
-                    crc_next_reset_bit_i.append(crc_cur_reset_bits[j])
-
-            crc_next_reset_bits[i] = functools.reduce(operator.xor, crc_next_reset_bit_i)
 
             self.comb += [
                 crc_next[i].eq(functools.reduce(operator.xor, to_xor)),
             ]
 
-        crc_next_reset_value = int("0b"+"".join(str(i) for i in crc_next_reset_bits[::-1]), 2)
-        crc_next.reset.value = crc_next_reset_value
+        crc_next.reset.value = int(crc_next_reset)
 
 
 class TxCrcPipeline(Module):
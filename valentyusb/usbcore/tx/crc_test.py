@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 
 import functools
+import json
 import operator
+import os
+import tempfile
 import unittest
 
 from migen import *
@@ -16,6 +19,7 @@ from .shifter import TxShifter
 from .tester import module_tester
 
 from .crc import TxSerialCrcGenerator, TxParallelCrcGenerator, TxCrcPipeline, bytes_to_int
+from .crc import crc_matrix
 
 
 @module_tester(
@@ -93,6 +97,38 @@ class TestTxSerialCrcGenerator(BaseUsbTestCase):
         )
 
 
+class TestCrcMatrixCache(unittest.TestCase):
+    def test_disk_cache(self):
+        with tempfile.TemporaryDirectory() as d:
+            expected = crc_matrix(16, 0x8005, 8, 0xffff)
+            crc_matrix.cache_clear()
+            self.assertEqual(expected, crc_matrix(16, 0x8005, 8, 0xffff, cache_dir=d))
+            files = os.listdir(d)
+            self.assertEqual(len(files), 1)
+
+            # Loaded from disk
+            crc_matrix.cache_clear()
+            self.assertEqual(expected, crc_matrix(16, 0x8005, 8, 0xffff, cache_dir=d))
+
+            # Entries for other parameters are ignored
+            path = os.path.join(d, files[0])
+            with open(path) as f:
+                cached = json.load(f)
+            cached["params"]["initial"] = 0
+            cached["reset"] = 0
+            with open(path, "w") as f:
+                json.dump(cached, f)
+            crc_matrix.cache_clear()
+            self.assertEqual(expected, crc_matrix(16, 0x8005, 8, 0xffff, cache_dir=d))
+
+            # Corrupt entries are rebuilt
+            with open(path, "w") as f:
+                f.write("{")
+            crc_matrix.cache_clear()
+            self.assertEqual(expected, crc_matrix(16, 0x8005, 8, 0xffff, cache_dir=d))
+            crc_matrix.cache_clear()
+
+
 class TestTxParallelCrcGenerator(BaseUsbTestCase):
     def sim(self, name, dut, in_data, expected_crc):
         def stim():
@@ -107,7 +143,7 @@ class TestTxParallelCrcGenerator(BaseUsbTestCase):
             print("{0} {1:04x} {1:016b} {2:04x} {2:016b}".format(name, expected_crc, o_crc))
             self.assertEqual(hex(expected_crc), hex(o_crc))
 
-        run_simulation(dut, stim(), vcd_name=self.make_vcd_name())
+        self.run_simulation(dut, stim(), vcd_name=self.make_vcd_name())
 
     def sim_crc16(self, in_data):
         expected_crc = bytes_to_int(crc16(in_data))
@@ -190,7 +226,7 @@ class TestCrcPipeline(BaseUsbTestCase):
                 yield
             self.assertLess(i, MAX)
 
-        run_simulation(dut, stim(), vcd_name=self.make_vcd_name())
+        self.run_simulation(dut, stim(), vcd_name=self.make_vcd_name())
 
     def test_00000001_byte(self):
         self.sim([0b00000001])
@@ -84,7 +84,7 @@ class TestTxPipeline(BaseUsbTestCase):
         with self.subTest(name=name):
             fname = name.replace(" ","_")
             dut = TxPipeline()
-            run_simulation(dut, stim(**vector),
+            self.run_simulation(dut, stim(**vector),
                 vcd_name=self.make_vcd_name(testsuffix=fname),
                 clocks={"sys": 10, "usb_48": 40, "usb_12": 160})
 
@@ -67,7 +67,7 @@ class TestTxShifter(BaseUsbTestCase):
             fname = name.replace(' ', '_')
             dut = TxShifter(vector["width"])
 
-            run_simulation(dut, stim(**vector),
+            self.run_simulation(dut, stim(**vector),
                 vcd_name=self.make_vcd_name(testsuffix=fname))
 
     def test_basic_shift_out_1(self):
@@ -133,7 +133,7 @@ def create_tester(dut_type, **def_args):
 
 
         # run simulation
-        run_simulation(dut, stim(), vcd_name=self.vcd_name)
+        self.run_simulation(dut, stim(), vcd_name=self.vcd_name)
 
         return actual_output
 
@@ -5,11 +5,387 @@ import subprocess
 from .sdiff import Differ, getTerminalSize, original_diff
 import sys
 
+
+# Labels written by utils.pprint.pp_packet, mapped to the field they belong to.
+_PACKET_LABELS = {
+    "Sync": "Sync",
+    "PID": "PID",
+    "Address": "Address",
+    "Endpoint": "Endpoint",
+    "Frame #": "Frame #",
+    "CRC5": "CRC5",
+    "CRC16": "CRC16",
+    "SE0": "EOP",
+    "END": "EOP",
+}
+
+
+def _is_separator(line):
+    line = line.rstrip('\n')
+    return bool(line) and line.strip('-') == ''
+
+
+def _line_field(line):
+    """Return the field a pp_packet line belongs to.
+
+    None is returned for separators and bit stuffing, which belong to
+    whatever field they are in the middle of.
+
+    >>> _line_field('KKKK 1 PID (PID.ACK)\\n'), _line_field('JJJJ 10 CRC16')
+    ('PID', 'CRC16')
+    >>> _line_field('JJJJ\\n'), _line_field('----\\n'), _line_field('KKKK    Bitstuff')
+    ('Data', None, None)
+    """
+    if _is_separator(line):
+        return None
+    line = line.rstrip('\n')
+    parts = line.split(None, 1)
+    if len(parts) == 1:
+        return "Data"
+    label = parts[1]
+    if label.startswith("Bitstuff"):
+        return None
+    number, _, rest = label.partition(' ')
+    if number.isdigit():
+        label = rest
+    if label.startswith("PID"):
+        label = "PID"
+    return _PACKET_LABELS.get(label, label)
+
+
+def packet_fields(lines):
+    """Group pp_packet output lines into (key, lines) fields.
+
+    Every byte of a DATA payload is its own field, the key is the field name
+    and how many fields of that name came before it.
+
+    >>> from .pprint import pp_packet
+    >>> from .packet import wrap_packet, data_packet
+    >>> from ..pid import PID
+    >>> text = pp_packet(wrap_packet(data_packet(PID.DATA1, [1, 2])))
+    >>> [(k, len(l)) for k, l in packet_fields(text.splitlines(True))]
+    [(('Sync', 0), 10), (('PID', 0), 9), (('Data', 0), 8), (('Data', 1), 9), (('CRC16', 0), 20), (('EOP', 0), 3)]
+    """
+    fields = []
+    counts = {}
+    current = None
+    pending = []
+    for line in lines:
+        name = _line_field(line)
+        if name is None:
+            pending.append(line)
+            # Separators mark byte boundaries inside the payload, everywhere
+            # else they (and bit stuffing) stay with the current field.
+            if current is not None and (current[0][0] != "Data" or not _is_separator(line)):
+                current[1].extend(pending)
+                pending = []
+            continue
+        if current is None or name != current[0][0] or (name == "Data" and pending):
+            n = counts.get(name, 0)
+            counts[name] = n + 1
+            current = ((name, n), [])
+            fields.append(current)
+        current[1].extend(pending)
+        current[1].append(line)
+        pending = []
+    if pending:
+        if current is None:
+            current = (("", 0), [])
+            fields.append(current)
+        current[1].extend(pending)
+    return fields
+
+
+def _is_packet_text(lines):
+    return any(_line_field(l) == "Sync" for l in lines[:16])
+
+
+def _field_bits(field):
+    """Lines of a field that carry bits, ignoring separators."""
+    return [l.rstrip('\n') for l in field[1] if not _is_separator(l)]
+
+
+def _decode_fields(fields, last='K'):
+    """NRZI decode every field, ignoring stuffed bits.
+
+    Line states depend on everything sent before, so fields are compared by
+    their decoded bits when aligning.
+    """
+    decoded = []
+    for field in fields:
+        bits = []
+        for l in field[1]:
+            if _is_separator(l):
+                continue
+            chunk = l.split(None, 1)[0]
+            if "Bitstuff" not in l:
+                bits.append('1' if chunk == last else '0')
+            last = chunk
+        decoded.append("".join(bits))
+    return decoded
+
+
+def _align_band(a, b, band):
+    """Edit distance alignment of two short sequences within a diagonal band.
+
+    Returns a list of (i, j) index pairs with None for a gap.  Cost is
+    O(len(a) * band), if the lengths differ by more than `band` the
+    sequences are paired up by position instead.
+
+    >>> _align_band('abcd', 'acd', 2)
+    [(0, 0), (1, None), (2, 1), (3, 2)]
+    """
+    n, m = len(a), len(b)
+    if abs(n - m) > band:
+        return [(i if i < n else None, i if i < m else None)
+                for i in range(max(n, m))]
+
+    inf = n + m + 1
+    cost = {(0, 0): 0}
+    move = {}
+    for i in range(n + 1):
+        for j in range(max(0, i - band), min(m, i + band) + 1):
+            if i == 0 and j == 0:
+                continue
+            best = inf
+            if i and j and (i - 1, j - 1) in cost:
+                best = cost[(i - 1, j - 1)] + (a[i - 1] != b[j - 1])
+                move[(i, j)] = (1, 1)
+            if i and cost.get((i - 1, j), inf) + 1 < best:
+                best = cost[(i - 1, j)] + 1
+                move[(i, j)] = (1, 0)
+            if j and cost.get((i, j - 1), inf) + 1 < best:
+                best = cost[(i, j - 1)] + 1
+                move[(i, j)] = (0, 1)
+            cost[(i, j)] = best
+
+    pairs = []
+    i, j = n, m
+    while i or j:
+        di, dj = move[(i, j)]
+        i -= di
+        j -= dj
+        pairs.append((i if di else None, j if dj else None))
+    pairs.reverse()
+    return pairs
+
+
+def _last_state(field):
+    for l in reversed(field[1]):
+        if l.strip() and not _is_separator(l):
+            return l.split(None, 1)[0]
+    return 'K'
+
+
+def align_fields(fields1, fields2, band=8):
+    """Pair up two lists of fields.
+
+    Fields are paired by key, except DATA payload bytes which are aligned by
+    content so a dropped or extra byte shows up as one unpaired field
+    instead of shifting the rest of the payload.  Content alignment only
+    looks `band` bytes either side, keeping the cost linear in the number of
+    fields.
+
+    >>> a = [(('PID', 0), 'a'), (('Data', 0), 'b'), (('CRC16', 0), 'c')]
+    >>> b = [(('PID', 0), 'a'), (('CRC16', 0), 'c')]
+    >>> [(x and x[0][0], y and y[0][0]) for x, y in align_fields(a, b)]
+    [('PID', 'PID'), ('Data', None), ('CRC16', 'CRC16')]
+    """
+    def group(fields):
+        # Replace the run of payload bytes by a single ('Data', 0) entry.
+        out = []
+        for f in fields:
+            if f[0][0] == "Data":
+                if not out or out[-1][0] != ("Data", 0):
+                    out.append((("Data", 0), []))
+                out[-1][1].append(f)
+            else:
+                out.append(f)
+        return out
+
+    def expand(f1, f2):
+        if f1 is not None and f2 is not None and f1[0] == ("Data", 0):
+            b1 = _decode_fields(f1[1], last1)
+            b2 = _decode_fields(f2[1], last2)
+            for i, j in _align_band(b1, b2, band):
+                pairs.append((
+                    f1[1][i] if i is not None else None,
+                    f2[1][j] if j is not None else None))
+            return
+        for f, side in ((f1, 0), (f2, 1)):
+            if f is None:
+                continue
+            for g in (f[1] if f[0] == ("Data", 0) else [f]):
+                pairs.append((g, None) if side == 0 else (None, g))
+
+    fields1 = group(fields1)
+    fields2 = group(fields2)
+    pos1 = {k: i for i, (k, _) in enumerate(fields1)}
+    pos2 = {k: i for i, (k, _) in enumerate(fields2)}
+    i = j = 0
+    pairs = []
+    while i < len(fields1) or j < len(fields2):
+        k1 = fields1[i][0] if i < len(fields1) else None
+        k2 = fields2[j][0] if j < len(fields2) else None
+        if k1 is not None and k1 == k2:
+            if k1 == ("Data", 0):
+                last1 = _last_state(fields1[i - 1]) if i else 'K'
+                last2 = _last_state(fields2[j - 1]) if j else 'K'
+                expand(fields1[i], fields2[j])
+            else:
+                pairs.append((fields1[i], fields2[j]))
+            i += 1
+            j += 1
+        elif k1 is not None and pos2.get(k1, -1) < j:
+            expand(fields1[i], None)
+            i += 1
+        elif k2 is not None and pos1.get(k2, -1) < i:
+            expand(None, fields2[j])
+            j += 1
+        else:
+            # Both appear further along on the other side, compare them as is.
+            expand(fields1[i], None)
+            expand(None, fields2[j])
+            i += 1
+            j += 1
+    return pairs
+
+
+def _align_lines(lines1, lines2):
+    """Pair up the lines of two matching fields.
+
+    Separators and bit stuffing are only paired with each other, so an
+    extra stuffed bit doesn't shift the rest of the field.
+    """
+    def extra(line):
+        return _is_separator(line) or "Bitstuff" in line
+
+    i = j = 0
+    while i < len(lines1) or j < len(lines2):
+        l1 = lines1[i] if i < len(lines1) else None
+        l2 = lines2[j] if j < len(lines2) else None
+        if l1 is not None and l2 is not None and extra(l1) == extra(l2):
+            yield l1, l2
+            i += 1
+            j += 1
+        elif l1 is not None and (l2 is None or extra(l1)):
+            yield l1, None
+            i += 1
+        else:
+            yield None, l2
+            j += 1
+
+
+def packet_diff(expected, actual, context=1, max_lines=200):
+    """Side by side diff of two pp_packet outputs aligned by packet field.
+
+    Identical fields more than `context` fields away from a difference are
+    collapsed into one line, and at most `max_lines` lines are rendered, so
+    both the cost and the size of the output stay bounded.
+
+    >>> from .pprint import pp_packet
+    >>> from .packet import wrap_packet, data_packet
+    >>> from ..pid import PID
+    >>> e = pp_packet(wrap_packet(data_packet(PID.DATA0, [1, 2, 3])))
+    >>> a = pp_packet(wrap_packet(data_packet(PID.DATA0, [1, 3])))
+    >>> print("\\n".join(packet_diff(e, a, context=0)))  # doctest: +ELLIPSIS
+      expected                 actual
+      --------                 --------
+      ... 3 identical fields (Sync, PID, Data 0) ...
+    < ----
+    < KKKK
+    ...
+    < KKKK
+      ----                     ----
+    | KKKK                   | JJJJ
+    ...
+      ... 1 identical fields (EOP) ...
+
+    >>> d = [0]*1023
+    >>> e = pp_packet(wrap_packet(data_packet(PID.DATA0, d)))
+    >>> d[100] = d[900] = 3  # two flipped bits, so the NRZI phase is back after them
+    >>> a = pp_packet(wrap_packet(data_packet(PID.DATA0, d)))
+    >>> [l.strip() for l in packet_diff(e, a, context=0, max_lines=1000) if "identical" in l]
+    ['... 102 identical fields (Sync..Data 99) ...', \
+'... 799 identical fields (Data 101..Data 899) ...', \
+'... 122 identical fields (Data 901..Data 1022) ...', \
+'... 1 identical fields (EOP) ...']
+    """
+    lines1 = expected.splitlines()
+    lines2 = actual.splitlines()
+    pairs = align_fields(packet_fields(lines1), packet_fields(lines2))
+
+    width = max([len(l) for l in lines1 + lines2] + [8]) + 1
+
+    def row(mark, left, right):
+        if left is None:
+            left = ""
+        if right is None:
+            return ("%s %s" % (mark, left)).rstrip()
+        return "%s %-*s%s %s" % (mark, width, left, mark if mark != ' ' else ' ', right)
+
+    def name(key):
+        if key[0] == "Data":
+            return "Data %i" % key[1]
+        return key[0]
+
+    different = [
+        f1 is None or f2 is None or _field_bits(f1) != _field_bits(f2)
+        for f1, f2 in pairs]
+    show = [False] * len(pairs)
+    for i, d in enumerate(different):
+        if d:
+            for j in range(max(0, i - context), min(len(pairs), i + context + 1)):
+                show[j] = True
+
+    out = [row(' ', "expected", "actual"), row(' ', "--------", "--------")]
+    skipped = []
+
+    def flush_skipped():
+        # Long runs are named by their ends, so the line stays short.
+        if len(skipped) > 3:
+            out.append("  ... %i identical fields (%s..%s) ..." % (
+                len(skipped), skipped[0], skipped[-1]))
+        elif skipped:
+            out.append("  ... %i identical fields (%s) ..." % (
+                len(skipped), ", ".join(skipped)))
+        del skipped[:]
+
+    for i, (f1, f2) in enumerate(pairs):
+        if len(out) >= max_lines:
+            out.append("  ... diff truncated, %i more differing fields ..." % (
+                sum(different[i:]),))
+            break
+        if not show[i]:
+            skipped.append(name(f1[0]))
+            continue
+        flush_skipped()
+        if f1 is None:
+            for l in f2[1]:
+                out.append(row('>', "", l))
+        elif f2 is None:
+            for l in f1[1]:
+                out.append(row('<', l, None))
+        else:
+            for l1, l2 in _align_lines(f1[1], f2[1]):
+                if l1 is None:
+                    out.append(row('>', "", l2))
+                elif l2 is None:
+                    out.append(row('<', l1, None))
+                else:
+                    out.append(row(' ' if l1 == l2 else '|', l1, l2))
+    flush_skipped()
+    return out
+
+
 def assertMultiLineEqualSideBySide(expected, actual, msg):
     # print("data1: {}".format(data1.splitlines(1)))
     if expected == actual:
         return
 
+    if _is_packet_text(expected.splitlines()) and _is_packet_text(actual.splitlines()):
+        assert False, "\n".join([msg or ""] + packet_diff(expected, actual))
+
     withcolor = True
     if not sys.stdout.isatty():
         withcolor = False
@@ -42,3 +418,8 @@ def assertMultiLineEqualSideBySide(expected, actual, msg):
         msg = msg + '\n' + line
 
     assert False, msg
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
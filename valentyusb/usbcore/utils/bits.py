@@ -1,6 +1,160 @@
 #!/usr/bin/env python3
 
 
+class BitVector:
+    """Fixed width vector of bits packed into an int.
+
+    Bit 0 of `value` is element 0, so indexing and iteration are LSB first
+    like `int_to_bits`.  Slices return new BitVectors.
+
+    >>> v = BitVector(0b1101, 4)
+    >>> list(v), len(v), v[0], v[1]
+    ([1, 0, 1, 1], 4, 1, 0)
+    >>> v[1:3], v[::-1]
+    (BitVector(0b10, 2), BitVector(0b1011, 4))
+    >>> v ^ BitVector(0b0110, 4), v.popcount(), int(v.reversed())
+    (BitVector(0b1011, 4), 3, 11)
+    >>> v.bits(), v.rbits()
+    ([1, 0, 1, 1], [1, 1, 0, 1])
+    >>> BitVector.from_bits([0, 0, 1]) == BitVector.from_rbits([1, 0, 0])
+    True
+    """
+    __slots__ = ("value", "width")
+
+    def __init__(self, value=0, width=None):
+        if width is None:
+            width = max(value.bit_length(), 1)
+        assert value >= 0 and value >> width == 0, (value, width)
+        self.value = value
+        self.width = width
+
+    @classmethod
+    def from_bits(cls, bits):
+        """Create from a sequence of bits, LSB first."""
+        v = 0
+        for i, b in enumerate(bits):
+            if b:
+                v |= 1 << i
+        return cls(v, len(bits))
+
+    @classmethod
+    def from_rbits(cls, rbits):
+        """Create from a sequence of bits, MSB first."""
+        return cls.from_bits(rbits[::-1])
+
+    @classmethod
+    def one_hot(cls, i, width):
+        return cls(1 << i, width)
+
+    def __len__(self):
+        return self.width
+
+    def __int__(self):
+        return self.value
+
+    __index__ = __int__
+
+    def __iter__(self):
+        v = self.value
+        for i in range(self.width):
+            yield (v >> i) & 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self.width)
+            if step == 1:
+                width = max(stop - start, 0)
+                return BitVector((self.value >> start) & ((1 << width) - 1), width)
+            return BitVector.from_bits([(self.value >> j) & 1 for j in range(start, stop, step)])
+        if i < 0:
+            i += self.width
+        if not 0 <= i < self.width:
+            raise IndexError(i)
+        return (self.value >> i) & 1
+
+    def __eq__(self, other):
+        if isinstance(other, BitVector):
+            return (self.value, self.width) == (other.value, other.width)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash((self.value, self.width))
+
+    def __repr__(self):
+        return "BitVector(0b{0:0{w}b}, {w})".format(self.value, w=self.width)
+
+    def _check(self, other):
+        assert self.width == other.width, (self, other)
+
+    def __xor__(self, other):
+        self._check(other)
+        return BitVector(self.value ^ other.value, self.width)
+
+    def __and__(self, other):
+        self._check(other)
+        return BitVector(self.value & other.value, self.width)
+
+    def __or__(self, other):
+        self._check(other)
+        return BitVector(self.value | other.value, self.width)
+
+    def __invert__(self):
+        return BitVector(~self.value & ((1 << self.width) - 1), self.width)
+
+    def popcount(self):
+        return bin(self.value).count("1")
+
+    def parity(self):
+        return self.popcount() & 1
+
+    def reversed(self):
+        """Reverse the bit order, LSB becomes MSB."""
+        if not self.width:
+            return self
+        return BitVector(int("{0:0{w}b}".format(self.value, w=self.width)[::-1], 2), self.width)
+
+    def bits(self):
+        """List of bits, LSB first (see `int_to_bits`)."""
+        return [int(c) for c in "{0:0{w}b}".format(self.value, w=self.width)[::-1]] if self.width else []
+
+    def rbits(self):
+        """List of bits, MSB first (see `int_to_rbits`)."""
+        return [int(c) for c in "{0:0{w}b}".format(self.value, w=self.width)] if self.width else []
+
+
+def transpose(rows):
+    """Transpose a matrix stored as a list of BitVector rows.
+
+    >>> transpose([BitVector(0b01, 2), BitVector(0b11, 2), BitVector(0b10, 2)])
+    [BitVector(0b011, 3), BitVector(0b110, 3)]
+    """
+    width = len(rows[0])
+    columns = []
+    for ci in range(width):
+        v = 0
+        for ri, r in enumerate(rows):
+            assert len(r) == width, "len(%r) != %i" % (r, width)
+            v |= ((r.value >> ci) & 1) << ri
+        columns.append(BitVector(v, len(rows)))
+    return columns
+
+
+def gf2_matvec(rows, vector):
+    """Multiply a matrix of BitVector rows by a BitVector over GF(2).
+
+    Bit i of the result is the parity of `rows[i] & vector`.
+
+    >>> gf2_matvec([BitVector(0b011, 3), BitVector(0b110, 3)], BitVector(0b010, 3))
+    BitVector(0b11, 2)
+    """
+    v = vector.value
+    result = 0
+    for i, r in enumerate(rows):
+        assert len(r) == len(vector), (r, vector)
+        result |= (bin(r.value & v).count("1") & 1) << i
+    return BitVector(result, len(rows))
+
+
 def int_to_bits(i, width=None):
     """Convert an int to list of bits (LSB first).
 
@@ -24,9 +178,7 @@ def int_to_bits(i, width=None):
     >>> int_to_bits(0b100, 8)
     [0, 0, 1, 0, 0, 0, 0, 0]
     """
-    if width is None:
-        width=''
-    return [int(i) for i in "{0:0{w}b}".format(i,w=width)[::-1]]
+    return BitVector(i, max(width or 0, i.bit_length(), 1)).bits()
 
 
 def bits_to_int(bits):
@@ -56,10 +208,7 @@ def bits_to_int(bits):
     >>> bin(bits_to_int([0, 0, 0, 0, 0, 1, 0, 1]))
     '0b10100000'
     """
-    v = 0
-    for i in range(0, len(bits)):
-        v |= bits[i] << i
-    return v
+    return int(BitVector.from_bits(bits))
 
 
 def int_to_rbits(i, width=None):
@@ -85,9 +234,7 @@ def int_to_rbits(i, width=None):
     >>> int_to_rbits(0b100, 8)
     [0, 0, 0, 0, 0, 1, 0, 0]
     """
-    if width is None:
-        width=''
-    return [int(i) for i in "{0:0{w}b}".format(i,w=width)]
+    return BitVector(i, max(width or 0, i.bit_length(), 1)).rbits()
 
 
 def rbits_to_int(rbits):
@@ -113,10 +260,7 @@ def rbits_to_int(rbits):
     >>> bin(rbits_to_int([1, 0, 1, 0, 0, 0, 0, 0]))
     '0b10100000'
     """
-    v = 0
-    for i in range(0, len(rbits)):
-        v |= rbits[i] << len(rbits)-i-1
-    return v
+    return int(BitVector.from_rbits(rbits))
 
 
 def get_bit(epaddr, v):
@@ -150,3 +294,8 @@ def set_bit(current, epaddr, v):
         return current | 1 << epaddr
     else:
         return current & ~(1 << epaddr)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
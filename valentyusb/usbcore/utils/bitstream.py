@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+# Line states are stored one byte per bit time using the same characters as
+# the string representation in utils/packet.py.
+J = ord('J')
+K = ord('K')
+SE0 = ord('_')
+
+SYNC_STATES = b"KJKJKJKK"
+EOP_STATES = b"__J"
+
+_LEVEL_TO_STATE = bytes.maketrans(b"01", b"KJ")
+_STATE_TO_P = bytes.maketrans(b"JK_", b"100")
+_STATE_TO_N = bytes.maketrans(b"JK_", b"010")
+
+_repeat_tables = {}
+
+
+def _oversample(states, cycles):
+    """Repeat every byte in `states` `cycles` times."""
+    if cycles == 1:
+        return bytes(states)
+    table = _repeat_tables.get(cycles, None)
+    if table is None:
+        table = [bytes((i,)) * cycles for i in range(256)]
+        _repeat_tables[cycles] = table
+    return b"".join(map(table.__getitem__, states))
+
+
+class BitStream:
+    """Sequence of bits packed into an int.
+
+    Bit 0 of `value` is the first bit sent on the wire, so bytes are packed
+    LSB first exactly like `encode_data` does.
+
+    >>> bits = BitStream.from_bytes([0x80, 0x06])
+    >>> len(bits)
+    16
+    >>> str(bits)
+    '0000000101100000'
+    >>> bits == '0000000101100000'
+    True
+    >>> str(BitStream.from_str('101') + BitStream.from_int(0b10, 2))
+    '10101'
+    >>> bits[7], bits[8]
+    (1, 0)
+    """
+    __slots__ = ("value", "length")
+
+    def __init__(self, value=0, length=0):
+        assert value >> length == 0, (value, length)
+        self.value = value
+        self.length = length
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = bytes(data)
+        return cls(int.from_bytes(data, "little"), len(data) * 8)
+
+    @classmethod
+    def from_int(cls, value, width):
+        return cls(value & ((1 << width) - 1), width)
+
+    @classmethod
+    def from_str(cls, s):
+        """Create from a string of '0' and '1' in wire order."""
+        if not s:
+            return cls()
+        return cls(int(s[::-1], 2), len(s))
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError(i)
+        return (self.value >> i) & 1
+
+    def __eq__(self, other):
+        if isinstance(other, str):
+            return str(self) == other
+        if isinstance(other, BitStream):
+            return (self.value, self.length) == (other.value, other.length)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash((self.value, self.length))
+
+    def __add__(self, other):
+        if isinstance(other, str):
+            return str(self) + other
+        return BitStream(self.value | (other.value << self.length), self.length + other.length)
+
+    def __radd__(self, other):
+        if isinstance(other, str):
+            return other + str(self)
+        return NotImplemented
+
+    def __str__(self):
+        if not self.length:
+            return ""
+        return "{0:0{w}b}".format(self.value, w=self.length)[::-1]
+
+    def __repr__(self):
+        return "BitStream(%r)" % str(self)
+
+    def stuffed(self):
+        """Insert a 0 after every run of six 1s.
+
+        >>> str(BitStream.from_str('1111111111').stuffed())
+        '11111101111'
+        >>> str(BitStream.from_str('111111').stuffed())
+        '1111110'
+        >>> str(BitStream.from_str('0111110111111').stuffed())
+        '01111101111110'
+        """
+        value, length = self.value, self.length
+        pos = 0
+        while True:
+            v = value >> pos
+            run = v & (v >> 1) & (v >> 2) & (v >> 3) & (v >> 4) & (v >> 5)
+            if not run:
+                break
+            # End of the first run of six ones, the stuffed zero goes here.
+            cut = pos + (run & -run).bit_length() + 5
+            value = (value & ((1 << cut) - 1)) | ((value >> cut) << (cut + 1))
+            length += 1
+            pos = cut + 1
+        return BitStream(value, length)
+
+    def nrzi(self, init='J', cycles=1):
+        """NRZI encode (without bit stuffing) into a LineStream.
+
+        A 0 toggles the line state, a 1 keeps it.
+
+        >>> str(BitStream.from_str('1100000001').nrzi(cycles=1))
+        'JJKJKJKJKK'
+        >>> str(BitStream.from_str('01').nrzi('K', cycles=2))
+        'JJJJ'
+        """
+        assert init in "JK", init
+        length = self.length
+        mask = (1 << length) - 1
+        # Prefix XOR of the zeros gives the number of toggles (mod 2) so far.
+        toggles = ~self.value & mask
+        shift = 1
+        while shift < length:
+            toggles ^= toggles << shift
+            shift <<= 1
+        levels = toggles & mask
+        if init == 'J':
+            levels ^= mask
+        if not length:
+            return LineStream(b"", cycles)
+        states = "{0:0{w}b}".format(levels, w=length)[::-1].encode("ascii")
+        return LineStream(states.translate(_LEVEL_TO_STATE), cycles)
+
+
+class LineStream:
+    """Sequence of J/K/SE0 line states.
+
+    One byte is stored per bit time, oversampling to `cycles` samples per bit
+    is only done when the samples are iterated over or rendered as a string.
+
+    >>> line = LineStream(b"KJ_", cycles=2)
+    >>> len(line)
+    6
+    >>> str(line)
+    'KKJJ__'
+    >>> list(line)
+    ['K', 'K', 'J', 'J', '_', '_']
+    >>> line[-1], line[2:5]
+    ('_', 'JJ_')
+    >>> line.diff()
+    ('001100', '110000')
+    >>> 'J' + LineStream(b"K", cycles=1)
+    'JK'
+    """
+    __slots__ = ("states", "cycles")
+
+    def __init__(self, states=b"", cycles=1):
+        self.states = bytes(states)
+        self.cycles = cycles
+
+    def __len__(self):
+        return len(self.states) * self.cycles
+
+    def __iter__(self):
+        cycles = self.cycles
+        for s in self.states:
+            c = chr(s)
+            for i in range(cycles):
+                yield c
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return str(self)[i]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return chr(self.states[i // self.cycles])
+
+    def __eq__(self, other):
+        if isinstance(other, str):
+            return str(self) == other
+        if isinstance(other, LineStream):
+            if self.cycles == other.cycles:
+                return self.states == other.states
+            return str(self) == str(other)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __add__(self, other):
+        if isinstance(other, str):
+            return str(self) + other
+        if isinstance(other, LineStream) and other.cycles == self.cycles:
+            return LineStream(self.states + other.states, self.cycles)
+        return NotImplemented
+
+    def __radd__(self, other):
+        if isinstance(other, str):
+            return other + str(self)
+        return NotImplemented
+
+    def __str__(self):
+        return _oversample(self.states, self.cycles).decode("ascii")
+
+    def __repr__(self):
+        return "LineStream(%r, cycles=%i)" % (self.states.decode("ascii"), self.cycles)
+
+    def diff(self):
+        """Convert into usbp / usbn bit strings, see `utils.packet.diff`."""
+        usbp = _oversample(self.states.translate(_STATE_TO_P), self.cycles)
+        usbn = _oversample(self.states.translate(_STATE_TO_N), self.cycles)
+        return usbp.decode("ascii"), usbn.decode("ascii")
+
+
+def wrap_bits(bits, cycles=4):
+    """Add sync + eop to a packet, bit stuff and NRZI encode it.
+
+    Equivalent to `utils.packet.wrap_packet` but stays in packed form.
+
+    >>> wrap_bits(BitStream.from_str('01001011'), cycles=1)
+    LineStream('KJKJKJKKJJKJJKKK__J', cycles=1)
+    """
+    body = bits.stuffed().nrzi(init=chr(SYNC_STATES[-1]))
+    return LineStream(SYNC_STATES + body.states + EOP_STATES, cycles)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
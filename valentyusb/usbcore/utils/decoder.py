@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+from collections import namedtuple
+
+from ..pid import PID, PIDTypes
+from .crctable import CRC5_USB, CRC16_USB
+
+
+DecodedPacket = namedtuple("DecodedPacket", [
+    "pid",      # PID, or the raw PID byte if the check nibble is wrong
+    "addr",     # Token address, else None
+    "endp",     # Token endpoint, else None
+    "frame",    # SOF frame number, else None
+    "payload",  # DATA payload as bytes (without CRC16), else None
+    "crc_ok",   # CRC5 / CRC16 matched (True for handshakes)
+    "ok",       # PID check, bit stuffing, byte alignment and EOP were valid
+    "start",    # Sample index of the first SYNC sample
+    "end",      # Sample index of the J ending the EOP
+])
+
+
+_PAIR_STATES = {
+    (0, 0): '_',
+    (1, 0): 'J',
+    (0, 1): 'K',
+    (1, 1): 'E',
+}
+
+
+def _pair_to_state(pair):
+    p, n = pair
+    return _PAIR_STATES[(int(p), int(n))]
+
+
+class PacketDecoder:
+    """Streaming decoder for wire level USB full speed samples.
+
+    Samples are fed in chunks of any size, either as strings of J/K/_ line
+    states or as iterables of (usbp, usbn) pairs.  Only the packet
+    currently on the wire is buffered (up to `max_bytes`), so captures of
+    any length can be decoded in a single pass.
+
+    `cycles` is the number of samples per bit time and does not have to be
+    an integer; the sample point is re-aligned on every line transition.
+
+    >>> from .packet import wrap_packet, token_packet, data_packet
+    >>> d = PacketDecoder(cycles=4)
+    >>> wire = 'J'*8 + wrap_packet(token_packet(PID.SETUP, 0x12, 3))
+    >>> list(d.feed(wire[:50]))
+    []
+    >>> p, = d.feed(wire[50:] + 'JJJJ')
+    >>> p.pid, p.addr, p.endp, p.crc_ok, p.ok, p.start, p.end
+    (<PID.SETUP: 13>, 18, 3, True, True, 8, 144)
+    >>> p, = d.feed(wrap_packet(data_packet(PID.DATA1, [1, 2, 0xff]), cycles=4))
+    >>> p.pid, p.payload, p.crc_ok
+    (<PID.DATA1: 11>, b'\\x01\\x02\\xff', True)
+    """
+
+    IDLE = 0
+    SYNC = 1
+    DATA = 2
+    EOP = 3
+
+    def __init__(self, cycles=4, max_bytes=1027):
+        self.cycles = cycles
+        self.max_bytes = max_bytes
+        self.time = 0
+        self.last = 'J'
+        self._state = self.IDLE
+
+    def _start(self):
+        self._state = self.SYNC
+        self._start_time = self.time
+        self._next_sample = self.time + (self.cycles - 1) / 2
+        self._previous = 'J'
+        self._ones = 0
+        self._ok = True
+        self._data = bytearray()
+        self._byte = 0
+        self._nbits = 0
+
+    def _bit(self, bit):
+        if self._state == self.SYNC:
+            # SYNC is a run of 0s ended by a 1.
+            if bit:
+                self._state = self.DATA
+            return
+
+        if self._ones == 6:
+            # Stuffed bit, must be a 0.
+            self._ones = 0
+            if bit:
+                self._ok = False
+            return
+        self._ones = self._ones + 1 if bit else 0
+
+        self._byte |= bit << self._nbits
+        self._nbits += 1
+        if self._nbits == 8:
+            if len(self._data) < self.max_bytes:
+                self._data.append(self._byte)
+            else:
+                self._ok = False
+            self._byte = 0
+            self._nbits = 0
+
+    def _finish(self, eop_ok):
+        self._state = self.IDLE
+        ok = self._ok and eop_ok and self._nbits == 0
+        return decode_packet(bytes(self._data), self._start_time, self.time, ok)
+
+    def feed(self, samples):
+        """Feed a chunk of samples, yields any packets completed by it."""
+        if not isinstance(samples, str):
+            samples = map(_pair_to_state, samples)
+
+        for s in samples:
+            state = self._state
+            if state == self.IDLE:
+                if s == 'K' and self.last == 'J':
+                    self._start()
+                    state = self.SYNC
+
+            if state == self.SYNC or state == self.DATA:
+                if s == '_' or s == 'E':
+                    # SE0 during SYNC is a glitch, not a packet.
+                    if state == self.DATA:
+                        self._state = self.EOP
+                    else:
+                        self._state = self.IDLE
+                else:
+                    if s != self.last:
+                        self._next_sample = self.time + (self.cycles - 1) / 2
+                    if self.time >= self._next_sample:
+                        self._next_sample += self.cycles
+                        self._bit(int(s == self._previous))
+                        self._previous = s
+            elif state == self.EOP:
+                if s == 'J':
+                    yield self._finish(True)
+                elif s == 'K':
+                    yield self._finish(False)
+
+            self.last = s
+            self.time += 1
+
+    def decode(self, chunks):
+        for chunk in chunks:
+            yield from self.feed(chunk)
+
+
+def decode_packet(data, start=None, end=None, ok=True):
+    """Decode the bytes between SYNC and EOP into a DecodedPacket.
+
+    >>> decode_packet(bytes([0xa5, 0x95, 0x0d])).frame
+    1429
+    >>> decode_packet(bytes([0xd2])).pid
+    <PID.ACK: 2>
+    """
+    pid = addr = endp = frame = payload = None
+    crc_ok = False
+    if not data:
+        return DecodedPacket(None, None, None, None, None, False, False, start, end)
+
+    pid_byte = data[0]
+    if (pid_byte & 0xf) ^ (pid_byte >> 4) != 0xf:
+        pid = pid_byte
+        ok = False
+    else:
+        pid = PID(pid_byte & 0xf)
+        body = data[1:]
+        if PIDTypes.token(pid):
+            if len(body) == 2:
+                v = body[0] | (body[1] << 8)
+                crc_ok = CRC5_USB.calc_bits(v & 0x7ff, 11) == (v >> 11)
+                if pid == PID.SOF:
+                    frame = v & 0x7ff
+                else:
+                    addr = v & 0x7f
+                    endp = (v >> 7) & 0xf
+            else:
+                ok = False
+        elif PIDTypes.data(pid):
+            if len(body) >= 2:
+                payload = bytes(body[:-2])
+                crc = body[-2] | (body[-1] << 8)
+                crc_ok = CRC16_USB.calc_bytes(payload) == crc
+            else:
+                ok = False
+        elif PIDTypes.handshake(pid):
+            crc_ok = True
+            if body:
+                ok = False
+    return DecodedPacket(pid, addr, endp, frame, payload, crc_ok, ok, start, end)
+
+
+def decode_packets(chunks, cycles=4):
+    """Decode an iterable of sample chunks into a stream of packets.
+
+    >>> from .packet import wrap_packet, sof_packet, handshake_packet, diff
+    >>> wire = 'JJJJ'.join(wrap_packet(p, cycles=5) for p in (
+    ...     sof_packet(1429), handshake_packet(PID.NAK), sof_packet(1430)))
+    >>> for p in decode_packets(iter(wire[i:i+7] for i in range(0, len(wire), 7)), 5):
+    ...     print(p.pid.name, p.frame, p.crc_ok, p.ok)
+    SOF 1429 True True
+    NAK None True True
+    SOF 1430 True True
+    >>> usbp, usbn = diff(wrap_packet(handshake_packet(PID.ACK), cycles=4))
+    >>> [p.pid for p in decode_packets([zip(usbp, usbn)])]
+    [<PID.ACK: 2>]
+    """
+    return PacketDecoder(cycles).decode(chunks)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
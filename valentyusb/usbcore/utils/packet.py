@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 
+from functools import lru_cache
+
 from ..pid import PID
-from . import CrcMoose3 as crc
+from .bitstream import BitStream, LineStream, wrap_bits
+from .crctable import CRC5_USB, CRC16_USB, reflect
 
 
 def b(s):
@@ -20,13 +23,11 @@ def b(s):
 def encode_data(data):
     """
     Converts array of 8-bit ints into string of 0s and 1s.
-    """
-    output = ""
-
-    for b in data:
-        output += ("{0:08b}".format(b))[::-1]
 
-    return output
+    >>> encode_data([0x80, 0x06])
+    '0000000101100000'
+    """
+    return str(BitStream.from_bytes(data))
 
 
 def encode_pid(value):
@@ -44,10 +45,7 @@ def crc5(nibbles):
     >>> hex(crc5([3, 0]))
     '0x13'
     """
-    reg = crc.CrcRegister(crc.CRC5_USB)
-    for n in nibbles:
-        reg.takeWord(n, 4)
-    return reg.getFinalValue() & 0x1f
+    return CRC5_USB.calc_nibbles(nibbles)
 
 
 def crc5_token(addr, ep):
@@ -61,10 +59,7 @@ def crc5_token(addr, ep):
     >>> hex(crc5_token(56, 4))
     '0xb'
     """
-    reg = crc.CrcRegister(crc.CRC5_USB)
-    reg.takeWord(addr, 7)
-    reg.takeWord(ep, 4)
-    return reg.getFinalValue()
+    return CRC5_USB.calc_bits(addr | (ep << 7), 11)
 
 
 def crc5_sof(v):
@@ -74,22 +69,22 @@ def crc5_sof(v):
     >>> hex(crc5_sof(1013))
     '0x5'
     """
-    reg = crc.CrcRegister(crc.CRC5_USB)
-    reg.takeWord(v, 11)
-    return eval('0b' + bin(reg.getFinalValue() | 0x10000000)[::-1][:5])
+    return reflect(CRC5_USB.calc_bits(v, 11), 5)
 
 
 def crc16(input_data):
     # width=16 poly=0x8005 init=0xffff refin=true refout=true xorout=0xffff check=0xb4c8 residue=0xb001 name="CRC-16/USB"
     # CRC appended low byte first.
-    reg = crc.CrcRegister(crc.CRC16_USB)
-    for d in input_data:
-        assert d <= 0xff, input_data
-        reg.takeWord(d, 8)
-    crc16 = reg.getFinalValue()
+    assert all(d <= 0xff for d in input_data), input_data
+    crc16 = CRC16_USB.calc_bytes(input_data)
     return [crc16 & 0xff, (crc16 >> 8) & 0xff]
 
 
+def _is_bits(data):
+    """Only '0' and '1', no pre-encoded line states or spacing."""
+    return isinstance(data, str) and set(data) <= {'0', '1'}
+
+
 def nrzi(data, cycles=4, init="J"):
     """Converts string of 0s and 1s into NRZI encoded string.
 
@@ -112,6 +107,10 @@ def nrzi(data, cycles=4, init="J"):
     >>> nrzi("101", 4)
     'JJJJKKKKKKKK'
     """
+    if init in "JK" and _is_bits(data):
+        bits = BitStream.from_str(data)
+        return str(bits.stuffed().nrzi(init, cycles))
+
     def toggle_state(state):
         if state == 'J':
             return 'K'
@@ -120,38 +119,36 @@ def nrzi(data, cycles=4, init="J"):
         return state
 
     state = init
-    output = ""
+    output = []
 
-    stuffed = []
-    i = 0
+    ones = 0
     for bit in data:
-        stuffed.append(bit)
-        if bit == '1':
-            i += 1
-        else:
-            i = 0
-        if i > 5:
-            stuffed.append('0')
-            i = 0
-
-    for bit in stuffed:
         if bit == ' ':
-            output += bit
+            ones = 0
+            output.append(bit)
             continue
 
         # only toggle the state on '0'
         if bit == '0':
             state = toggle_state(state)
+            ones = 0
         elif bit == '1':
-            pass
+            ones += 1
         elif bit in "jk_":
             state = bit.upper()
+            ones = 0
         else:
             assert False, "Unknown bit %s in %r" % (bit, data)
 
-        output += (state * cycles)
+        output.append(state * cycles)
 
-    return output
+        # bit stuffing
+        if ones > 5:
+            state = toggle_state(state)
+            ones = 0
+            output.append(state * cycles)
+
+    return "".join(output)
 
 
 def sync():
@@ -174,7 +171,15 @@ def wrap_packet(data, cycles=4):
     >>> wrap_packet(data_packet(PID.DATA0, [0x1]), cycles=1)
     'KJKJKJKKKKJKJKKKKJKJKJKJJKJKJKJJJJJJJKKKJ__J'
 
+    Packed BitStream input stays packed, the result is a LineStream which is
+    only expanded to `cycles` samples per bit when iterated or printed.
+    >>> wrap_packet(BitStream.from_str(handshake_packet(PID.ACK)))
+    LineStream('KJKJKJKKJJKJJKKK__J', cycles=4)
     """
+    if isinstance(data, BitStream):
+        return wrap_bits(data, cycles)
+    if _is_bits(data):
+        return str(wrap_bits(BitStream.from_str(data), cycles))
     return nrzi(sync() + data + eop(), cycles)
 
 
@@ -287,6 +292,70 @@ def sof_packet(frame):
     return encode_pid(PID.SOF) + encode_data(data)
 
 
+# Wrapped (sync + nrzi + eop) wire patterns for the host side packets.  The
+# whole token space is only 3 PIDs x 128 addresses x 16 endpoints, so
+# repeated stimulus becomes a dictionary lookup.
+WIRE_CACHE_SIZE = 8192
+
+_sof_tables = {}
+
+
+@lru_cache(maxsize=WIRE_CACHE_SIZE)
+def wrap_token_packet(pid, addr, endp, cycles=4):
+    """Cached `wrap_packet(token_packet(pid, addr, endp), cycles)`.
+
+    >>> wrap_token_packet(PID.SETUP, 0, 0, 1) == wrap_packet(token_packet(PID.SETUP, 0, 0), 1)
+    True
+    >>> wrap_token_packet(PID.SETUP, 0, 0, 1) is wrap_token_packet(PID.SETUP, 0, 0, 1)
+    True
+    """
+    return wrap_packet(token_packet(pid, addr, endp), cycles)
+
+
+@lru_cache(maxsize=WIRE_CACHE_SIZE)
+def _wrap_sof_packet(frame, cycles):
+    return wrap_packet(sof_packet(frame), cycles)
+
+
+def wrap_sof_packet(frame, cycles=4):
+    """Cached `wrap_packet(sof_packet(frame), cycles)`.
+
+    Uses the table from `build_sof_table` if one was built for `cycles`.
+
+    >>> wrap_sof_packet(1429) == wrap_packet(sof_packet(1429))
+    True
+    """
+    table = _sof_tables.get(cycles, None)
+    if table is not None:
+        return table[frame]
+    return _wrap_sof_packet(frame, cycles)
+
+
+def build_sof_table(cycles=4):
+    """Eagerly wrap all 2048 SOF frames for `cycles`.
+
+    >>> len(build_sof_table(1))
+    2048
+    >>> wrap_sof_packet(2047, 1) is build_sof_table(1)[2047]
+    True
+    """
+    table = _sof_tables.get(cycles, None)
+    if table is None:
+        table = [wrap_packet(sof_packet(frame), cycles) for frame in range(2**11)]
+        _sof_tables[cycles] = table
+    return table
+
+
+@lru_cache(maxsize=WIRE_CACHE_SIZE)
+def wrap_handshake_packet(pid, cycles=4):
+    """Cached `wrap_packet(handshake_packet(pid), cycles)`.
+
+    >>> wrap_handshake_packet(PID.ACK, 1)
+    'KJKJKJKKJJKJJKKK__J'
+    """
+    return wrap_packet(handshake_packet(pid), cycles)
+
+
 def diff(value):
     """Convert J/K encoding into bits for P/N diff pair.
 
@@ -1,11 +1,19 @@
 #!/usr/bin/env python3
 
+from collections import deque
+from functools import lru_cache
+from io import StringIO
+from itertools import islice
+
 from .packet import *
 from ..pid import *
 
 
 def pp_packet(p, cycles=4):
-    """
+    """Annotate the wire level samples of a packet, one bit time per line.
+
+    See `pp_packet_stream` to write the output to a file instead.
+
     >>> print(pp_packet(wrap_packet(handshake_packet(PID.ACK), cycles=1), cycles=1))
     -
     K 1 Sync
@@ -302,9 +310,72 @@ def pp_packet(p, cycles=4):
     JJJJ END
 
     """
+    out = StringIO()
+    pp_packet_stream(p, out, cycles)
+    # Drop the final newline
+    return out.getvalue()[:-1]
+
+
+@lru_cache(maxsize=None)
+def _encoded_pids(cycles):
+    return {p.encode(cycles): p for p in PID}
+
+
+def _chunks(p, cycles):
+    """Split samples (a string or any iterable of characters) into bit times."""
+    if isinstance(p, str):
+        for i in range(0, len(p), cycles):
+            yield p[i:i+cycles]
+        return
+
+    it = iter(p)
+    while True:
+        chunk = "".join(islice(it, cycles))
+        if not chunk:
+            return
+        yield chunk
+
+
+def pp_packet_stream(p, out, cycles=4):
+    """Write the `pp_packet` annotation of `p` to the file like `out`.
+
+    `p` can be any iterable of samples, output is written as soon as each
+    line is known so large captures never have to be held in memory.  Only
+    the last 16 bit times of a DATA packet are buffered, as they can't be
+    labelled until it is known whether they are the CRC16.
+
+    >>> import sys
+    >>> pp_packet_stream(iter(wrap_packet(handshake_packet(PID.NAK), cycles=2)), sys.stdout, cycles=2)
+    --
+    KK 1 Sync
+    JJ 2 Sync
+    KK 3 Sync
+    JJ 4 Sync
+    KK 5 Sync
+    JJ 6 Sync
+    KK 7 Sync
+    KK 8 Sync
+    --
+    JJ 1 PID (PID.NAK)
+    JJ 2 PID
+    KK 3 PID
+    KK 4 PID
+    KK 5 PID
+    JJ 6 PID
+    JJ 7 PID
+    KK 8 PID
+    --
+    __ SE0
+    __ SE0
+    JJ END
+    """
+    # Lines waiting on a Data placeholder (None) before them are held back.
+    output = deque()
+    write = out.write
 
-    output = []
-    chunks = [p[i:i+cycles] for i in range(0, len(p), cycles)]
+    def flush():
+        while output and output[0] is not None:
+            write(output.popleft())
 
     class BitStuff:
         def __init__(self):
@@ -354,9 +425,7 @@ def pp_packet(p, cycles=4):
             self.pid_chunks = []
             self.type = None
 
-            self.encoded_pids = {}
-            for p in PID:
-                self.encoded_pids[p.encode(cycles)] = p
+            self.encoded_pids = _encoded_pids(cycles)
 
         def __call__(self, chunk):
             if self.done:
@@ -368,10 +437,11 @@ def pp_packet(p, cycles=4):
 
             self.done = True
             self.type = self.encoded_pids.get("".join(self.pid_chunks), 'ERROR')
+            name = self.type if self.type == 'ERROR' else 'PID.' + self.type.name
 
             for i, chunk in enumerate(self.pid_chunks):
                 if i == 0:
-                    output.extend([chunk, ' %i PID (%s)\n' % (1, self.type)])
+                    output.extend([chunk, ' %i PID (%s)\n' % (1, name)])
                 else:
                     output.extend([chunk, ' %i PID\n' % (i+1,)])
 
@@ -412,7 +482,7 @@ def pp_packet(p, cycles=4):
         def __init__(self, pid):
             self.done = False
             self.pid = pid
-            self.last16 = []
+            self.last16 = deque()
 
         def __call__(self, chunk):
             if self.pid.type not in (PID.DATA0, PID.DATA1):
@@ -422,7 +492,7 @@ def pp_packet(p, cycles=4):
             output.append(None)
 
             if len(self.last16) > 16:
-                self.patch(self.last16.pop(0)+'\n')
+                self.patch(self.last16.popleft()+'\n')
 
             return True
 
@@ -480,13 +550,13 @@ def pp_packet(p, cycles=4):
 
     class End:
         def __init__(self):
-            pass
+            self.last = False
 
         def __call__(self, chunk):
             if chunk == '_' * cycles:
                 output.extend([chunk, ' SE0\n'])
                 return True
-            if len(chunks) == 0:
+            if self.last:
                 output.extend([chunk, ' END\n'])
                 return True
             return False
@@ -497,18 +567,25 @@ def pp_packet(p, cycles=4):
     printers.append(Sync())
     pid_printer = Pid()
     printers.append(pid_printer)
-    printers.append(End())
+    end_printer = End()
+    printers.append(end_printer)
     printers.append(SOF(pid_printer))
     printers.append(Data(pid_printer))
     printers.append(Token(pid_printer))
 
-    while len(chunks) > 0:
-        chunk = chunks.pop(0)
+    # Look one chunk ahead, End needs to know which chunk is the last one.
+    chunks = _chunks(p, cycles)
+    chunk = next(chunks, None)
+    while chunk is not None:
+        following = next(chunks, None)
+        end_printer.last = following is None
         for printer in printers:
             if printer(chunk):
                 break
         else:
             output.extend([chunk, ' ERROR!\n'])
+        flush()
+        chunk = following
 
     for p in printers:
         if not hasattr(p, "finish"):
@@ -516,8 +593,7 @@ def pp_packet(p, cycles=4):
         p.finish()
 
     assert output.count(None) == 0, output
-    output[-1] = output[-1][:-1]
-    return "".join(output)
+    flush()
 
 
 if __name__ == "__main__":
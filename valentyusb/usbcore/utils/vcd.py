@@ -1,7 +1,15 @@
 #!/usr/bin/env python3
 
+import os
 import tempfile
 
+from collections import deque
+from fnmatch import fnmatchcase
+from io import StringIO
+
+from migen.fhdl.namer import build_namespace
+from migen.sim.vcd import VCDWriter, vcd_codes
+
 def write_gtkwave_file(vcd_filename):
 
     basename, ext = os.path.splitext(vcd_filename)
@@ -68,3 +76,184 @@ def add_vcd_timescale(filename, timescale=435):
     with open(filename, 'w') as f:
         f.write("$timescale %ips $end\n" % timescale)
         f.write(data)
+
+
+def read_vcd_samples(f, signals, period, offset=0):
+    """Stream the values of `signals` out of a VCD file.
+
+    Yields a tuple with the value of each signal for every `period` time
+    units starting at `offset`, using the values after all changes at or
+    before that time.  Only the current value of each signal is held, so
+    dumps of any size are read in one pass.  Signals are matched on their
+    name, optionally with the enclosing scopes joined by '.'.
+
+    >>> dump = [
+    ...     '$scope module top $end',
+    ...     '$var wire 1 ! usb_p $end',
+    ...     '$var wire 1 " usb_n $end',
+    ...     '$upscope $end',
+    ...     '$enddefinitions $end',
+    ...     '#0', '1!', '0"',
+    ...     '#20', '0!', '1"',
+    ...     '#30', '0!', '0"',
+    ...     '#40',
+    ... ]
+    >>> list(read_vcd_samples(dump, ("usb_p", "top.usb_n"), 10))
+    [(1, 0), (1, 0), (0, 1), (0, 0), (0, 0)]
+
+    The samples can be fed straight into `decoder.PacketDecoder`.
+    """
+    ids = {}
+    scope = []
+    values = [0] * len(signals)
+    next_sample = offset
+    now = 0
+
+    for line in f:
+        tokens = line.split()
+        if not tokens:
+            continue
+        head = tokens[0]
+        if head == "$scope":
+            scope.append(tokens[2])
+        elif head == "$upscope":
+            scope.pop()
+        elif head == "$var":
+            code, name = tokens[3], tokens[4]
+            full = ".".join(scope + [name])
+            for i, s in enumerate(signals):
+                if s == name or s == full or full.endswith("." + s):
+                    ids.setdefault(code, []).append(i)
+        elif head[0] == "#":
+            t = int(head[1:])
+            while next_sample < t:
+                yield tuple(values)
+                next_sample += period
+            now = t
+        elif head[0] in "01xzXZ" and len(tokens) == 1:
+            for i in ids.get(head[1:], ()):
+                values[i] = 1 if head[0] == "1" else 0
+        elif head[0] in "bB" and len(tokens) == 2:
+            for i in ids.get(tokens[1], ()):
+                bits = head[1:].replace("x", "0").replace("z", "0")
+                values[i] = int(bits, 2)
+
+    if next_sample <= now:
+        yield tuple(values)
+
+
+class RingVCDWriter(VCDWriter):
+    """VCD writer for migen's Simulator which only keeps the tail of a run.
+
+    The changes of the last `cycles` cycles of the fastest clock (two
+    simulator steps each) are held in memory, and nothing touches the disk
+    until `write` is called, typically once a test has failed.  `select`
+    limits the capture to signals whose names match one of a set of
+    fnmatch patterns.
+
+    >>> from migen import Signal
+    >>> a, b = Signal(name="a"), Signal(2, name="b")
+    >>> w = RingVCDWriter("unused.vcd", cycles=1)
+    >>> w.select([a, b], ["a"])
+    >>> for t in range(4):
+    ...     w.delay(1)
+    ...     w.set(a, t & 1)
+    ...     w.set(b, t)
+    >>> print(w.dumps())
+    $var wire 1 ! a $end
+    #2
+    $dumpvars
+    1!
+    $end
+    #3
+    0!
+    #4
+    1!
+    <BLANKLINE>
+    """
+
+    def __init__(self, filename, cycles=10000):
+        self.filename = filename
+        self.codegen = vcd_codes()
+        self.codes = dict()
+        self.signal_values = dict()
+        self.t = 0
+        self.names = None
+        self.selected = None
+        # Values as of the oldest step still held, and the steps themselves.
+        self.start_time = 0
+        self.start_values = dict()
+        self.steps = deque()
+        self.max_steps = 2*cycles
+
+    def select(self, signals, patterns=None):
+        """Name `signals` as in a full dump, capturing those matching `patterns`."""
+        signals = list(signals)
+        ns = build_namespace(signals)
+        self.names = {s: ns.get_name(s) for s in signals}
+        if patterns is not None:
+            self.selected = {
+                s for s, name in self.names.items()
+                if any(fnmatchcase(name, p) for p in patterns)}
+
+    def set(self, signal, value):
+        if self.selected is not None and signal not in self.selected:
+            return
+        if signal in self.signal_values and self.signal_values[signal] == value:
+            return
+        self.signal_values[signal] = value
+        if self.steps:
+            self.steps[-1][1].append((signal, value))
+        else:
+            self.start_values[signal] = value
+
+    def delay(self, delay):
+        self.t += delay
+        if len(self.steps) == self.max_steps:
+            self.start_time, changes = self.steps.popleft()
+            self.start_values.update(changes)
+        self.steps.append((self.t, []))
+
+    def close(self):
+        pass
+
+    def _write_value(self, f, signal, value):
+        if hasattr(signal, "_enumeration"):
+            self._write_enum_value(f, signal, value)
+        else:
+            self._write_primitive_value(f, signal, value)
+
+    def _write(self, f):
+        if self.names is None:
+            self.select(self.start_values.keys())
+        for signal in self.start_values:
+            if hasattr(signal, "_enumeration"):
+                size = max([len(v) for v in signal._enumeration.values()])*8
+            else:
+                size = len(signal)
+            f.write("$var wire {size} {code} {name} $end\n".format(
+                size=size, code=self._get_code(signal), name=self.names[signal]))
+        f.write("#{}\n$dumpvars\n".format(self.start_time))
+        for signal, value in self.start_values.items():
+            self._write_value(f, signal, value)
+        f.write("$end\n")
+        for t, changes in self.steps:
+            f.write("#{}\n".format(t))
+            for signal, value in changes:
+                self._write_value(f, signal, value)
+
+    def dumps(self):
+        """The captured tail of the run as VCD text."""
+        f = StringIO()
+        self._write(f)
+        return f.getvalue()
+
+    def write(self, filename=None):
+        """Write the captured tail of the run out as a VCD file."""
+        if filename is None:
+            filename = self.filename
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(filename, "w") as f:
+            self._write(f)
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""NumPy versions of the wire level helpers in utils/packet.py.
+
+Bits are uint8 arrays of 0 / 1, line states are uint8 arrays holding the
+same characters as the string representation ('J', 'K', '_' and 'E' for
+SE1), so they convert to and from the string helpers with no lookup tables.
+All functions work on whole arrays and are intended for long captures;
+`unstuff_chunks` and the `init` argument of the NRZI helpers let a capture
+too large to hold a few copies of be processed a chunk at a time.
+"""
+
+import numpy as np
+
+J = ord('J')
+K = ord('K')
+SE0 = ord('_')
+SE1 = ord('E')
+
+SYNC_BITS = np.array([0, 0, 0, 0, 0, 0, 0, 1], dtype=np.uint8)
+
+# Bits unstuffed at once by `unstuff`, bounds the size of its temporaries.
+CHUNK_BITS = 1 << 20
+
+
+def from_str(s):
+    """Convert a '0'/'1' or J/K/_ string into a uint8 array.
+
+    >>> from_str('0110')
+    array([0, 1, 1, 0], dtype=uint8)
+    >>> to_str(from_str('KJ_'))
+    'KJ_'
+    """
+    a = np.frombuffer(s.encode("ascii"), dtype=np.uint8)
+    if a.size and a.max() <= ord('1') and a.min() >= ord('0'):
+        return a - ord('0')
+    return a.copy()
+
+
+def to_str(a):
+    """Convert a bit or line state array back into the string format."""
+    a = np.asarray(a, dtype=np.uint8)
+    if a.size and a.max() <= 1:
+        a = a + ord('0')
+    return a.tobytes().decode("ascii")
+
+
+def _run_position(bits, run=0):
+    """1-based position of each bit within its run of ones (0 for zeros).
+
+    `run` is the number of ones just before `bits`, for a chunk that
+    continues a previous one.
+    """
+    bits = np.asarray(bits, dtype=np.uint8)
+    dtype = np.int32 if bits.size + run < 2**31 else np.int64
+    idx = np.arange(bits.size, dtype=dtype)
+    last_zero = np.maximum.accumulate(np.where(bits == 0, idx, dtype(-1 - run)))
+    return np.where(bits != 0, idx - last_zero, dtype(0))
+
+
+def bitstuff(bits):
+    """Insert a 0 after every run of six 1s.
+
+    >>> to_str(bitstuff(from_str('1111111111')))
+    '11111101111'
+    >>> to_str(bitstuff(from_str('1' * 13)))
+    '111111011111101'
+    """
+    bits = np.asarray(bits, dtype=np.uint8)
+    pos = _run_position(bits)
+    stuff = np.flatnonzero((pos != 0) & (pos % 6 == 0)) + 1
+    return np.insert(bits, stuff, 0)
+
+
+def unstuff(bits):
+    """Remove the bit following every run of six 1s.
+
+    Returns (bits, errors) where errors marks the positions (in the output)
+    after which a stuffed bit was expected to be 0 but was 1.
+
+    >>> b, err = unstuff(from_str('11111101111'))
+    >>> to_str(b), bool(err.any())
+    ('1111111111', False)
+    >>> b, err = unstuff(from_str('1111111'))
+    >>> to_str(b), np.flatnonzero(err)
+    ('111111', array([5]))
+    """
+    bits = np.asarray(bits, dtype=np.uint8)
+    chunks = (bits[i:i + CHUNK_BITS] for i in range(0, bits.size, CHUNK_BITS))
+    out = list(unstuff_chunks(chunks))
+    if not out:
+        return bits.copy(), np.zeros(0, dtype=bool)
+    return (np.concatenate([b for b, _ in out]),
+            np.concatenate([e for _, e in out]))
+
+
+def unstuff_chunks(chunks):
+    """`unstuff` a capture that arrives as an iterable of bit arrays.
+
+    Yields (bits, errors) for each chunk, which concatenate to the result of
+    `unstuff` on the whole capture.  The run of ones is carried from one
+    chunk to the next, and the last output bit of each chunk is held back
+    until the next one shows whether the stuffed bit after it was an error.
+    NRZI decode each chunk with `init` set to the last line state of the
+    previous one to keep that state as well.
+
+    >>> bits = from_str('1111110' + '1111111' + '11')
+    >>> out = list(unstuff_chunks([bits[:6], bits[6:7], bits[7:]]))
+    >>> to_str(np.concatenate([b for b, _ in out]))
+    '11111111111111'
+    >>> np.flatnonzero(np.concatenate([e for _, e in out]))
+    array([11])
+    """
+    run = 0
+    skip = False
+    held = None
+    for bits in chunks:
+        bits = np.asarray(bits, dtype=np.uint8)
+        if not bits.size:
+            continue
+        # A stuffed bit resets the run, so runs longer than six are only
+        # possible if the stuffed bit was an error; count every 7th bit of
+        # a run as a stuffed bit in that case.
+        pos = _run_position(bits, run)
+        sixth = np.flatnonzero((pos % 7 == 6) & (bits != 0))
+        stuffed = sixth + 1
+        stuffed = stuffed[stuffed < bits.size]
+        keep = np.ones(bits.size, dtype=bool)
+        keep[stuffed] = False
+        errors = np.zeros(bits.size, dtype=bool)
+        errors[stuffed - 1] = bits[stuffed] != 0
+
+        if skip:
+            # The stuffed bit for the end of the previous chunk.
+            keep[0] = False
+            held = (held[0], held[1] | (bits[0] != 0))
+        out_bits, out_errors = bits[keep], errors[keep]
+        if held is not None:
+            out_bits = np.concatenate(([held[0]], out_bits)).astype(np.uint8)
+            out_errors = np.concatenate(([held[1]], out_errors))
+        held = (out_bits[-1], out_errors[-1]) if out_bits.size else None
+        yield out_bits[:-1], out_errors[:-1]
+
+        skip = bool(sixth.size) and sixth[-1] == bits.size - 1
+        run = int(pos[-1]) % 7
+    if held is not None:
+        yield (np.array([held[0]], dtype=np.uint8),
+               np.array([held[1]], dtype=bool))
+
+
+def nrzi_encode(bits, init='J'):
+    """NRZI encode bits (no stuffing) into line states, a 0 toggles the line.
+
+    >>> to_str(nrzi_encode(from_str('1100000001')))
+    'JJKJKJKJKK'
+    """
+    bits = np.asarray(bits, dtype=np.uint8)
+    # Only the parity is used, so the sum can wrap.
+    toggles = np.cumsum(bits == 0, dtype=np.uint8) & 1
+    if init == 'K':
+        toggles ^= 1
+    return np.where(toggles == 0, J, K).astype(np.uint8)
+
+
+def nrzi_decode(states, init='J'):
+    """Decode line states (one per bit) into bits, 1 when the line holds.
+
+    >>> to_str(nrzi_decode(from_str('JJKJKJKJKK')))
+    '1100000001'
+    """
+    states = np.asarray(states, dtype=np.uint8)
+    previous = np.concatenate(([ord(init)], states[:-1])).astype(np.uint8)
+    return (states == previous).astype(np.uint8)
+
+
+def oversample(a, cycles):
+    """Repeat every element `cycles` times.
+
+    >>> to_str(oversample(from_str('KJ'), 3))
+    'KKKJJJ'
+    """
+    return np.repeat(np.asarray(a, dtype=np.uint8), cycles)
+
+
+def decimate(a, cycles, phase=None):
+    """Take one sample per bit time out of an oversampled array.
+
+    Samples from the middle of the bit time unless `phase` is given.
+
+    >>> to_str(decimate(from_str('KKKKJJJJ____'), 4))
+    'KJ_'
+    """
+    if phase is None:
+        phase = cycles // 2
+    return np.asarray(a, dtype=np.uint8)[phase::cycles]
+
+
+def nrzi(bits, cycles=4, init='J'):
+    """Bit stuff, NRZI encode and oversample, same as `packet.nrzi`.
+
+    >>> to_str(nrzi(from_str('1111111111'), 1))
+    'JJJJJJKKKKK'
+    >>> to_str(nrzi(from_str('101'), 4))
+    'JJJJKKKKKKKK'
+    """
+    return oversample(nrzi_encode(bitstuff(bits), init), cycles)
+
+
+def wrap_packet(bits, cycles=4):
+    """Add sync + eop and line encode a packet, same as `packet.wrap_packet`.
+
+    >>> to_str(wrap_packet(from_str('01001011'), cycles=1))
+    'KJKJKJKKJJKJJKKK__J'
+    """
+    body = nrzi_encode(bitstuff(bits), init='K')
+    sync = nrzi_encode(SYNC_BITS, init='J')
+    eop = np.array([SE0, SE0, J], dtype=np.uint8)
+    return oversample(np.concatenate((sync, body, eop)), cycles)
+
+
+def diff(states):
+    """Convert line states into (usbp, usbn) bit arrays.
+
+    >>> p, n = diff(from_str('KJKJKJKKJJKJJKKK__J'))
+    >>> to_str(p), to_str(n)
+    ('0101010011011000001', '1010101100100111000')
+    """
+    states = np.asarray(states, dtype=np.uint8)
+    bad = ~np.isin(states, (J, K, SE0, SE1))
+    assert not bad.any(), "Unknown value: %s" % chr(states[bad][0])
+    usbp = ((states == J) | (states == SE1)).astype(np.uint8)
+    usbn = ((states == K) | (states == SE1)).astype(np.uint8)
+    return usbp, usbn
+
+
+def undiff(usbp, usbn):
+    """Convert (usbp, usbn) bit arrays into line states.
+
+    >>> to_str(undiff(from_str('1100'), from_str('1010')))
+    'EJK_'
+    """
+    usbp = np.asarray(usbp, dtype=np.uint8)
+    usbn = np.asarray(usbn, dtype=np.uint8)
+    assert usbp.shape == usbn.shape, "Sequence different lengths!"
+    lookup = np.array([SE0, K, J, SE1], dtype=np.uint8)
+    return lookup[(usbp << 1) | usbn]
+
+
+def compare_with_reference(samples=200, seed=0):
+    """Check the vectorized helpers against the string implementations.
+
+    >>> compare_with_reference()
+    True
+    """
+    import random
+    from . import packet
+
+    rng = random.Random(seed)
+    for i in range(samples):
+        s = "".join(rng.choice("0111111") for i in range(rng.randrange(1, 200)))
+        cycles = rng.choice((1, 4, 5))
+        init = rng.choice("JK")
+
+        line = packet.nrzi(s, cycles, init)
+        if to_str(nrzi(from_str(s), cycles, init)) != line:
+            return False
+        if to_str(wrap_packet(from_str(s), cycles)) != packet.wrap_packet(s, cycles):
+            return False
+
+        usbp, usbn = packet.diff(line)
+        p, n = diff(from_str(line))
+        if (to_str(p), to_str(n)) != (usbp, usbn):
+            return False
+        if to_str(undiff(p, n)) != packet.undiff(usbp, usbn):
+            return False
+
+        stuffed = nrzi_decode(decimate(from_str(line), cycles), init)
+        unstuffed, errors = unstuff(stuffed)
+        if to_str(unstuffed) != s or errors.any():
+            return False
+        cut = rng.randrange(stuffed.size + 1)
+        out = list(unstuff_chunks([stuffed[:cut], stuffed[cut:]]))
+        if to_str(np.concatenate([b for b, _ in out])) != s:
+            return False
+    return True
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()